@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 from .get_secret import get_secret
 
@@ -9,13 +10,89 @@ class Settings(BaseSettings):
     LANGSMITH_PROJECT :str = "Wzgate Chatbot"
     LANGCHAIN_ENDPOINT :str = "https://api.smith.langchain.com"
     EMBEDDING_MODEL :str = "text-embedding-3-large"
+    # embedding backend: "openai", or "hash" for a local deterministic stand-in (tests and benchmarks)
+    EMBEDDING_BACKEND: str = "openai"
+    # concurrent embedding requests arriving within this window are sent as one batched API call
+    EMBEDDING_COALESCE_MS: float = 10
+    EMBEDDING_MAX_BATCH: int = 256
+    # embedding API calls in flight at once across the whole process
+    EMBEDDING_MAX_IN_FLIGHT: int = 4
+    # query embedding calls in flight at once, on their own lane beside the bulk (document) calls
+    EMBEDDING_QUERY_MAX_IN_FLIGHT: int = 4
+    # concurrent queries arriving within this (shorter) window are sent as one call of at most EMBEDDING_QUERY_MAX_BATCH
+    EMBEDDING_QUERY_COALESCE_MS: float = 2
+    EMBEDDING_QUERY_MAX_BATCH: int = 64
+    # retries of a failed (rate-limited, timed out, 5xx) embedding call, with jittered exponential backoff
+    EMBEDDING_MAX_RETRIES: int = 5
+    EMBEDDING_BACKOFF_SECONDS: float = 0.5
+    # rate-limited (429) attempts of one embedding call before it fails; they do not use up the retries above
+    EMBEDDING_MAX_RATE_LIMITED: int = 20
+    # the account's embedding rate limits (0 disables a limit) and the largest batch, in tokens, per call
+    EMBEDDING_REQUESTS_PER_MINUTE: int = 3000
+    EMBEDDING_TOKENS_PER_MINUTE: int = 1000000
+    EMBEDDING_MAX_BATCH_TOKENS: int = 100000
+    # index truncated, re-normalized embeddings of this size (e.g. 256 or 512); None indexes the full vectors
+    EMBEDDING_DIMENSIONS: Optional[int] = None
+    # first-pass candidates re-scored with the full-size vectors when EMBEDDING_DIMENSIONS is set
+    RESCORE_CANDIDATES: int = 50
+    # candidates fetched for local re-ranking and how many of them are passed to the LLM
+    RERANK_CANDIDATES: int = 50
+    RERANK_TOP_N: int = 5
+    # re-ranking score = semantic weight * cosine + lexical weight * question term overlap,
+    # minus the diversity penalty for every chunk already picked from the same source
+    RERANK_SEMANTIC_WEIGHT: float = 0.7
+    RERANK_LEXICAL_WEIGHT: float = 0.3
+    RERANK_DIVERSITY_PENALTY: float = 0.1
     LOG_LEVEL: str = 'INFO'
     MODEL_NAME: str = 'gpt-4o-mini'
     DOCUMENTS_JSON_PATH: str = "test_data.json"
     SOURCE_DATA: str = r"services/source_doc"
     FAISS_INDEX_PATH: str = SOURCE_DATA + "_faiss_index"
+    # on-disk cache of document embeddings by model and text hash; empty disables it
+    EMBEDDING_CACHE_PATH: str = SOURCE_DATA + "_embedding_cache"
     MIN_CHUNK_SIZE: int = 300
+    # worker processes parsing DOCX files (0: one per CPU) and files being ingested at once
+    INGEST_WORKERS: int = 0
+    INGEST_MAX_FILES_IN_FLIGHT: int = 16
+    # capacity of the queues between the streaming ingestion stages, and chunks embedded per pipeline batch
+    INGEST_QUEUE_SIZE: int = 64
+    INGEST_EMBED_BATCH: int = 256
+    # chunks at least this similar (estimated Jaccard of word 3-grams) to a kept chunk are dropped at ingestion; 0 disables
+    INGEST_DEDUP_THRESHOLD: float = 0.85
+    # parallel Drive downloads, bytes requested per download chunk and retries of a failed chunk
+    # (the chunk size is MediaIoBaseDownload's own default, kept as it was; only resuming is new)
+    DRIVE_DOWNLOAD_CONCURRENCY: int = 8
+    DRIVE_DOWNLOAD_CHUNK_BYTES: int = 100 * 1024 * 1024
+    DRIVE_DOWNLOAD_RETRIES: int = 5
+    # index chunks with vectors pooled from the chunker's sentence embeddings instead of embedding them again
+    EMBEDDING_POOLED_CHUNKS: bool = False
+    # fraction of pooled chunks re-embedded to measure their drift from real chunk embeddings
+    EMBEDDING_POOLED_VERIFY_SAMPLE: float = 0.05
     BREAKPOINT_THRESHOLD: float = 0.5
+    # FAISS index type: one of "Flat", "HNSW", "IVFFlat", "IVFPQ", "SQ8"
+    FAISS_INDEX_TYPE: str = "Flat"
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_IVF_NLIST: int = 256
+    FAISS_IVF_NPROBE: int = 16
+    FAISS_PQ_M: int = 64
+    FAISS_PQ_NBITS: int = 8
+    FAISS_TRAIN_SAMPLE_SIZE: int = 20000
+    # memory-map the saved index read-only on load instead of reading it into RAM
+    FAISS_MMAP: bool = True
+    # number of delta segments (one per update) after which a background compaction merges them
+    FAISS_MAX_DELTA_SEGMENTS: int = 8
+    # fraction of deleted (replaced or removed) rows after which a background compaction drops them
+    FAISS_MAX_DELETED_FRACTION: float = 0.2
+    # shard used by /upload and the Drive endpoint when none is given
+    DEFAULT_SHARD: str = "default"
+    # threads searching shards in parallel
+    SHARD_SEARCH_WORKERS: int = 8
+    # previous index versions kept after a full rebuild, for rollback
+    FAISS_KEEP_VERSIONS: int = 3
+    # sample chunks searched by their own vector to validate a rebuilt index before it is activated
+    FAISS_VALIDATION_QUERIES: int = 20
 
 
 settings = Settings()
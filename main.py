@@ -11,6 +11,8 @@ from core import settings
 from routers import user_memory_store, get_memory_key, chatbot_interface
 from routers import global_rag_chatbot
 from routers import initialize_rag
+from services import jobs, check_filter, StoreWriterError
+from services.semantic_chunking import shutdown_parse_pool
 
 # Define your API key (in production, load this securely from environment variables or a secrets vault)
 API_KEY = settings.APP_API_KEY
@@ -23,6 +25,8 @@ def verify_api_key(app_api_key: str = Header(...)):
         raise HTTPException(status_code=403, detail="Invalid API Key")
     return app_api_key
 
+WRITER_BUSY_DETAIL = "The index is being written by another process (another server worker); try again later."
+
 # Initialize the RAG chatbot
 async def initialize_chatbot():
     await initialize_rag()  
@@ -44,6 +48,14 @@ A list of messages. Each message is a dict with:
         default=False,
         description="Set to True if you want the endpoint to return the chat history in the response."
     )
+    filters: Optional[dict] = Field(
+        default=None,
+        description="""
+Optional metadata filters that restrict the documents searched by RAG, e.g. {"project": "marina", "language": "ar"}.
+Keys: **shard**, **source**, **filename**, **project**, **language**, **doc_type**; a value may be a string or a list of strings.
+Without **shard**, all shards are searched.
+"""
+    )
 
 class Message(BaseModel):
     role: str
@@ -80,6 +92,7 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown (optional)
     print("Shutting down...")
+    shutdown_parse_pool()
 
 # initialize the FastAPI app
 app = FastAPI(
@@ -122,6 +135,7 @@ async def chat_endpoint(request: ChatRequest, api_key: str = Depends(verify_api_
       - **role**: Must be either "user" or "ai".
       - **content**: The message text.
     - **return_history** (bool, optional): Set to True to include the updated chat history in the response.
+    - **filters** (dict, optional): Metadata filters for the documents searched by RAG.
 
       
     **Response:**
@@ -135,6 +149,10 @@ async def chat_endpoint(request: ChatRequest, api_key: str = Depends(verify_api_
         raise HTTPException(status_code=400, detail="Input message is required")
     if not request.user_id:
         raise HTTPException(status_code=400, detail="User ID is required")
+    try:
+        check_filter(request.filters, sharded=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     chat_key = get_memory_key(request.user_id, "chat_history")
     
@@ -157,7 +175,7 @@ async def chat_endpoint(request: ChatRequest, api_key: str = Depends(verify_api_
         user_memory_store.put(chat_key, chat_key, messages)
     
     try:
-        result = await chatbot_interface(request.input, request.user_id, request.chat_history or [])
+        result = await chatbot_interface(request.input, request.user_id, request.chat_history or [], request.filters)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat processing error: {e}")
     
@@ -174,15 +192,21 @@ async def chat_endpoint(request: ChatRequest, api_key: str = Depends(verify_api_
 
 # --- Endpoint 2: Upload DOCX File to Update Vector Store ---------------------------------------------------------------------
 @app.post("/upload", response_model=dict)
-async def upload_file(file: UploadFile = File(...), api_key: str = Depends(verify_api_key)):
+async def upload_file(file: UploadFile = File(...), project: Optional[str] = Form(None), doc_type: Optional[str] = Form(None),
+                      shard: Optional[str] = Form(None), api_key: str = Depends(verify_api_key)):
     """
     Updates the vector store using an uploaded DOCX file.
+    A file with the same name replaces the previous version; identical content is skipped.
 
     **Request:**
     - **file**: A DOCX file sent via form-data.
+    - **project** (optional): The project the document belongs to, usable as a chat filter.
+    - **doc_type** (optional): The document type (e.g. "price list", "brochure"), usable as a chat filter.
+    - **shard** (optional): The index shard to update (e.g. one per developer); created if it does not exist.
 
     **Response:**
     - **message**: A confirmation message.
+    - **shard**, **index_version**: The shard updated and its active index version (null when the file is unchanged).
 
     **Authentication:** Requires a valid API key in the 'x-api-key' header.
     """
@@ -201,8 +225,17 @@ async def upload_file(file: UploadFile = File(...), api_key: str = Depends(verif
             f.write(content)
         
         # Call the RAG subgraph function to update the vector store with the new DOCX.
-        await global_rag_chatbot.update_vector_store_with_docx(file_path)
-        response_message = f"FAISS index updated and saved to {settings.FAISS_INDEX_PATH}."
+        updated = await global_rag_chatbot.update_vector_store_with_docx(
+            file_path, source_name=file.filename, attributes={"project": project, "doc_type": doc_type}, shard=shard
+        )
+        if updated:
+            response_message = (f"FAISS index of shard {updated['shard']!r} updated "
+                                f"(index version {updated['index_version']}).")
+        else:
+            response_message = f"{file.filename} is unchanged, the FAISS index was not modified."
+            updated = {"shard": shard or settings.DEFAULT_SHARD, "index_version": None}
+    except StoreWriterError:
+        raise HTTPException(status_code=409, detail=WRITER_BUSY_DETAIL)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File processing error: {e}")
     finally:
@@ -210,7 +243,7 @@ async def upload_file(file: UploadFile = File(...), api_key: str = Depends(verif
         if os.path.exists(file_path):
             os.remove(file_path)
     
-    return JSONResponse(content={"message": response_message})
+    return JSONResponse(content={"message": response_message, **updated})
 
 # --- Endpoint 3: Get Vector Store File Info ---
 @app.get("/vector_store_info", response_model=dict)
@@ -219,29 +252,32 @@ async def get_vector_store_info(api_key: str = Depends(verify_api_key)):
     Retrieves information about the vector store.
 
     **Response:**
-    - **num_files**: Number of files in the vector store.
-    - **filenames**: A list of filenames in the vector store.
+    - **num_files**: Number of files (sources) in the vector store, the sum of the shards' num_files.
+    - **filenames**: The distinct display names of the files (their names up to the first ".").
+    - **files**: Per-file chunk count, token count, content hash, ingestion time and row-id ranges.
+    - **shards**: Per shard, the index version (incremented by every update), file count and chunk count.
 
     **Authentication:** Requires a valid API key in the 'x-api-key' header.
     
     """
     try:
-        num_files, filenames = await global_rag_chatbot.get_vector_store_file_info()
+        info = await global_rag_chatbot.get_vector_store_info()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving vector store info: {e}")
-    return JSONResponse(content={"num_files": num_files, "filenames": filenames})
+    return JSONResponse(content=info)
 
 
 # --- Endpoint 4: Create New Vector Store from Drive ---------------------------------------------------------------------
 
 @app.post("/create_vector_store_from_drive", response_model=dict)
-async def create_vector_store_from_drive(drive_link: str = Form(...), credentials_file: UploadFile = File(...), api_key: str = Depends(verify_api_key),background_tasks: BackgroundTasks = BackgroundTasks):
+async def create_vector_store_from_drive(drive_link: str = Form(...), credentials_file: UploadFile = File(...), shard: Optional[str] = Form(None), api_key: str = Depends(verify_api_key),background_tasks: BackgroundTasks = BackgroundTasks):
     """
     Creates a new vector store from files in a specified Google Drive folder.
 
     **Request (form-data):**
     - **drive_link**: A URL to the Google Drive folder.
     - **credentials_file**: A JSON file containing service account credentials.
+    - **shard** (optional): The index shard rebuilt from the folder (e.g. one per developer); other shards are not touched.
     
     **How to Create Your Credentials File for Google Drive:**
         1. **Go to the Google Cloud Console**  
@@ -257,33 +293,148 @@ async def create_vector_store_from_drive(drive_link: str = Form(...), credential
 
     **Response:**
     - **message**: A confirmation message indicating the creation of the new FAISS index.
+    - **job_id**: Poll /jobs/{job_id} for the progress and the result.
 
     **Authentication:** Requires a valid API key in the 'x-api-key' header.
     """
-    # Create a temporary directory to store the credentials file.
-    temp_dir = "temp_creds"
-    os.makedirs(temp_dir, exist_ok=True)
-    creds_file_name = f"{uuid.uuid4()}_{credentials_file.filename}"
-    creds_file_path = os.path.join(temp_dir, creds_file_name)
-    
     try:
-        with open(creds_file_path, "wb") as f:
-            content = await credentials_file.read()
-            f.write(content)
-        
-        # Call the function to create a new vector store from the drive.
-        # await global_rag_chatbot.create_new_vector_store_from_drive(drive_link, creds_file_path)
+        creds_file_path = await save_credentials_file(credentials_file)
+        job = jobs.create("drive_rebuild", drive_link=drive_link, shard=shard)
         # make it a background task to avoid timeout
         background_tasks.add_task(
-        global_rag_chatbot.create_new_vector_store_from_drive,
-        drive_link,
-        creds_file_path
+        jobs.run, job,
+        global_rag_chatbot.create_new_vector_store_from_drive(drive_link, creds_file_path, shard, job=job)
         )
-        response_message = "New FAISS index created from drive and saved."
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating new vector store: {e}")
     
-    return JSONResponse(content={"message": "Task scheduled. Processing in background."})
+    return JSONResponse(content={"message": "Task scheduled. Processing in background.", "job_id": job.id})
+
+
+async def save_credentials_file(credentials_file: UploadFile) -> str:
+    """Store an uploaded credentials file in a temporary directory and return its path."""
+    temp_dir = "temp_creds"
+    os.makedirs(temp_dir, exist_ok=True)
+    creds_file_name = f"{uuid.uuid4()}_{credentials_file.filename}"
+    creds_file_path = os.path.join(temp_dir, creds_file_name)
+    with open(creds_file_path, "wb") as f:
+        content = await credentials_file.read()
+        f.write(content)
+    return creds_file_path
+
+# --- Endpoint 4b: Sync a Shard with a Drive Folder ---------------------------------------------------------------------
+@app.post("/sync_drive", response_model=dict)
+async def sync_drive(drive_link: str = Form(...), credentials_file: UploadFile = File(...), shard: Optional[str] = Form(None),
+                     api_key: str = Depends(verify_api_key), background_tasks: BackgroundTasks = BackgroundTasks):
+    """
+    Brings a shard up to date with a Google Drive folder: only new or changed files are downloaded and
+    re-embedded, and the chunks of files deleted from the folder are removed (a missing shard is built).
+
+    **Request (form-data):**
+    - **drive_link**: A URL to the Google Drive folder.
+    - **credentials_file**: A JSON file containing service account credentials (see /create_vector_store_from_drive).
+    - **shard** (optional): The shard synced with the folder (the default shard if omitted).
+
+    **Response:**
+    - **job_id**: Poll /jobs/{job_id} for the progress and the numbers of added, changed, removed and unchanged files.
+
+    **Authentication:** Requires a valid API key in the 'x-api-key' header.
+    """
+    try:
+        # a sync writes into the shard's active index: refuse it now rather than fail the job
+        global_rag_chatbot.check_writable(shard)
+        creds_file_path = await save_credentials_file(credentials_file)
+        job = jobs.create("drive_sync", drive_link=drive_link, shard=shard)
+        background_tasks.add_task(
+            jobs.run, job, global_rag_chatbot.sync_drive_folder(drive_link, creds_file_path, shard, job=job))
+    except StoreWriterError:
+        raise HTTPException(status_code=409, detail=WRITER_BUSY_DETAIL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error scheduling the Drive sync: {e}")
+    return JSONResponse(content={"message": "Sync scheduled. Processing in background.", "job_id": job.id})
+
+# --- Endpoint 4c: Background Job Status ---------------------------------------------------------------------
+@app.get("/jobs/{job_id}", response_model=dict)
+async def get_job(job_id: str, api_key: str = Depends(verify_api_key)):
+    """
+    Returns the status ("pending", "running", "succeeded" or "failed"), progress, result or error of a background job.
+
+    **Authentication:** Requires a valid API key in the 'x-api-key' header.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return JSONResponse(content=job.to_dict())
+
+# --- Endpoint 5: Delete a Document from the Vector Store ---------------------------------------------------------------------
+@app.delete("/documents/{filename}", response_model=dict)
+async def delete_document(filename: str, shard: Optional[str] = Query(None), api_key: str = Depends(verify_api_key)):
+    """
+    Removes every chunk of a file from the vector store.
+
+    **Request:**
+    - **filename**: The uploaded file name (e.g. "prices.docx") or its name without extension.
+    - **shard** (query, optional): Only delete from this shard; by default every shard is checked.
+
+    **Response:**
+    - **message**: A confirmation message.
+    - **removed_chunks**: Number of chunks removed.
+
+    **Authentication:** Requires a valid API key in the 'x-api-key' header.
+    """
+    try:
+        removed = await global_rag_chatbot.delete_document(filename, shard)
+    except StoreWriterError:
+        raise HTTPException(status_code=409, detail=WRITER_BUSY_DETAIL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {e}")
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"{filename} is not in the vector store.")
+    return JSONResponse(content={"message": f"{filename} removed from the FAISS index.", "removed_chunks": removed})
+
+# --- Endpoint 6: List Index Versions (admin) ---------------------------------------------------------------------
+@app.get("/admin/index_versions", response_model=dict)
+async def list_index_versions(shard: Optional[str] = Query(None), api_key: str = Depends(verify_api_key)):
+    """
+    Lists the FAISS index versions of a shard kept on disk (the active one and the ones available for rollback).
+
+    **Request:**
+    - **shard** (query, optional): The shard (the default shard if omitted).
+
+    **Response:**
+    - **versions**: A list of {"version", "active"} entries, oldest first.
+
+    **Authentication:** Requires a valid API key in the 'x-api-key' header.
+    """
+    try:
+        versions = await global_rag_chatbot.list_index_versions(shard)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing index versions: {e}")
+    return JSONResponse(content={"versions": versions})
+
+# --- Endpoint 7: Roll Back the Index (admin) ---------------------------------------------------------------------
+@app.post("/admin/rollback_index", response_model=dict)
+async def rollback_index(version: Optional[str] = Form(None), shard: Optional[str] = Form(None),
+                         api_key: str = Depends(verify_api_key)):
+    """
+    Switches a shard back to an earlier FAISS index version.
+
+    **Request (form-data):**
+    - **version** (optional): The version to activate (see /admin/index_versions); defaults to the previous one.
+    - **shard** (optional): The shard to roll back (the default shard if omitted).
+
+    **Response:**
+    - **message**: A confirmation message with the active version.
+
+    **Authentication:** Requires a valid API key in the 'x-api-key' header.
+    """
+    try:
+        active = await global_rag_chatbot.rollback_index(version, shard)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rolling back the index: {e}")
+    return JSONResponse(content={"message": f"FAISS index version {active} is now active."})
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=80)
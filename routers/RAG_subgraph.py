@@ -12,89 +12,26 @@ from langchain_openai.chat_models import ChatOpenAI
 from core import settings
 import tempfile
 import os
-import io
-import re
-import shutil
 from services import SemanticChunkingService
-from services import FAISSIndexService
+from services import ShardManager
+from services import Reranker
 from format import  get_system_prompt_rag, get_redefined_question_prompt 
 from langchain.docstore.document import Document
 from typing import Optional
 from langchain_core.messages import HumanMessage, AIMessage
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from services.drive_sync import GoogleDriveClient, DriveManifest, Downloader, folder_id_from_link, plan_sync, \
+    recorded_source, download_files
 
 
-async def download_docx_files_from_drive(
-    drive_link: str, 
-    credentials_file: str, 
-    download_dir: str = None
-) -> List[str]:
-    """
-    Asynchronously downloads all DOCX files from a Google Drive folder.
-    
-    Parameters:
-        drive_link (str): Google Drive folder URL (e.g., 
-            "https://drive.google.com/drive/folders/<folder_id>").
-        credentials_file (str): Path to your service account credentials JSON file.
-        download_dir (str, optional): Local directory where files will be saved.
-            If None, a temporary directory is created.
-    
-    Returns:
-        List[str]: A list of local file paths for the downloaded DOCX files.
-    """
-    
-    def sync_download() -> List[str]:
-        match = re.search(r'folders/([a-zA-Z0-9_-]+)', drive_link)
-        if not match:
-            raise ValueError("Invalid drive folder link format.")
-        folder_id = match.group(1)
-        
-        local_dir = download_dir or tempfile.mkdtemp()
-        
-        # Set up credentials and build the Drive service.
-        scopes = ['https://www.googleapis.com/auth/drive.readonly']
-        creds = Credentials.from_service_account_file(credentials_file, scopes=scopes)
-        service = build('drive', 'v3', credentials=creds)
-        
-        # Query for DOCX files in the folder.
-        query = (
-            f"'{folder_id}' in parents and "
-            "mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document'"
-        )
-        results = service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get('files', [])
-        
-        downloaded_paths = []
-        for file in files:
-            file_id = file.get('id')
-            file_name = file.get('name')
-            local_path = os.path.join(local_dir, file_name)
-            
-            request = service.files().get_media(fileId=file_id)
-            with io.FileIO(local_path, 'wb') as fh:
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()
-                    print(f"Downloading {file_name}: {int(status.progress() * 100)}%.")
-            
-            downloaded_paths.append(local_path)
-        
-        return downloaded_paths
-
-    # Offload the synchronous download operation to a separate thread.
-    return await asyncio.to_thread(sync_download)
-
 # ------- RAGChatbot Class (for setup and chain creation)
 # --------------------------------------------------------------------------
 
 class RAGChatbot:
     def __init__(self):
-        # Initialize the semantic chunking and FAISS services.
+        # Initialize the semantic chunking service and the FAISS index services (one per shard).
         self.semantic_service = SemanticChunkingService()
-        self.faiss_service = FAISSIndexService()
+        self.shards = ShardManager()
+        self.reranker = Reranker()
         
         # Initialize the LLM models for the RAG chatbot.
         self.llm = ChatOpenAI(
@@ -107,109 +44,239 @@ class RAGChatbot:
             openai_api_key=settings.OPENAI_API_KEY,
             temperature=0.2
         )
+        # a view searching all loaded shards; replaced whenever a shard is built, rolled back or added
         self.vector_store = None
 
+    def _refresh_vector_store(self):
+        self.vector_store = self.shards.vector_store()
+
 
     async def setup(self, directory_path: str):
-        """Process documents, create/load the FAISS index, and initialize retrieval."""
+        """Process documents, create/load the FAISS indexes of all shards, and initialize retrieval."""
         import os
 
-        if not os.path.exists(settings.FAISS_INDEX_PATH):
+        if not await asyncio.to_thread(self.shards.load_all):
             print("🔍 Creating FAISS index...")
-            documents = await self.semantic_service.process_directory(directory_path)
-            print(f"📄 Processed {len(documents)} documents.")
-            if not documents:
+            # parse, chunk, embed and index the files as a stream; the index can later be rebuilt from
+            # its own chunks without re-parsing (python -m services.chunk_manifest)
+            store = await self.shards.service(settings.DEFAULT_SHARD).build_from_files(
+                self.semantic_service.list_docx_files(directory_path), self.semantic_service)
+            if store is None:
                 print("❌ No documents found! Check your directory path.")
                 return
-            self.semantic_service.save_documents_to_json(documents, directory_path + ".json")
-            await self.faiss_service.create_faiss_index(documents)
-            self.vector_store = self.faiss_service.vector_store
-
+            print(f"📄 Processed {store.ntotal} documents.")
 
         else:
-            print("📥 Loading FAISS index...")
-            self.vector_store = self.faiss_service.load_index()
+            print("📥 Loaded FAISS index shards.")
 
+        self._refresh_vector_store()
         print("✅ FAISS index ready.")
 
-    async def update_vector_store_with_docx(self,file_path: str):
+    async def update_vector_store_with_docx(self,file_path: str, source_name: Optional[str] = None,
+                                            attributes: Optional[dict] = None, shard: Optional[str] = None) -> Optional[dict]:
+        """
+        Upsert a DOCX file into a shard (settings.DEFAULT_SHARD by default; a new shard is built from it):
+        the chunks of a previous version of the same file are replaced.
+        attributes (project, doc_type) are stored with its chunks and can be used as search filters.
+        Returns the shard and its active index version, or None (without chunking or embedding anything)
+        when its content and attributes are unchanged.
+        """
+        service = self.shards.service(shard)
+        store = service.vector_store
+        source = source_name or os.path.basename(file_path)
+        attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+        parsed = await self.semantic_service.aparse_file(file_path)
+        entry = store.catalog.get(source) if store is not None else None
+        if entry is not None and entry["content_hash"] == parsed["content_hash"] and \
+                all(entry["attributes"].get(key) == value for key, value in attributes.items()):
+            print(f"{source} is unchanged, skipping it.")
+            return None
+
         # Process the DOCX file asynchronously to produce Document objects.
-            new_documents = await asyncio.to_thread(self.semantic_service.process_file, file_path)
-            
-            print(" 📩 Updating existing FAISS index with new document...")
-            texts = [doc.page_content for doc in new_documents]
-            metadatas = [doc.metadata for doc in new_documents]
-            await self.vector_store.aadd_texts(texts, metadatas=metadatas)
-            self.vector_store.save_local(settings.FAISS_INDEX_PATH)
-            print(f"FAISS index updated and saved to {settings.FAISS_INDEX_PATH}.")    
-
-    async def get_vector_store_file_info(self) -> tuple[int, list[str]]:
+        new_documents = await self.semantic_service.achunk_parsed(parsed, source, attributes)
+
+        if store is None:
+            print(f" 📩 Creating shard {service.shard!r} from the new document...")
+            await service.create_faiss_index(new_documents)
+            self._refresh_vector_store()
+            return {"shard": service.shard, "index_version": service.versions.current()}
+
+        print(f" 📩 Updating FAISS index shard {service.shard!r} with new document...")
+        texts = [doc.page_content for doc in new_documents]
+        metadatas = [doc.metadata for doc in new_documents]
+        # the new chunks are persisted as a delta segment, no full save is needed
+        await store.aupsert_texts(source, texts, metadatas=metadatas)
+        print(f"FAISS index updated and saved to {store.folder_path}.")
+        return {"shard": service.shard, "index_version": service.versions.current()}
+
+    async def delete_document(self, filename: str, shard: Optional[str] = None) -> int:
+        """
+        Remove a file from the vector store (from one shard, or from every shard that has it),
+        by its file name ("prices.docx") or display name ("prices").
+        Returns the number of chunks removed.
         """
-        function to get the number of unique files in the vector store and their filenames.
-        Returns:
-        Count the unique files in the vector store and return a tuple:
-        (number_of_unique_files, list_of_file_names)
-        based on the 'filename' key in each document's metadata.
+        stores = self.shards.stores()
+        if shard is not None:
+            stores = {shard: stores[shard]} if shard in stores else {}
+        removed = 0
+        for store in stores.values():
+            catalog = store.catalog
+            sources = [filename] if catalog.get(filename) else \
+                [entry["source"] for entry in catalog.sources() if entry["filename"] == filename]
+            for source in sources:
+                removed += await asyncio.to_thread(store.delete_source, source)
+        print(f"Removed {removed} chunks of {filename} from the FAISS index.")
+        return removed
+
+    async def get_vector_store_info(self) -> dict:
+        """
+        function to describe the vector store from the source catalogs of its shards, without scanning the chunks.
+        Returns a dict with the number of files (sources, as in every shard's num_files), their display names, per-file stats
+        (shard, chunk count, token count, content hash, ingestion time, row-id ranges)
+        and the index version of every shard.
         """
         if self.vector_store is None:
             print("Vector store is not initialized.")
-            return 0, []
-        
-        try:
-            docs = await asyncio.to_thread(lambda: list(self.vector_store.docstore._dict.values()))
-        except AttributeError:
-            print("Vector store does not expose a 'docstore' attribute.")
-            return 0, []
-        
-        filenames = []
-        for doc in docs:
-            metadata = getattr(doc, "metadata", {})
-            if "filename" in metadata:
-                filenames.append(metadata["filename"])
-        
-        unique_filenames = list(set(filenames))
-        return len(unique_filenames), unique_filenames
+            return {"num_files": 0, "filenames": [], "files": [], "shards": {}}
+
+        files, shards = [], {}
+        for name, store in self.shards.stores().items():
+            shard_files = await asyncio.to_thread(store.catalog.sources)
+            files += [{"shard": name, **entry} for entry in shard_files]
+            # live chunks only: rows of deleted or replaced files stay in the index until the next compaction
+            shards[name] = {"index_version": store.version, "num_files": len(shard_files),
+                            "num_chunks": sum(entry["chunk_count"] for entry in shard_files)}
+        filenames = sorted({entry["filename"] for entry in files})
+        return {"num_files": len(files), "filenames": filenames, "files": files, "shards": shards}
     
     
-    async def create_new_vector_store_from_drive(self, drive_link: str, credentials_file: str):
+    async def create_new_vector_store_from_drive(self, drive_link: str, credentials_file: Optional[str] = None,
+                                                 shard: Optional[str] = None, client=None, job=None):
         """
-        function to create a new vector store from the files in the Google Drive folder specified by the drive_link.
+        function to create a new vector store shard from the files in the Google Drive folder specified by the drive_link.
         Asynchronously downloads DOCX files from the provided Google Drive folder link,
-        processes each file to perform semantic chunking, deletes any existing FAISS index,
-        and then creates a completely new FAISS vector store from the processed documents.
+        processes each file to perform semantic chunking, and then creates a completely new
+        FAISS index version of the shard from the processed documents, which replaces the current one
+        only once it has been validated. Other shards are not touched.
+        The Drive manifest saved with the new version lets later syncs (sync_drive_folder) be incremental.
         
         Parameters:
             drive_link (str): The URL of the Google Drive folder.
             credentials_file (str): Path to your service account credentials JSON file.
+            shard (str, optional): The shard to rebuild (settings.DEFAULT_SHARD by default).
+            client (optional): A Drive client to use instead of Google Drive (e.g. LocalDriveClient).
+            job (Job, optional): Receives the progress.
         """
-        #Download DOCX files from the drive.
-        docx_paths = await download_docx_files_from_drive(drive_link, credentials_file)
-        if not docx_paths:
+        service = self.shards.service(shard)
+        client = client or GoogleDriveClient(credentials_file)
+        folder_id = folder_id_from_link(drive_link)
+        listing = await asyncio.to_thread(client.list_files, folder_id)
+        if job is not None:
+            job.update(files=len(listing), total_bytes=sum(int(file.get("size", 0)) for file in listing))
+        if not listing:
             print("No DOCX files found at the provided drive link.")
-            return
-
-        #Process each DOCX file concurrently (perform semantic chunking service)
-        tasks = [
-            asyncio.to_thread(self.semantic_service.process_file, file_path)
-            for file_path in docx_paths
-        ]
-        results = await asyncio.gather(*tasks)
-        # Flatten the list of lists into one list of Document objects
-        new_documents = [doc for docs in results for doc in docs]
-        if not new_documents:
+            return {"files": 0, "chunks": 0, "index_version": None}
+
+        # the chunks of every file are stored under its name, qualified with its id when names repeat
+        plan_sync({}, listing)
+        with tempfile.TemporaryDirectory() as download_dir:
+            #Download the DOCX files from the drive.
+            docx_paths = await download_files(client, listing, download_dir, job)
+            # Stream the files through parsing, semantic chunking and embedding into a new FAISS index
+            # version; the current index keeps serving until the new one is validated and activated,
+            # and is kept for rollback.
+            store = await service.build_from_files(docx_paths, self.semantic_service, job=job,
+                                                   sources=[file["source"] for file in listing])
+        if store is None:
             print("No documents were processed from the downloaded files.")
-            return
+            return {"files": len(listing), "chunks": 0, "index_version": None}
 
-        # Delete any existing FAISS index folder to start fresh
-        if os.path.exists(settings.FAISS_INDEX_PATH):
-            shutil.rmtree(settings.FAISS_INDEX_PATH)
-            print(f"Deleted existing FAISS index at {settings.FAISS_INDEX_PATH}.")
+        manifest = DriveManifest(service.vector_store.folder_path)
+        manifest.folder_id, manifest.files = folder_id, {file["id"]: file for file in listing}
+        manifest.save()
+        self._refresh_vector_store()
+        print(f"New FAISS index created for shard {service.shard!r}.")
+        return {"files": len(listing), "chunks": store.ntotal, "index_version": service.versions.current()}
+
+    async def sync_drive_folder(self, drive_link: str, credentials_file: Optional[str] = None,
+                                shard: Optional[str] = None, client=None, job=None) -> dict:
+        """
+        function to bring a shard up to date with a Google Drive folder without rebuilding it:
+        only new or changed files (by md5Checksum / modifiedTime against the shard's Drive manifest) are
+        downloaded and re-embedded, and the chunks of files deleted from the folder are removed.
+        A shard that does not exist yet is built from the whole folder (all its files are "added").
+        Returns the number of added, changed, removed and unchanged files, and the index version served.
+        """
+        service = self.shards.service(shard)
+        store = service.vector_store
+        if store is None:
+            result = await self.create_new_vector_store_from_drive(drive_link, credentials_file, shard, client, job)
+            return {"added": result["files"], "changed": 0, "removed": 0, "unchanged": 0,
+                    "index_version": result["index_version"]}
+        client = client or GoogleDriveClient(credentials_file)
+        folder_id = folder_id_from_link(drive_link)
+        listing = await asyncio.to_thread(client.list_files, folder_id)
+        manifest = DriveManifest(store.folder_path)
+        plan = plan_sync(manifest.files, listing)
+        summary = {kind: len(files) for kind, files in plan.items()}
+        print(f"Syncing shard {service.shard!r} with Drive folder {folder_id}: {summary}.")
+        if job is not None:
+            job.update(**summary, total_bytes=sum(int(file.get("size", 0)) for file in plan["added"] + plan["changed"]))
+        manifest.folder_id = folder_id
+
+        try:
+            # removed files, and the previous sources of renamed ones
+            for file in plan["removed"] + [file for file in plan["changed"]
+                                           if recorded_source(manifest.files[file["id"]]) != file["source"]]:
+                await asyncio.to_thread(store.delete_source, recorded_source(manifest.files[file["id"]]))
+                manifest.files.pop(file["id"])
+
+            limit = asyncio.Semaphore(settings.INGEST_MAX_FILES_IN_FLIGHT)
+            with tempfile.TemporaryDirectory() as download_dir:
+                downloader = Downloader(client, download_dir, job)
+
+                async def ingest(file):
+                    async with limit:
+                        path = await downloader.download(file)
+                        await self.update_vector_store_with_docx(path, source_name=file["source"], shard=service.shard)
+                        os.remove(path)
+                        manifest.files[file["id"]] = file
+                        if job is not None:
+                            job.increment("ingested")
+
+                # a failure cancels the other files before the download directory is removed
+                try:
+                    async with asyncio.TaskGroup() as group:
+                        for file in plan["added"] + plan["changed"]:
+                            group.create_task(ingest(file))
+                except ExceptionGroup as errors:
+                    raise errors.exceptions[0]
+        finally:
+            # files ingested before a failure are not downloaded again by the next sync
+            manifest.save()
+            self._refresh_vector_store()
+        return {**summary, "index_version": service.versions.current()}
+
+    def check_writable(self, shard: Optional[str] = None):
+        """Raise StoreWriterError when another process writes to the shard's index (a new shard is writable)."""
+        store = self.shards.store(shard)
+        if store is not None:
+            store.claim_writer()
+
+    async def rollback_index(self, version: Optional[str] = None, shard: Optional[str] = None) -> str:
+        """
+        function to switch a shard back to an earlier index version (by default the previous one).
+        Returns the name of the version now being served.
+        """
+        service = self.shards.service(shard)
+        await asyncio.to_thread(service.rollback, version)
+        self._refresh_vector_store()
+        return service.versions.current()
+
+    async def list_index_versions(self, shard: Optional[str] = None) -> list:
+        """function to list the kept index versions of a shard, oldest first, with the active one flagged."""
+        return await asyncio.to_thread(self.shards.service(shard).list_versions)
 
-        #Create a new FAISS index using the processed documents
-        await self.faiss_service.create_faiss_index(new_documents)
-        self.vector_store = self.faiss_service.vector_store
-        print(f"New FAISS index created and saved to {settings.FAISS_INDEX_PATH}.")
-        
 
 # Initialize the global RAG chatbot instance.
 global_rag_chatbot = RAGChatbot()
@@ -220,6 +287,7 @@ class RAGChatbotState(TypedDict):
     question: str
     redifined_question: str | None
     context: List[Document]  # List of retrieved Document objects.
+    filters: dict | None  # Optional metadata filters for retrieval, e.g. {"project": "..."}.
     answer: str | None
     chat_history: list   # General conversation history
     rag_chat_history: list    # RAG-specific conversation history 
@@ -262,6 +330,7 @@ async def retrieve_context(state: RAGChatbotState) -> RAGChatbotState:
     """
     Function to retrieve context from the FAISS vector store using a refined query that is
     generated based on both the current question and the conversation history.
+    The top RERANK_CANDIDATES hits are re-ranked locally and the best RERANK_TOP_N are kept.
     """
     if "rag_chat_history" not in state:
         state["rag_chat_history"] = []  
@@ -275,8 +344,15 @@ async def retrieve_context(state: RAGChatbotState) -> RAGChatbotState:
         # First, generate a refined retrieval query based on the conversation history.
         refined_query = await generate_context_query(state)
                 
-        # Use the refined query to search the vector store.
-        docs_retrieved = global_rag_chatbot.vector_store.similarity_search(refined_query, k=10)
+        # Fetch a wide candidate set from the vector store (a pinned snapshot, so concurrent uploads don't interfere)
+        # and re-rank it locally so only the best few chunks go into the prompt.
+        vector_store = global_rag_chatbot.vector_store
+        query_vector = await vector_store.embedding.aembed_query(refined_query)
+        # the FAISS search and chunk store reads block: run them off the event loop
+        docs, vectors, distances = await asyncio.to_thread(vector_store.candidates_by_vector, query_vector,
+                                                           settings.RERANK_CANDIDATES, state.get("filters"))
+        docs_retrieved = global_rag_chatbot.reranker.rerank(query_vector, docs, vectors, distances,
+                                                            [refined_query, state["question"]])
         
         # Update the state with the retrieved context.
         state["context"] = docs_retrieved
@@ -287,6 +363,17 @@ async def retrieve_context(state: RAGChatbotState) -> RAGChatbotState:
     return state
 
 
+def format_context_doc(doc: Document) -> str:
+    """
+    The text of a retrieved chunk for the prompt. A chunk kept for several files (see services/dedup)
+    is preceded by all of their names, so the answer can name every brochure it applies to.
+    """
+    sources = doc.metadata.get("sources") or []
+    if len(sources) < 2:
+        return doc.page_content
+    return f"(from {', '.join(sources)})\n{doc.page_content}"
+
+
 # Node: generate answer
 # --- Define the RAG Subgraph Nodes ---
 async def generate_answer(state: RAGChatbotState) -> RAGChatbotState:
@@ -296,7 +383,7 @@ async def generate_answer(state: RAGChatbotState) -> RAGChatbotState:
     The answer is stored in the 'answer' field and also as 'bot_response'.
     """
     if state.get("context"):
-        docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+        docs_content = "\n\n".join(format_context_doc(doc) for doc in state["context"])
     else:
         docs_content = "No context was retrieved."
 
@@ -352,7 +439,8 @@ class RAGChatbotGraph:
         return final_state
 
 # --- RAG Interface ---
-async def rag_interface(question: str, user_id: str, history: Optional[List[dict]] = None) -> dict:
+async def rag_interface(question: str, user_id: str, history: Optional[List[dict]] = None,
+                        filters: Optional[dict] = None) -> dict:
     from main_graph import user_memory_store, get_memory_key
 
     # Build unique keys for chat history and rag-specific history.
@@ -377,6 +465,7 @@ async def rag_interface(question: str, user_id: str, history: Optional[List[dict
         "question": question,
         "redifined_question": None,
         "context": [],
+        "filters": filters,
         "answer": None,
         "chat_history": chat_history,
         "rag_chat_history": rag_chat_history,
@@ -398,8 +487,9 @@ async def rag_interface(question: str, user_id: str, history: Optional[List[dict
     }
 
 # --- RAG Interface (Synchronous Wrapper) ---
-def sync_rag_interface(question: str, user_id: str, history: Optional[List[dict]] = None):
-    return asyncio.run(rag_interface(question, user_id, history))
+def sync_rag_interface(question: str, user_id: str, history: Optional[List[dict]] = None,
+                       filters: Optional[dict] = None):
+    return asyncio.run(rag_interface(question, user_id, history, filters))
     
 # --- Initialize the RAG Chatbot ---
 async def initialize_chatbot():
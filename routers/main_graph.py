@@ -50,6 +50,7 @@ class ChatbotState(TypedDict, total=False):
     rag_chat_history: List      # list of messages (HumanMessage, AIMessage, etc.)
     units_chat_history: List    # list of messages (HumanMessage, AIMessage, etc.)
     lang: str                   # This key is needed by the Units and RAG adapters.
+    filters: dict | None        # Optional metadata filters passed to RAG retrieval.
 
 
 # Create a classifier LLM and prompt for routing.
@@ -111,6 +112,7 @@ def rag_adapter(state: ChatbotState) -> RAGChatbotState:
     return {
         "question": state["user_input"],
         "context": [],
+        "filters": state.get("filters"),
         "answer": None,
         "chat_history": state["chat_history"],
         "rag_chat_history":state["rag_chat_history"],  # Passing the shared MemorySaver
@@ -197,12 +199,13 @@ rag_class= RAGChatbot()
 # compiled_parent.get_graph(xray=1).draw_mermaid_png(output_file_path="main_graph_final.png")
 
 # Define the chatbot interface.
-async def chatbot_interface(input_text: str, user_id: str, history: list = None) -> dict:
+async def chatbot_interface(input_text: str, user_id: str, history: list = None, filters: dict = None) -> dict:
     """
     this function is the main interface for the chatbot
     input_text: the user input
     user_id: the user id
     history: the chat history
+    filters: optional metadata filters for RAG retrieval (source, filename, project, language, doc_type)
     
     return: the chatbot response
     """
@@ -240,6 +243,7 @@ async def chatbot_interface(input_text: str, user_id: str, history: list = None)
         "units_chat_history": units_chat_history,
         "lang": "ar" if any(0x0600 <= ord(c) <= 0x06FF for c in input_text) else "en",
         "redifined_question": "",
+        "filters": filters,
     }
     
     final_response = None
@@ -1,3 +1,14 @@
+from .embedding_service import EmbeddingService, HashEmbeddingBackend, OpenAIEmbeddingBackend, get_embedding_service
 from .semantic_chunking import SemanticChunkingService
 from .faiss_index import FAISSIndexService
+from .vector_store import FAISSVectorStore, StoreBuilder, StoreWriterError
+from .ingest_pipeline import IngestionPipeline
+from .chunk_store import ChunkStore
+from .source_catalog import SourceCatalog
+from .metadata_filter import check_filter
+from .index_versions import IndexVersions
+from .reranker import Reranker
+from .shards import ShardManager, ShardedVectorStore
+from .jobs import JobRegistry, jobs
+from .drive_sync import GoogleDriveClient, LocalDriveClient, DriveManifest
 from .chain_setup import MyCustomAsyncHandler, MyCustomSyncHandler, PropertyChain, DictFilter
@@ -0,0 +1,107 @@
+"""
+this file contains the JSONL chunk manifest of an index version, and the rebuild that reads it back.
+every line is one live chunk of the version's chunk store: its row id, text, metadata, content hash
+(of the text), token count and, when the embedding cache holds its vector, the cache's model and row
+("embedding_model", "embedding_row").
+a rebuild exports the manifest from the active version, so it has every upsert and deletion made since
+the last full build, then streams it INGEST_EMBED_BATCH lines at a time into a new index version (of
+any index type) without parsing or chunking a single DOCX file: vectors are read from the active
+version's full-size vectors (or the cache rows), and re-embedded only when neither holds them.
+the rebuild switches the shard's active version, so it refuses to run while a server has the shard loaded.
+
+usage (from the project root):
+    python -m services.chunk_manifest --shard default --index-type HNSW
+    python -m services.chunk_manifest --shard default --export chunks.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+from typing import Iterator, List
+
+import numpy as np
+
+from core import settings
+from .semantic_chunking import content_hash
+from .tokens import count_tokens_batch
+
+
+def write_chunk_manifest(chunk_store, path: str, embeddings_model=None, batch_size: int = 1000) -> int:
+    """Write the chunks of a chunk store to a JSONL manifest, in row order; returns the number of lines."""
+    cache = getattr(embeddings_model, "cache", None)
+    count = 0
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for rows in chunk_store.iter_rows(batch_size):
+            texts = [text for _, text, _ in rows]
+            cache_rows = cache.rows(texts) if cache is not None else None
+            for i, ((row_id, text, metadata), tokens) in enumerate(zip(rows, count_tokens_batch(texts))):
+                record = {"row_id": row_id, "text": text, "metadata": metadata,
+                          "content_hash": content_hash(text), "tokens": tokens}
+                if cache_rows is not None and cache_rows[i] >= 0:
+                    record.update(embedding_model=cache.model, embedding_row=int(cache_rows[i]))
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += len(rows)
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def iter_chunk_manifest(path: str, batch_size: int = None) -> Iterator[List[dict]]:
+    """The records of a manifest, batch_size (INGEST_EMBED_BATCH by default) at a time."""
+    batch_size = batch_size or settings.INGEST_EMBED_BATCH
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def manifest_vectors(records: List[dict], embeddings_model, full_vectors=None) -> np.ndarray:
+    """
+    The vectors of manifest records: by row id from full_vectors (the FullVectorFile of the store the
+    manifest was exported from), else from their embedding cache rows when all are valid, else embedded.
+    """
+    texts = [record["text"] for record in records]
+    if full_vectors is not None and all(record.get("row_id", len(full_vectors)) < len(full_vectors)
+                                        for record in records):
+        return np.array(full_vectors.vectors[[record["row_id"] for record in records]], dtype="float32")
+    cache = getattr(embeddings_model, "cache", None)
+    if cache is not None and all(record.get("embedding_model") == cache.model and "embedding_row" in record
+                                 for record in records):
+        vectors = await asyncio.to_thread(cache.vectors_at, [record["embedding_row"] for record in records], texts)
+        if vectors is not None:
+            return vectors
+    return np.asarray(await embeddings_model.aembed_documents(texts), dtype="float32")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild a shard's FAISS index from the chunks of its active version.")
+    parser.add_argument("--shard", default=None, help="Shard to rebuild (the default shard if omitted).")
+    parser.add_argument("--index-type", default=None, help="FAISS index type (settings.FAISS_INDEX_TYPE if omitted).")
+    parser.add_argument("--export", default=None, help="Only write the chunk manifest to this path, without rebuilding.")
+    args = parser.parse_args(argv)
+
+    from .faiss_index import FAISSIndexService
+    from .index_versions import ShardInUseError, migrate_unsharded
+    migrate_unsharded()
+    service = FAISSIndexService(args.shard)
+    try:
+        if args.export:
+            count = service.export_manifest(args.export)
+            print(f"Exported {count} chunks of shard {service.shard!r} to {args.export}.")
+            return
+        store = asyncio.run(service.rebuild(index_type=args.index_type))
+    except (ShardInUseError, ValueError) as e:
+        parser.error(str(e))
+    if store is None:
+        parser.error(f"shard {service.shard!r} holds no chunks")
+    print(f"Rebuilt shard {service.shard!r}: {store.ntotal} chunks, "
+          f"index version {os.path.basename(store.folder_path)}.")
+
+
+if __name__ == "__main__":
+    main()
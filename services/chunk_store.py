@@ -0,0 +1,141 @@
+"""
+this file contains the on-disk chunk store used by the vector store.
+chunk texts and metadata live in a SQLite table keyed by the FAISS row id, so the chatbot
+never holds the whole corpus as Python objects and adding chunks only writes the new rows.
+"""
+import json
+import sqlite3
+import threading
+from typing import Iterable, Iterator, List, Optional
+from langchain_core.documents import Document
+
+CHUNK_STORE_FILE = "chunks.sqlite3"
+
+
+def source_key(metadata: dict) -> Optional[str]:
+    """The source file a chunk came from (chunks ingested before 'source' existed use their filename)."""
+    return metadata.get("source") or metadata.get("filename")
+
+
+class ChunkStore:
+    """SQLite-backed chunk texts and metadata keyed by FAISS row id."""
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self.lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "row_id INTEGER PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL, filename TEXT, source TEXT)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")]
+            if "source" not in columns:
+                self._conn.execute("ALTER TABLE chunks ADD COLUMN source TEXT")
+                self._conn.execute("UPDATE chunks SET source = filename")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_filename ON chunks(filename)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source)")
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def append(self, start_row: int, texts: Iterable[str], metadatas: Iterable[dict]) -> List[int]:
+        """Store chunks under consecutive row ids starting at `start_row` and return the row ids."""
+        rows = [(start_row + i, text, json.dumps(metadata, ensure_ascii=False), metadata.get("filename"),
+                 source_key(metadata))
+                for i, (text, metadata) in enumerate(zip(texts, metadatas))]
+        with self.lock, self.conn:
+            # rows beyond the last saved index position may be left over from an interrupted update
+            self.conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+        return [row[0] for row in rows]
+
+    def update_metadata(self, rows: List[tuple]):
+        """Replace the metadata of chunks, given as (row_id, metadata) pairs (their source stays the same)."""
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE chunks SET metadata = ? WHERE row_id = ?",
+                                  [(json.dumps(metadata, ensure_ascii=False), row_id) for row_id, metadata in rows])
+
+    def truncate(self, n_rows: int):
+        """Drop every chunk with a row id >= n_rows."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE row_id >= ?", (n_rows,))
+
+    def detach_source(self, source: str) -> int:
+        """
+        Unlink every chunk of one source file from it (they stay readable by row id until
+        delete_ranges() purges them) and return how many there were.
+        """
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE chunks SET source = NULL, filename = NULL WHERE source = ?", (source,)
+            ).rowcount
+
+    def delete_ranges(self, ranges: List[List[int]]):
+        """Drop the chunks whose row ids fall in the [start, end) ranges."""
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM chunks WHERE row_id >= ? AND row_id < ?", ranges)
+
+    def get(self, row_id: int) -> Optional[Document]:
+        """Fetch a single chunk by row id."""
+        return self.get_many([row_id])[0]
+
+    def get_many(self, row_ids: List[int]) -> List[Optional[Document]]:
+        """Fetch several chunks in one query, in the order of `row_ids` (None for unknown ids)."""
+        row_ids = [int(row_id) for row_id in row_ids]
+        if not row_ids:
+            return []
+        placeholders = ",".join("?" * len(row_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT row_id, text, metadata FROM chunks WHERE row_id IN ({placeholders})", row_ids
+            ).fetchall()
+        found = {row_id: Document(page_content=text, metadata=json.loads(metadata)) for row_id, text, metadata in rows}
+        return [found.get(row_id) for row_id in row_ids]
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[List[tuple]]:
+        """(row_id, text, metadata) of the chunks that belong to a source, in row order, batch_size at a time."""
+        last = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT row_id, text, metadata FROM chunks WHERE row_id > ? AND source IS NOT NULL "
+                    "ORDER BY row_id LIMIT ?", (last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [(row_id, text, json.loads(metadata)) for row_id, text, metadata in rows]
+            last = rows[-1][0]
+
+    def source_rows(self, source: str) -> List[tuple]:
+        """(row_id, text, metadata) of every chunk of one source file, in row order."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT row_id, text, metadata FROM chunks WHERE source = ? ORDER BY row_id", (source,)
+            ).fetchall()
+        return [(row_id, text, json.loads(metadata)) for row_id, text, metadata in rows]
+
+    def sources(self) -> List[str]:
+        """Distinct source files."""
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT source FROM chunks WHERE source IS NOT NULL").fetchall()
+        return [row[0] for row in rows]
+
+    def filenames(self) -> List[str]:
+        """Distinct 'filename' metadata values."""
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT filename FROM chunks WHERE filename IS NOT NULL").fetchall()
+        return [row[0] for row in rows]
@@ -0,0 +1,118 @@
+"""
+this file contains the semantic chunker used by the SemanticChunkingService.
+it splits a text into sentences (Arabic "؟" included), embeds a window of neighbouring sentences
+around each one, and breaks the text where the cosine distance between consecutive windows is high.
+distances, breakpoints and the pooled chunk vectors are computed with numpy over the whole
+sentence-embedding matrix. all per-call parameters (such as the number of chunks) are arguments,
+so one chunker is safely shared by concurrent threads.
+"""
+import re
+from typing import List, Optional, Tuple
+import numpy as np
+
+# sentences end with ".", "?", "!" or the Arabic question mark "؟"
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.?!؟])\s+")
+BREAKPOINT_THRESHOLD_TYPES = ("percentile", "standard_deviation", "interquartile", "gradient")
+
+
+def split_sentences(text: str) -> List[str]:
+    return SENTENCE_SPLIT_PATTERN.split(text)
+
+
+def sentence_windows(sentences: List[str], buffer_size: int = 1) -> List[str]:
+    """Every sentence joined with up to `buffer_size` sentences on each side."""
+    return [" ".join(sentences[max(0, i - buffer_size):i + buffer_size + 1]) for i in range(len(sentences))]
+
+
+def cosine_distances(embeddings: np.ndarray) -> np.ndarray:
+    """Cosine distance between each row and the next one."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1.0, norms)
+    return 1.0 - np.einsum("ij,ij->i", unit[:-1], unit[1:])
+
+
+class SemanticChunker:
+    """Breakpoint-based semantic chunking, compatible with langchain_experimental's SemanticChunker."""
+    def __init__(self, embeddings, breakpoint_threshold_type: str = "percentile",
+                 breakpoint_threshold_amount: float = 95, min_chunk_size: Optional[int] = None, buffer_size: int = 1):
+        if breakpoint_threshold_type not in BREAKPOINT_THRESHOLD_TYPES:
+            raise ValueError(f"Unknown breakpoint threshold type {breakpoint_threshold_type!r}, "
+                             f"expected one of {BREAKPOINT_THRESHOLD_TYPES}.")
+        self.embeddings = embeddings
+        self.breakpoint_threshold_type = breakpoint_threshold_type
+        self.breakpoint_threshold_amount = breakpoint_threshold_amount
+        self.min_chunk_size = min_chunk_size
+        self.buffer_size = buffer_size
+
+    def breakpoints(self, distances: np.ndarray, number_of_chunks: Optional[int] = None) -> np.ndarray:
+        """Indexes i of the sentences after which the text is split."""
+        if number_of_chunks is not None:
+            # the percentile of the distances that leaves about number_of_chunks chunks
+            n = len(distances)
+            x = max(min(number_of_chunks, n), 1)
+            percentile = 100.0 if n == 1 else 100.0 * (x - n) / (1 - n)
+            return np.flatnonzero(distances > np.percentile(distances, min(max(percentile, 0), 100)))
+        scores = distances
+        amount = self.breakpoint_threshold_amount
+        if self.breakpoint_threshold_type == "percentile":
+            threshold = np.percentile(distances, amount)
+        elif self.breakpoint_threshold_type == "standard_deviation":
+            threshold = distances.mean() + amount * distances.std()
+        elif self.breakpoint_threshold_type == "interquartile":
+            q1, q3 = np.percentile(distances, [25, 75])
+            threshold = distances.mean() + amount * (q3 - q1)
+        else:
+            scores = np.gradient(distances)
+            threshold = np.percentile(scores, amount)
+        return np.flatnonzero(scores > threshold)
+
+    def _groups(self, sentences: List[str], breakpoints: np.ndarray) -> List[Tuple[int, int]]:
+        """[start, end) sentence ranges of the chunks; a group shorter than min_chunk_size joins the next one."""
+        lengths = np.fromiter((len(sentence) for sentence in sentences), dtype="int64", count=len(sentences))
+        # characters of sentences[:i] joined by spaces, minus the trailing space
+        offsets = np.concatenate([[0], np.cumsum(lengths + 1)])
+        groups, start = [], 0
+        for index in breakpoints:
+            end = int(index) + 1
+            if self.min_chunk_size is not None and offsets[end] - offsets[start] - 1 < self.min_chunk_size:
+                continue
+            groups.append((start, end))
+            start = end
+        if start < len(sentences):
+            groups.append((start, len(sentences)))
+        return groups
+
+    def needs_embeddings(self, sentences: List[str]) -> bool:
+        """False for texts too short to have breakpoints; they are returned one chunk per sentence."""
+        return not (len(sentences) == 1 or (self.breakpoint_threshold_type == "gradient" and len(sentences) == 2))
+
+    def windows(self, sentences: List[str]) -> List[str]:
+        """The texts to embed for `sentences`."""
+        return sentence_windows(sentences, self.buffer_size) if self.needs_embeddings(sentences) else []
+
+    def split(self, text: str, number_of_chunks: Optional[int] = None) -> Tuple[List[str], List[Optional[np.ndarray]]]:
+        """
+        Split `text` into chunks. Also returns a vector per chunk, pooled from the sentence-window
+        embeddings (length-weighted mean, re-normalized); None where no embeddings were needed.
+        """
+        sentences = split_sentences(text)
+        windows = self.windows(sentences)
+        embeddings = self.embeddings.embed_documents(windows) if windows else None
+        return self.split_embedded(sentences, embeddings, number_of_chunks)
+
+    def split_embedded(self, sentences: List[str], embeddings: Optional[List[List[float]]],
+                       number_of_chunks: Optional[int] = None) -> Tuple[List[str], List[Optional[np.ndarray]]]:
+        """split() for sentences whose windows were embedded by the caller (embeddings of self.windows(sentences))."""
+        if not self.needs_embeddings(sentences):
+            return sentences, [None] * len(sentences)
+        embeddings = np.asarray(embeddings, dtype="float32")
+        groups = self._groups(sentences, self.breakpoints(cosine_distances(embeddings), number_of_chunks))
+
+        # pooling as one matrix product: row g of `assignment` holds the length weights of group g's sentences
+        assignment = np.zeros((len(groups), len(sentences)), dtype="float32")
+        for g, (start, end) in enumerate(groups):
+            assignment[g, start:end] = [max(len(sentence), 1) for sentence in sentences[start:end]]
+        pooled = assignment @ embeddings
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        chunks = [" ".join(sentences[start:end]) for start, end in groups]
+        return chunks, list(pooled)
@@ -0,0 +1,123 @@
+"""
+this file compares the throughput of our semantic chunker with langchain_experimental's SemanticChunker
+(the one used before) on the same texts, and checks that both produce the same chunks.
+sentence embeddings are computed once up front with the local hashing embedder, so the timings measure
+the chunking itself (splitting, distances, breakpoints, assembly), not the embedding API.
+
+usage (from the project root):
+    python -m services.chunker_benchmark --files services/source_doc/*.docx --threads 4
+    python -m services.chunker_benchmark --synthetic 200
+"""
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+from core import settings
+from .chunker import SemanticChunker, split_sentences, sentence_windows
+from .embedding_service import HashEmbeddingBackend
+from .index_benchmark import format_report
+
+WORDS_PER_CHUNK = 80  # as in SemanticChunkingService._n_chunks
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Embeddings looked up from a table filled before timing starts."""
+    def __init__(self, texts: List[str], dimensions: int):
+        backend = HashEmbeddingBackend(dimensions)
+        self.table = {text: backend._vector(text).tolist() for text in set(texts)}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.table[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.table[text]
+
+
+def synthetic_texts(n_texts: int, sentences_per_text: int = 300) -> List[str]:
+    rng = random.Random(0)
+    topics = [[f"topic{t}word{w}" for w in range(40)] for t in range(20)]
+    texts = []
+    for _ in range(n_texts):
+        sentences, topic = [], rng.choice(topics)
+        for _ in range(sentences_per_text):
+            if rng.random() < 0.1:
+                topic = rng.choice(topics)
+            sentences.append(" ".join(rng.choices(topic, k=rng.randint(6, 20))) + rng.choice(".?!"))
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def _n_chunks(text: str) -> int:
+    return max(1, len(text.split()) // WORDS_PER_CHUNK)
+
+
+def benchmark_chunkers(texts: List[str], threads: int = 1, dimensions: int = 3072) -> list:
+    """Chunk all texts with both chunkers and report texts/s, sentences/s and agreement."""
+    from langchain_experimental.text_splitter import SemanticChunker as LangchainSemanticChunker
+
+    windows = [window for text in texts for window in sentence_windows(split_sentences(text))]
+    embeddings = PrecomputedEmbeddings(windows, dimensions)
+    n_sentences = sum(len(split_sentences(text)) for text in texts)
+    options = dict(breakpoint_threshold_type="gradient", breakpoint_threshold_amount=settings.BREAKPOINT_THRESHOLD,
+                   min_chunk_size=settings.MIN_CHUNK_SIZE)
+
+    ours = SemanticChunker(embeddings, **options)
+    theirs = LangchainSemanticChunker(embeddings, **options)
+
+    def run_ours(text):
+        return ours.split(text, number_of_chunks=_n_chunks(text))[0]
+
+    def run_theirs(text):
+        # the langchain chunker keeps number_of_chunks on the instance, so it cannot be shared by threads
+        chunker = LangchainSemanticChunker(embeddings, number_of_chunks=_n_chunks(text), **options)
+        return chunker.split_text(text)
+
+    results, outputs = [], {}
+    for name, run in (("langchain_experimental", run_theirs), ("services.chunker", run_ours)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            outputs[name] = list(pool.map(run, texts))
+        seconds = time.perf_counter() - start
+        results.append({
+            "chunker": name,
+            "threads": threads,
+            "texts": len(texts),
+            "chunks": sum(len(chunks) for chunks in outputs[name]),
+            "seconds": round(seconds, 3),
+            "texts_per_s": round(len(texts) / seconds, 1),
+            "sentences_per_s": round(n_sentences / seconds),
+        })
+    same = sum(a == b for a, b in zip(outputs["langchain_experimental"], outputs["services.chunker"]))
+    for result in results:
+        result["same_chunks"] = f"{same}/{len(texts)}"
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput of the semantic chunker against langchain's.")
+    parser.add_argument("--files", nargs="*", default=[], help="DOCX files to chunk.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of generated texts to chunk.")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--dimensions", type=int, default=3072, help="Size of the stand-in sentence embeddings.")
+    parser.add_argument("--json", help="Optional path to also write the results as JSON.")
+    args = parser.parse_args(argv)
+
+    texts = synthetic_texts(args.synthetic) if args.synthetic else []
+    if args.files:
+        from .semantic_chunking import load_docx_text
+        texts += [load_docx_text(path) for path in args.files]
+    if not texts:
+        parser.error("give --files or --synthetic")
+    results = benchmark_chunkers(texts, args.threads, args.dimensions)
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+this file contains the near-duplicate chunk detection used by the ingestion pipeline.
+developer brochures repeat the same boilerplate (company intro, payment plans) across many files;
+every chunk gets a MinHash signature over the word 3-grams of its normalized text, candidates are
+found with LSH (DEDUP_BANDS bands of the signature) and a chunk whose estimated Jaccard similarity with
+an already kept chunk reaches INGEST_DEDUP_THRESHOLD is dropped before it is embedded. the sources of
+the dropped copies are merged into the "sources" metadata of the kept chunk, which is shown with its
+text in the RAG prompt.
+the kept chunk is stored under the source it came from: filtering by another of its sources does not
+find it, and deleting its own source removes it until the next full build.
+"""
+import re
+import zlib
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from core import settings
+
+NUM_PERMUTATIONS = 64
+DEDUP_BANDS = 8  # of NUM_PERMUTATIONS // DEDUP_BANDS rows: candidates from about 0.77 Jaccard similarity
+SHINGLE_WORDS = 3
+_PRIME = (1 << 31) - 1
+
+_rng = np.random.default_rng(0)
+_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype="uint64")[:, None]
+_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype="uint64")[:, None]
+
+
+def shingles(text: str) -> List[str]:
+    """Word 3-grams of the lowercased text, without punctuation."""
+    words = re.findall(r"\w+", unicodedata.normalize("NFC", text).lower())
+    if len(words) <= SHINGLE_WORDS:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """MinHash signature of the text's shingles (None for a text without words)."""
+    shingle_set = set(shingles(text))
+    if not shingle_set:
+        return None
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) & _PRIME for shingle in shingle_set),
+                         dtype="uint64", count=len(shingle_set))
+    return ((_A * hashes + _B) % _PRIME).min(axis=1).astype("uint32")
+
+
+class Deduplicator:
+    """The chunks kept so far, by LSH band; assigns each kept chunk a number in order."""
+    def __init__(self, threshold: float = None):
+        self.threshold = settings.INGEST_DEDUP_THRESHOLD if threshold is None else threshold
+        self.rows = NUM_PERMUTATIONS // DEDUP_BANDS
+        self.signatures = np.empty((1024, NUM_PERMUTATIONS), dtype="uint32")
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(DEDUP_BANDS)]
+        self.kept = 0
+        self.duplicates = 0
+        # kept chunk number -> sources of its dropped copies
+        self.merged: Dict[int, List[str]] = {}
+
+    def add(self, text: str, source: str) -> Optional[int]:
+        """Number of the chunk if it is kept, None if it is a near-duplicate of a kept one."""
+        signature = minhash(text)
+        if self.threshold <= 0 or signature is None:
+            return self._keep(signature)
+        bands = [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(DEDUP_BANDS)]
+        candidates = {k for band, key in zip(self.buckets, bands) for k in band.get(key, ())}
+        for k in sorted(candidates):
+            if np.mean(self.signatures[k] == signature) >= self.threshold:
+                self.duplicates += 1
+                if source not in self.merged.setdefault(k, []):
+                    self.merged[k].append(source)
+                return None
+        k = self._keep(signature)
+        for band, key in zip(self.buckets, bands):
+            band.setdefault(key, []).append(k)
+        return k
+
+    def _keep(self, signature: Optional[np.ndarray]) -> int:
+        k = self.kept
+        if k == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        if signature is not None:
+            self.signatures[k] = signature
+        self.kept += 1
+        return k
+
+    @staticmethod
+    def merge_sources(metadata: dict, sources: List[str]) -> dict:
+        """The metadata of a kept chunk with the sources of its dropped copies added."""
+        own = metadata.get("source")
+        merged = [own] + [source for source in sources if source != own]
+        return {**metadata, "sources": merged}
@@ -0,0 +1,72 @@
+"""
+this file contains the streaming DOCX text extractor used to ingest documents.
+it reads word/document.xml straight out of the zip archive with an incremental XML parser and yields
+the body's blocks one at a time: each paragraph, and each table row as its cells joined by " | "
+(so the rows of price lists stay together). elements are discarded once their text is taken, so memory
+does not grow with the size of the document. headers, footers and deleted (tracked) text are skipped.
+the text is not byte for byte that of Docx2txtLoader, which this replaced: paragraphs are joined by one
+newline instead of blank lines, table rows are kept on one line, and text boxes are read once (not
+with their fallback copy), so a few documents (2 of the 110 source documents) differ in their words too.
+"""
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Iterator
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# fallback copy of content (such as text boxes) that is also given in the preferred mc:Choice form
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+CELL_SEPARATOR = " | "
+
+
+def iter_docx_blocks(filepath: str) -> Iterator[str]:
+    """The non-blank paragraphs and table rows of a DOCX file, in document order."""
+    with zipfile.ZipFile(filepath) as archive, archive.open("word/document.xml") as xml:
+        paragraphs = []  # text runs of the open paragraphs (text boxes nest paragraphs in paragraphs)
+        cells = []       # paragraphs of the open table cells
+        rows = []        # cells of the open table rows
+        body, fallback = None, 0
+        for event, elem in ET.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if tag == MC_FALLBACK:
+                fallback += 1 if event == "start" else -1
+                continue
+            if fallback:
+                continue
+            if event == "start":
+                if tag == W + "p":
+                    paragraphs.append([])
+                elif tag == W + "tc":
+                    cells.append([])
+                elif tag == W + "tr":
+                    rows.append([])
+                elif tag == W + "body":
+                    body = elem
+                continue
+
+            block = None
+            if tag == W + "t" and paragraphs:
+                paragraphs[-1].append(elem.text or "")
+            elif tag == W + "tab" and paragraphs and elem.get(W + "val") is None:  # not a tab stop definition
+                paragraphs[-1].append("\t")
+            elif tag in (W + "br", W + "cr") and paragraphs:
+                paragraphs[-1].append("\n")
+            elif tag == W + "p":
+                block = "".join(paragraphs.pop()).strip()
+            elif tag == W + "tc":
+                rows[-1].append(" ".join(cells.pop()))
+            elif tag == W + "tr":
+                block = CELL_SEPARATOR.join(cell for cell in rows.pop() if cell)
+            elif tag != W + "tbl":
+                continue
+
+            if block:
+                if cells:
+                    cells[-1].append(block)
+                elif paragraphs:
+                    paragraphs[-1].append(" " + block + " ")
+                else:
+                    yield block
+            # the text of this element has been taken: drop it (and, outside any container, all the body read so far)
+            elem.clear()
+            if not (paragraphs or cells) and body is not None:
+                body.clear()
@@ -0,0 +1,220 @@
+"""
+this file contains the Google Drive access used to build and sync shards from a Drive folder.
+a manifest of the Drive files last ingested (id, name, modifiedTime, md5Checksum) is kept in the
+shard's active index version, so a sync only downloads new or changed files and removes the chunks
+of deleted ones. LocalDriveClient is a stand-in that serves a local directory the same way, for tests
+and benchmarks without Google credentials.
+Drive allows several files of one name in a folder, so files are keyed by their Drive id: they are
+downloaded to a path made from the id, and their chunks are stored under a "source" that is their
+name, qualified with their id ("name (id)") when another file of the folder already has that name.
+listings are paginated, files are downloaded DRIVE_DOWNLOAD_CONCURRENCY at a time (per build or sync,
+whatever the number of files requested at once) in chunks of
+DRIVE_DOWNLOAD_CHUNK_BYTES (MediaIoBaseDownload's default of 100 MB, unchanged), and a download
+interrupted by a transient error resumes from the last byte received instead of starting over. progress goes to the job (see jobs) instead of stdout.
+"""
+import io
+import os
+import re
+import json
+import asyncio
+from collections import Counter
+import hashlib
+import random
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from core import settings
+from .vector_store import write_json
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+MANIFEST_FILE = "drive_manifest.json"
+
+
+def folder_id_from_link(drive_link: str) -> str:
+    match = re.search(r'folders/([a-zA-Z0-9_-]+)', drive_link)
+    if not match:
+        raise ValueError("Invalid drive folder link format.")
+    return match.group(1)
+
+
+class GoogleDriveClient:
+    """DOCX files of a Drive folder, through a service account."""
+    def __init__(self, credentials_file: str):
+        from google.oauth2.service_account import Credentials
+        scopes = ['https://www.googleapis.com/auth/drive.readonly']
+        self.credentials = Credentials.from_service_account_file(credentials_file, scopes=scopes)
+        self._local = threading.local()
+
+    @property
+    def service(self):
+        # the HTTP transport of a Drive service object is not thread-safe: one per download thread
+        if getattr(self._local, "service", None) is None:
+            from googleapiclient.discovery import build
+            self._local.service = build('drive', 'v3', credentials=self.credentials, cache_discovery=False)
+        return self._local.service
+
+    def list_files(self, folder_id: str) -> List[dict]:
+        """id, name, modifiedTime, md5Checksum and size of the DOCX files in the folder (all pages)."""
+        query = f"'{folder_id}' in parents and mimeType='{DOCX_MIME_TYPE}' and trashed=false"
+        files, page_token = [], None
+        while True:
+            results = self.service.files().list(
+                q=query, pageSize=1000, pageToken=page_token,
+                fields="nextPageToken, files(id, name, modifiedTime, md5Checksum, size)").execute()
+            files += results.get('files', [])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def download(self, file: dict, local_path: str, progress=None):
+        """
+        Download a file in DRIVE_DOWNLOAD_CHUNK_BYTES chunks, calling progress(bytes) after each one.
+        After a transient error the download resumes where it stopped, up to DRIVE_DOWNLOAD_RETRIES times.
+        """
+        from httplib2 import HttpLib2Error
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaIoBaseDownload
+        request = self.service.files().get_media(fileId=file["id"])
+        with io.FileIO(local_path, 'wb') as fh:
+            downloader = MediaIoBaseDownload(fh, request, chunksize=settings.DRIVE_DOWNLOAD_CHUNK_BYTES)
+            done, received, failures = False, 0, 0
+            while not done:
+                try:
+                    # next_chunk retries 429/5xx responses itself; this loop also covers dropped connections
+                    status, done = downloader.next_chunk(num_retries=settings.DRIVE_DOWNLOAD_RETRIES)
+                except (HttpError, HttpLib2Error, OSError) as e:
+                    if isinstance(e, HttpError) and e.resp.status not in (408, 429, 500, 502, 503, 504):
+                        raise
+                    failures += 1
+                    if failures > settings.DRIVE_DOWNLOAD_RETRIES:
+                        raise
+                    time.sleep(min(30.0, 2 ** failures * random.uniform(0.5, 1.5)))
+                    continue
+                if progress is not None:
+                    progress(status.resumable_progress - received)
+                received = status.resumable_progress
+
+
+class LocalDriveClient:
+    """Stand-in Drive: folder <root>/<folder_id>, file ids are the file names."""
+    def __init__(self, root: str):
+        self.root = root
+
+    def list_files(self, folder_id: str) -> List[dict]:
+        folder = os.path.join(self.root, folder_id)
+        files = []
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not name.endswith(".docx"):
+                continue
+            with open(path, "rb") as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+            modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).isoformat()
+            files.append({"id": f"{folder_id}/{name}", "name": name, "modifiedTime": modified, "md5Checksum": md5,
+                          "size": str(os.path.getsize(path))})
+        return files
+
+    def download(self, file: dict, local_path: str, progress=None):
+        shutil.copyfile(os.path.join(self.root, file["id"]), local_path)
+        if progress is not None:
+            progress(os.path.getsize(local_path))
+
+
+class DriveManifest:
+    """The Drive files last ingested into an index version, by Drive file id."""
+    def __init__(self, folder_path: str):
+        self.path = os.path.join(folder_path, MANIFEST_FILE)
+        self.folder_id = None
+        self.files: Dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.folder_id, self.files = data["folder_id"], data["files"]
+
+    def save(self):
+        write_json({"folder_id": self.folder_id, "synced_at": datetime.now(timezone.utc).isoformat(),
+                    "files": self.files}, self.path)
+
+
+def recorded_source(entry: dict) -> str:
+    """The source a manifest entry was ingested under (manifests written before sources: its name)."""
+    return entry.get("source", entry["name"])
+
+
+def assign_sources(known: Dict[str, dict], listing: List[dict]):
+    """
+    Set the "source" of every listed file: the one it was ingested under while its name is unchanged
+    (and no other file shares it), else its name, or "name (id)" when another file already has that source.
+    """
+    shared = Counter(recorded_source(entry) for entry in known.values())
+    taken, pending = set(), []
+    for file in listing:
+        previous = known.get(file["id"])
+        if previous is not None and previous["name"] == file["name"] and shared[recorded_source(previous)] == 1:
+            file["source"] = recorded_source(previous)
+            taken.add(file["source"])
+        else:
+            pending.append(file)
+    for file in pending:
+        file["source"] = file["name"] if file["name"] not in taken else f"{file['name']} ({file['id']})"
+        taken.add(file["source"])
+
+
+def plan_sync(known: Dict[str, dict], listing: List[dict]) -> dict:
+    """
+    Compare the manifest with the folder listing: files are "added", "changed" (different checksum,
+    modification time or source), "removed" (from the manifest) or "unchanged".
+    Every listed file gets its "source" (see assign_sources). Files ingested under one shared source
+    (by a sync that keyed files by name) are all "changed", so each gets its own chunks back.
+    """
+    assign_sources(known, listing)
+    shared = Counter(recorded_source(entry) for entry in known.values())
+    plan = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    listed = {file["id"] for file in listing}
+    for file in listing:
+        previous = known.get(file["id"])
+        if previous is None:
+            plan["added"].append(file)
+        elif recorded_source(previous) != file["source"] or shared[file["source"]] > 1 or (
+                previous.get("md5Checksum") != file.get("md5Checksum") if file.get("md5Checksum")
+                else previous.get("modifiedTime") != file.get("modifiedTime")):
+            plan["changed"].append(file)
+        else:
+            plan["unchanged"].append(file)
+    plan["removed"] = [file for file_id, file in known.items() if file_id not in listed]
+    return plan
+
+
+class Downloader:
+    """
+    Downloads files of one build or sync into `directory`, DRIVE_DOWNLOAD_CONCURRENCY at a time across
+    all its callers. The job's progress counts the downloaded files and bytes.
+    """
+    def __init__(self, client, directory: str, job=None):
+        self.client = client
+        self.directory = directory
+        self.job = job
+        self.limit = asyncio.Semaphore(settings.DRIVE_DOWNLOAD_CONCURRENCY)
+
+    def _progress(self, n_bytes: int):
+        self.job.increment("downloaded_bytes", n_bytes)
+
+    async def download(self, file: dict) -> str:
+        """Download one file to a path made from its id (names can repeat or hold "/") and return the path."""
+        local_path = os.path.join(self.directory, hashlib.blake2b(file["id"].encode("utf-8"), digest_size=12).hexdigest()
+                                  + os.path.splitext(file["name"])[1])
+        async with self.limit:
+            await asyncio.to_thread(self.client.download, file, local_path,
+                                    self._progress if self.job is not None else None)
+        if self.job is not None:
+            self.job.increment("downloaded_files")
+        return local_path
+
+
+async def download_files(client, files: List[dict], directory: str, job=None) -> List[str]:
+    """Download files into `directory`, DRIVE_DOWNLOAD_CONCURRENCY at a time, and return their local paths."""
+    downloader = Downloader(client, directory, job)
+    return list(await asyncio.gather(*(downloader.download(file) for file in files)))
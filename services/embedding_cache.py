@@ -0,0 +1,204 @@
+"""
+this file contains the disk-backed embedding cache used by the embedding service for document texts
+(the chunker's sentences and the chunks indexed by the index builders), so rebuilding an unchanged
+corpus makes almost no embedding API calls.
+entries are keyed by a hash of the model name and the normalized text. every model has its own
+directory with two append-only files: vectors.f32 (the float32 vectors, memory-mapped read-only for
+lookups) and entries.u64 (pairs of an 8-byte key hash and the row of its vector). the lookup index is
+the keys sorted, with their rows, searched with numpy; new entries are merged into it.
+several processes (server workers, the benchmark, the rebuild) may share a cache: writers take a file
+lock, take the row of a new vector from the size of the vector file, and write every key with its row,
+so entries stay aligned whatever the order of the writers. readers pick up the entries written by
+other processes from the end of entries.u64.
+"""
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+import contextlib
+import unicodedata
+from typing import List, Optional, Tuple
+import numpy as np
+
+ENTRIES_FILE = "entries.u64"
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+# keys written in vector row order by earlier versions (converted to entries on load)
+LEGACY_KEYS_FILE = "keys.u64"
+ENTRY = np.dtype([("key", "<u8"), ("row", "<u8")])
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    """Content-addressed float32 vectors of one embedding model."""
+    def __init__(self, root: str, model: str):
+        self.model = model
+        self.path = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]", "_", model))
+        self.dimensions = None
+        self._lock = threading.Lock()
+        self._sorted_keys = np.empty(0, dtype="<u8")
+        self._sorted_rows = np.empty(0, dtype="int64")
+        self._n_entries = 0  # entries of the entries file read so far
+        self._n_vectors = 0
+        self._vectors = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._sorted_keys)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the cache files between processes (threads of this one also hold self._lock)."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        if not os.path.exists(self._file(META_FILE)):
+            return
+        with open(self._file(META_FILE), encoding="utf-8") as f:
+            self.dimensions = json.load(f)["dimensions"]
+        with self._file_lock():
+            self._convert_legacy_keys()
+            self._read_entries()
+
+    def _convert_legacy_keys(self):
+        """Turn the keys file of earlier versions (key i for vector row i) into entries."""
+        if not os.path.exists(self._file(LEGACY_KEYS_FILE)) or os.path.exists(self._file(ENTRIES_FILE)):
+            return
+        keys = np.fromfile(self._file(LEGACY_KEYS_FILE), dtype="<u8")
+        # keys were appended after their vectors, so an interrupted append left at most extra vectors
+        keys = keys[:min(len(keys), self._vector_file_rows())]
+        entries = np.empty(len(keys), dtype=ENTRY)
+        entries["key"], entries["row"] = keys, np.arange(len(keys))
+        entries.tofile(self._file(ENTRIES_FILE + ".tmp"))
+        os.replace(self._file(ENTRIES_FILE + ".tmp"), self._file(ENTRIES_FILE))
+        os.remove(self._file(LEGACY_KEYS_FILE))
+
+    def _vector_file_rows(self) -> int:
+        path = self._file(VECTORS_FILE)
+        return os.path.getsize(path) // (4 * self.dimensions) if os.path.exists(path) else 0
+
+    def _read_entries(self):
+        """Merge the entries written (by any process) since the entries file was last read. Called with the lock held."""
+        path = self._file(ENTRIES_FILE)
+        if self.dimensions is None or not os.path.exists(path) or \
+                os.path.getsize(path) < (self._n_entries + 1) * ENTRY.itemsize:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._n_entries * ENTRY.itemsize)
+            data = f.read()
+        # a torn entry at the end (a writer that crashed) is left out
+        entries = np.frombuffer(data, dtype=ENTRY, count=len(data) // ENTRY.itemsize)
+        self._n_entries += len(entries)
+        # vectors are written before their entries, so every row read here is in the vector file
+        self._n_vectors = max(self._n_vectors, self._vector_file_rows())
+        entries = entries[entries["row"] < self._n_vectors]
+        self._insert(entries["key"], entries["row"].astype("int64"))
+
+    def _insert(self, keys: np.ndarray, rows: np.ndarray):
+        """Merge new entries into the sorted index (the first row of a key wins)."""
+        keys, first = np.unique(keys, return_index=True)
+        rows = rows[first]
+        new = self._rows(keys) < 0
+        keys, rows = keys[new], rows[new]
+        positions = np.searchsorted(self._sorted_keys, keys)
+        self._sorted_keys = np.insert(self._sorted_keys, positions, keys)
+        self._sorted_rows = np.insert(self._sorted_rows, positions, rows)
+
+    def _vector_rows(self) -> np.ndarray:
+        if self._vectors is None or len(self._vectors) < self._n_vectors:
+            self._vectors = np.memmap(self._file(VECTORS_FILE), dtype="float32", mode="r",
+                                      shape=(self._n_vectors, self.dimensions)) if self._n_vectors else None
+        return self._vectors
+
+    def key(self, text: str) -> int:
+        digest = hashlib.blake2b(f"{self.model}\0{normalize_text(text)}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def _rows(self, keys: np.ndarray) -> np.ndarray:
+        """Row of each key in the vector file, -1 where missing. Called with the lock held."""
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions = np.minimum(positions, max(len(self._sorted_keys) - 1, 0))
+        found = (self._sorted_keys[positions] == keys) if len(self._sorted_keys) else np.zeros(len(keys), bool)
+        return np.where(found, self._sorted_rows[positions] if len(self._sorted_keys) else -1, -1)
+
+    def get_many(self, texts: List[str]) -> Tuple[List, np.ndarray]:
+        """The cached vector of each text (None where missing) and the keys of the texts."""
+        keys = np.array([self.key(text) for text in texts], dtype="<u8")
+        with self._lock:
+            self._read_entries()
+            rows = self._rows(keys)
+            vectors = self._vector_rows()
+            results = [None] * len(texts)
+            for i in np.flatnonzero(rows >= 0):
+                results[i] = np.array(vectors[rows[i]]).tolist()
+        return results, keys
+
+    def rows(self, texts: List[str]) -> np.ndarray:
+        """Row of each text's vector in the vector file (-1 where missing); rows never move."""
+        keys = np.array([self.key(text) for text in texts], dtype="<u8")
+        with self._lock:
+            self._read_entries()
+            return self._rows(keys)
+
+    def vectors_at(self, rows: List[int], texts: List[str]) -> Optional[np.ndarray]:
+        """
+        The vectors stored at `rows` (as returned by rows()), or None unless every row holds the
+        vector of its text (e.g. the cache was deleted since).
+        """
+        rows = np.asarray(rows, dtype="int64")
+        keys = np.array([self.key(text) for text in texts], dtype="<u8")
+        with self._lock:
+            self._read_entries()
+            if not len(rows) or not np.array_equal(self._rows(keys), rows):
+                return None
+            return np.array(self._vector_rows()[rows])
+
+    def put_many(self, keys: np.ndarray, vectors: List[List[float]]):
+        """Append new entries (keys as returned by get_many)."""
+        if not len(keys):
+            return
+        array = np.asarray(vectors, dtype="float32")
+        keys, first = np.unique(np.asarray(keys, dtype="<u8"), return_index=True)
+        array = array[first]
+        with self._lock, self._file_lock():
+            if self.dimensions is None:
+                self.dimensions = array.shape[1]
+                if not os.path.exists(self._file(META_FILE)):
+                    with open(self._file(META_FILE), "w", encoding="utf-8") as f:
+                        json.dump({"model": self.model, "dimensions": self.dimensions}, f)
+            # entries other processes added since the last read are not written again
+            self._read_entries()
+            new = self._rows(keys) < 0
+            if not new.any():
+                return
+            keys, array = keys[new], np.ascontiguousarray(array[new])
+            row_bytes = 4 * self.dimensions
+            with open(self._file(VECTORS_FILE), "ab") as f:
+                # the next row follows the last whole vector, whoever wrote it (a torn vector is cut off)
+                first_row = f.seek(0, os.SEEK_END) // row_bytes
+                f.truncate(first_row * row_bytes)
+                f.write(array.tobytes())
+            entries = np.empty(len(keys), dtype=ENTRY)
+            entries["key"], entries["row"] = keys, np.arange(first_row, first_row + len(keys))
+            with open(self._file(ENTRIES_FILE), "ab") as f:
+                size = f.seek(0, os.SEEK_END)
+                f.truncate(size - size % ENTRY.itemsize)
+                f.write(entries.tobytes())
+            self._n_entries = (size - size % ENTRY.itemsize) // ENTRY.itemsize + len(entries)
+            self._n_vectors = first_row + len(keys)
+            self._insert(keys, entries["row"].astype("int64"))
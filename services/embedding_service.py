@@ -0,0 +1,373 @@
+"""
+this file contains the process-wide embedding service used by both ingestion (the chunker and the index
+builders) and retrieval (query embeddings).
+concurrent requests from any thread or event loop are queued on one background event loop, coalesced
+into batched API calls within a short window (EMBEDDING_COALESCE_MS), limited to EMBEDDING_MAX_IN_FLIGHT
+concurrent calls, kept within the account's rate limits (see rate_limiter) and retried with jittered
+exponential backoff. batches are cut by token count as well as by size.
+queries have their own lane: concurrent queries are coalesced the same way, but apart from the bulk
+(document) queue and within a shorter window (EMBEDDING_QUERY_COALESCE_MS, at most EMBEDDING_QUERY_MAX_BATCH
+queries per call); their calls skip the bulk calls' in-flight limit and do not wait behind the rate
+limiter's backlog (EMBEDDING_QUERY_MAX_IN_FLIGHT calls at once), so a running ingestion does not slow
+down retrieval.
+the backend is pluggable: OpenAI in production, or a local deterministic hashing embedder
+(EMBEDDING_BACKEND="hash") for tests and benchmarks, which makes no network calls.
+document embeddings go through the on-disk embedding cache (see embedding_cache); queries do not.
+the chunker can also provide chunk vectors it pooled from sentence embeddings; they are used once,
+by the next request for that text, and never written to the cache. at most MAX_PROVIDED are held (the
+oldest are dropped), so vectors that are never requested do not pile up.
+"""
+import asyncio
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from core import settings
+from .embedding_cache import EmbeddingCache
+from .rate_limiter import RateLimiter
+from .tokens import count_tokens_batch
+
+MAX_PROVIDED = 50_000
+
+
+class OpenAIEmbeddingBackend:
+    """Embeddings from the OpenAI API (retries are left to the EmbeddingService)."""
+    max_batch_size = 2048
+    rate_limited = True
+
+    def __init__(self, model: str = None, api_key: str = None):
+        from openai import AsyncOpenAI
+        self.model = model or settings.EMBEDDING_MODEL
+        self.client = AsyncOpenAI(api_key=api_key or settings.OPENAI_API_KEY, max_retries=0)
+        # called with the response headers of every call (the service's rate limiter reads them)
+        self.on_headers = None
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        raw = await self.client.embeddings.with_raw_response.create(model=self.model, input=texts)
+        if self.on_headers is not None:
+            self.on_headers(raw.headers)
+        response = raw.parse()
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        import openai
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        if getattr(error, "code", None) == "insufficient_quota":
+            return False
+        return getattr(error, "status_code", None) in (408, 409, 429, 500, 502, 503, 504)
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """Seconds to wait when the call was rate limited (429), None for other errors."""
+        if getattr(error, "status_code", None) != 429:
+            return None
+        headers = error.response.headers
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        try:
+            return float(headers.get("retry-after", 1.0))
+        except ValueError:
+            return 1.0
+
+
+class HashEmbeddingBackend:
+    """
+    Deterministic local stand-in: hashed word and character-trigram features, L2-normalized.
+    Texts sharing words get similar vectors, which is enough to exercise retrieval end to end.
+    """
+    max_batch_size = 4096
+    # no account limits apply to a local embedder
+    rate_limited = False
+    _words = re.compile(r"[^\W_]+")
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.model = f"hash-{dimensions}"
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype="float32")
+        words = self._words.findall(text.lower())
+        features = words + [word[i:i + 3] for word in words for i in range(max(1, len(word) - 2))]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return vector / norm
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text).tolist() for text in texts]
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        return False
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        return None
+
+
+class _Lane:
+    """Texts waiting to be coalesced into batched calls, and the limit on the calls in flight, of one kind of request."""
+    def __init__(self, window: float, max_batch_size: int, max_in_flight: int, query: bool = False):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.query = query
+        self.pending = []  # (text, future, tokens)
+        self.pending_tokens = 0
+        self.flush_handle = None
+        self.semaphore = None  # created on the service's loop
+
+
+class EmbeddingService(Embeddings):
+    """
+    LangChain-compatible embeddings that coalesce, throttle and retry calls to a backend.
+    Safe to share between threads and event loops.
+    """
+    def __init__(self, backend, window_ms: float = None, max_batch_size: int = None, max_in_flight: int = None,
+                 max_retries: int = None, backoff_seconds: float = None, cache: EmbeddingCache = None,
+                 limiter: RateLimiter = None):
+        self.backend = backend
+        self.cache = cache
+        if limiter is None and backend.rate_limited:
+            limiter = RateLimiter(settings.EMBEDDING_REQUESTS_PER_MINUTE, settings.EMBEDDING_TOKENS_PER_MINUTE,
+                                  settings.EMBEDDING_MAX_BATCH_TOKENS)
+        self.limiter = limiter or RateLimiter(0, 0, settings.EMBEDDING_MAX_BATCH_TOKENS)
+        if hasattr(backend, "on_headers"):
+            backend.on_headers = self.limiter.observe_headers
+        window = (settings.EMBEDDING_COALESCE_MS if window_ms is None else window_ms) / 1000
+        self._documents = _Lane(window, min(max_batch_size or settings.EMBEDDING_MAX_BATCH, backend.max_batch_size),
+                                max_in_flight or settings.EMBEDDING_MAX_IN_FLIGHT)
+        self._queries = _Lane(settings.EMBEDDING_QUERY_COALESCE_MS / 1000,
+                              min(settings.EMBEDDING_QUERY_MAX_BATCH, backend.max_batch_size),
+                              settings.EMBEDDING_QUERY_MAX_IN_FLIGHT, query=True)
+        self.max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = settings.EMBEDDING_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.max_rate_limited = settings.EMBEDDING_MAX_RATE_LIMITED
+        self.stats = {"api_calls": 0, "texts": 0, "tokens": 0, "retries": 0, "rate_limited": 0,
+                      "cache_hits": 0, "provided": 0, "queries": 0}
+        self.drift = []
+        # provided by ingestion threads, taken by requests from any thread
+        self._provided = OrderedDict()
+        self._provided_lock = threading.Lock()
+        # the running batch calls (the loop only keeps weak references to its tasks)
+        self._calls = set()
+        self._loop = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def model(self) -> str:
+        return self.backend.model
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the background event loop that owns the queue, on first use."""
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="embedding-service", daemon=True).start()
+                for lane in (self._documents, self._queries):
+                    lane.semaphore = asyncio.Semaphore(lane.max_in_flight)
+                self._loop = loop
+        return self._loop
+
+    # ------------------------------------------------------------------ background loop
+    async def _enqueue(self, lane: _Lane, texts: List[str], tokens: List[int]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        lane.pending.extend(zip(texts, futures, tokens))
+        lane.pending_tokens += sum(tokens)
+        while len(lane.pending) >= lane.max_batch_size or lane.pending_tokens >= self.limiter.batch_tokens:
+            self._flush(lane)
+        if lane.pending and lane.flush_handle is None:
+            lane.flush_handle = loop.call_later(lane.window, self._flush, lane)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, lane: _Lane):
+        if lane.flush_handle is not None:
+            lane.flush_handle.cancel()
+            lane.flush_handle = None
+        # the next batch: at most max_batch_size texts and (unless a single text is larger) batch_tokens tokens
+        size, batch_tokens = 0, 0
+        while (size < min(lane.max_batch_size, len(lane.pending))
+               and (size == 0 or batch_tokens + lane.pending[size][2] <= self.limiter.batch_tokens)):
+            batch_tokens += lane.pending[size][2]
+            size += 1
+        batch, lane.pending = lane.pending[:size], lane.pending[size:]
+        lane.pending_tokens -= batch_tokens
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._call(lane, batch, batch_tokens))
+            self._calls.add(task)
+            task.add_done_callback(self._calls.discard)
+        if lane.pending:
+            lane.flush_handle = asyncio.get_running_loop().call_later(lane.window, self._flush, lane)
+
+    async def _embed(self, texts: List[str], tokens: int, query: bool = False) -> List[List[float]]:
+        """One backend call for the texts, retried; raises the last error. Queries do not wait for the budgets."""
+        attempt, rate_limited = 0, 0
+        while True:
+            if query:
+                await self.limiter.take(tokens)
+            else:
+                await self.limiter.acquire(tokens)
+            try:
+                self.stats["api_calls"] += 1
+                vectors = await self.backend.embed(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"The embedding backend returned {len(vectors)} vectors for {len(texts)} texts.")
+                self.stats["texts"] += len(texts)
+                self.stats["tokens"] += tokens
+                self.limiter.on_success()
+                return vectors
+            except Exception as e:
+                retry_after = self.backend.retry_after(e)
+                if retry_after is not None and self.backend.is_retryable(e) and rate_limited < self.max_rate_limited:
+                    # rate limited: wait as told, with smaller batches, without using up the retries
+                    rate_limited += 1
+                    self.stats["rate_limited"] += 1
+                    self.limiter.on_rate_limited(retry_after)
+                    print(f"Embedding call rate limited; pausing {retry_after:.1f} s.")
+                    continue
+                if retry_after is not None or attempt == self.max_retries or not self.backend.is_retryable(e):
+                    raise
+                self.stats["retries"] += 1
+                delay = self.backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5)
+                attempt += 1
+                print(f"Embedding call failed ({e}); retrying in {delay:.1f} s.")
+                await asyncio.sleep(delay)
+
+    async def _call(self, lane: _Lane, batch: list, batch_tokens: int):
+        # identical texts queued by different callers are embedded once
+        unique = list(dict.fromkeys(text for text, *_ in batch))
+        try:
+            async with lane.semaphore:
+                if lane.query:
+                    self.stats["queries"] += len(batch)
+                vectors = dict(zip(unique, await self._embed(unique, batch_tokens, query=lane.query)))
+            if self.cache is not None and not lane.query:
+                # cached per batch, so a build that fails part-way resumes from the last embedded batch
+                await asyncio.to_thread(self.cache.put_many, np.array([self.cache.key(text) for text in unique],
+                                                                      dtype="<u8"), [vectors[text] for text in unique])
+            for text, future, *_ in batch:
+                if not future.done():
+                    future.set_result(vectors[text])
+        except Exception as e:
+            # whatever failed (the call, the cache, a short response), no caller is left waiting
+            for _, future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            for _, future, *_ in batch:
+                future.cancel()
+            raise
+
+    # ------------------------------------------------------------------ Embeddings API
+    def provide(self, texts: List[str], vectors: List[np.ndarray]):
+        """Vectors computed elsewhere (pooled chunk vectors), returned once for the next request of each text."""
+        with self._provided_lock:
+            self._provided.update(zip(texts, vectors))
+            while len(self._provided) > MAX_PROVIDED:
+                self._provided.popitem(last=False)
+
+    def withdraw(self, texts: List[str]):
+        """Drop the provided vectors of texts that were not requested (e.g. after a failed call)."""
+        with self._provided_lock:
+            for text in texts:
+                self._provided.pop(text, None)
+
+    def record_drift(self, drift: np.ndarray):
+        """1 - cosine between provided vectors and real embeddings of a sample of them."""
+        self.drift.extend(float(value) for value in drift)
+
+    def _from_cache(self, texts: List[str]) -> tuple:
+        """Known vectors of the texts (None where missing) and the indexes of the missing ones."""
+        if self.cache is None:
+            results = [None] * len(texts)
+        else:
+            results, _ = self.cache.get_many(texts)
+            self.stats["cache_hits"] += sum(vector is not None for vector in results)
+        missing = []
+        with self._provided_lock:
+            # taken even for cache hits, so they are not left behind
+            provided = [self._provided.pop(text, None) for text in texts] if self._provided else [None] * len(texts)
+        for i, vector in enumerate(results):
+            if vector is None:
+                if provided[i] is None:
+                    missing.append(i)
+                else:
+                    results[i] = provided[i].tolist()
+                    self.stats["provided"] += 1
+        return results, missing
+
+    def _fill(self, results: list, missing: List[int], vectors: List[List[float]]) -> List[List[float]]:
+        for i, vector in zip(missing, vectors):
+            results[i] = vector
+        return results
+
+    def _submit(self, texts: List[str], lane: _Lane = None):
+        loop = self._ensure_loop()
+        coroutine = self._enqueue(lane or self._documents, texts, count_tokens_batch(texts))
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        results, missing = self._from_cache(texts)
+        if not missing:
+            return results
+        return self._fill(results, missing, self._submit([texts[i] for i in missing]).result())
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text], self._queries).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        results, missing = self._from_cache(texts)
+        if not missing:
+            return results
+        future = self._submit([texts[i] for i in missing])
+        return self._fill(results, missing, await asyncio.wrap_future(future))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await asyncio.wrap_future(self._submit([text], self._queries)))[0]
+
+
+def create_backend(name: str = None):
+    name = name or settings.EMBEDDING_BACKEND
+    if name == "openai":
+        return OpenAIEmbeddingBackend()
+    if name == "hash":
+        return HashEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend {name!r}, expected 'openai' or 'hash'.")
+
+
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """The process-wide embedding service (backend chosen by settings.EMBEDDING_BACKEND)."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            backend = create_backend()
+            cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH, backend.model) if settings.EMBEDDING_CACHE_PATH else None
+            _service = EmbeddingService(backend, cache=cache)
+        return _service
+
+
+def set_embedding_service(service: EmbeddingService):
+    """Replace the process-wide service (e.g. with a HashEmbeddingBackend one in benchmarks)."""
+    global _service
+    with _service_lock:
+        _service = service
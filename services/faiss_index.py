@@ -1,55 +1,162 @@
 """
 this file is responsible for creating and loading FAISS indexes.
+the index type (Flat, HNSW, IVFFlat, IVFPQ, SQ8) and its build/search parameters come from the settings.
+full builds go into a new index version that is validated before it is activated (see index_versions);
+builds from files stream through the ingestion pipeline (see ingest_pipeline), and the active version
+can be rebuilt (e.g. as another index type) from a JSONL chunk manifest exported from it, without
+re-chunking (see chunk_manifest).
 """
 import os
-from langchain_community.vectorstores import FAISS
+import time
+import asyncio
+import tempfile
+import numpy as np
 # from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores.faiss import DistanceStrategy
-from langchain_openai import OpenAIEmbeddings
 
 from core import settings
+from core.metrics import current_rss_bytes
+from .vector_store import FAISSVectorStore, StoreBuilder
+from .index_versions import IndexVersions, ShardLock, validate_store, shard_path
+from .embedding_service import get_embedding_service
+from .ingest_pipeline import IngestionPipeline
+from .chunk_manifest import iter_chunk_manifest, manifest_vectors, write_chunk_manifest
+
 class FAISSIndexService:
-    """Service for creating and loading FAISS indexes."""
-    def __init__(self):
-        self.embeddings_model = OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL)
+    """Service for creating and loading the FAISS index of one shard."""
+    def __init__(self, shard: str = None, embeddings_model=None):
+        self.shard = shard or settings.DEFAULT_SHARD
+        self.embeddings_model = embeddings_model or get_embedding_service()
         self.vector_store = None
+        self.versions = IndexVersions(shard_path(self.shard))
+        self.lock = ShardLock(shard_path(self.shard))
 
     async def create_faiss_index(self, documents):
-        """Create and save a FAISS index."""
-        texts = [doc.page_content for doc in documents]
-        metadatas = [doc.metadata for doc in documents]
-        self.vector_store = await FAISS.afrom_texts(texts=texts, embedding=self.embeddings_model, metadatas=metadatas) # ,distance_strategy=DistanceStrategy.JACCARD
-        self.vector_store.save_local(settings.FAISS_INDEX_PATH)
-        print(f"FAISS index saved to {settings.FAISS_INDEX_PATH}")
+        """
+        Create a FAISS index of type settings.FAISS_INDEX_TYPE in a new index version, validate it
+        and activate it. The active version is untouched until then; a failed build is discarded.
+        With settings.EMBEDDING_DIMENSIONS set, the index holds truncated vectors and the
+        full-size ones go to a memory-mapped side file for re-scoring.
+        """
+        async def fill(builder):
+            texts = [doc.page_content for doc in documents]
+            embeddings = await self.embeddings_model.aembed_documents(texts)
+            await asyncio.to_thread(builder.add, texts, np.asarray(embeddings, dtype="float32"),
+                                    [doc.metadata for doc in documents])
+
+        return await self._build_version(fill)
+
+    async def build_from_files(self, filepaths, semantic_service, job=None, sources=None):
+        """
+        create_faiss_index for DOCX files, streamed through the ingestion pipeline: the documents are
+        never all in memory and parsing, chunking, embedding and indexing overlap.
+        sources names the files' chunks (their file names by default). Returns None when the files hold no text.
+        """
+        return await self._build_version(
+            lambda builder: IngestionPipeline(semantic_service, builder, job).run(filepaths, sources))
+
+    async def build_from_manifest(self, manifest_path, job=None, index_type=None, full_vectors=None):
+        """
+        create_faiss_index for the chunks of a JSONL chunk manifest, streamed batch by batch: no DOCX
+        parsing or chunking. Vectors come from `full_vectors` (the side file of the store the manifest was
+        exported from) or the embedding cache, and are only embedded again when neither has them.
+        index_type overrides settings.FAISS_INDEX_TYPE. Returns None when the manifest holds no chunks.
+        """
+        async def fill(builder):
+            for records in iter_chunk_manifest(manifest_path):
+                vectors = await manifest_vectors(records, self.embeddings_model, full_vectors)
+                await asyncio.to_thread(builder.add, [record["text"] for record in records], vectors,
+                                        [record["metadata"] for record in records])
+                if job is not None:
+                    job.increment("ingested_chunks", len(records))
+
+        return await self._build_version(fill, index_type)
+
+    def export_manifest(self, path: str) -> int:
+        """Write the live chunks of the active version to a JSONL chunk manifest; returns their number."""
+        store = self.vector_store or self.load_index()
+        if store is None:
+            raise ValueError(f"Shard {self.shard!r} has no index to export.")
+        return write_chunk_manifest(store.chunk_store, path, self.embeddings_model)
+
+    async def rebuild(self, index_type=None, job=None):
+        """
+        Rebuild the active version from its own live chunks (exported to a manifest first, so later
+        upserts and deletions are included) into a new version, e.g. of another index type.
+        For offline use: raises ShardInUseError when another process serves the shard.
+        """
+        self.lock.acquire_exclusive()
+        try:
+            store = self.vector_store or self.load_index()
+            if store is None:
+                raise ValueError(f"Shard {self.shard!r} has no index to rebuild.")
+            with tempfile.TemporaryDirectory(dir=self.versions.root) as directory:
+                manifest_path = os.path.join(directory, "chunks.jsonl")
+                await asyncio.to_thread(write_chunk_manifest, store.chunk_store, manifest_path, self.embeddings_model)
+                new_store = await self.build_from_manifest(manifest_path, job, index_type, store.full_vectors)
+            if new_store is not None:
+                store.close()
+            return new_store
+        finally:
+            self.lock.release()
+
+    async def _build_version(self, fill, index_type=None):
+        """Build a new index version with `fill(builder)`, then validate and activate it."""
+        staging_path = self.versions.new_staging_dir()
+        builder = StoreBuilder(staging_path, self.embeddings_model, index_type=index_type,
+                               dimensions=settings.EMBEDDING_DIMENSIONS)
+        try:
+            await fill(builder)
+            if not builder.n_rows:
+                builder.chunk_store.close()
+                self.versions.discard(staging_path)
+                return None
+            store = await asyncio.to_thread(builder.finish)
+            store.apply_search_params()
+            validate_store(store, builder.n_rows)
+        except BaseException:
+            builder.chunk_store.close()
+            self.versions.discard(staging_path)
+            raise
+        self.versions.activate(os.path.basename(staging_path))
+        self.versions.prune()
+        self.vector_store = store
+        self.lock.acquire_shared()
+        print(f"FAISS {builder.index_type} index ({self.vector_store.dimensions} dims, {builder.n_rows} chunks) "
+              f"of shard {self.shard!r} saved to {staging_path} and activated")
+        return store
 
     def load_index(self):
-        """Load the FAISS index."""
-        if os.path.exists(settings.FAISS_INDEX_PATH):
-            self.vector_store = FAISS.load_local(settings.FAISS_INDEX_PATH, self.embeddings_model,allow_dangerous_deserialization=True)            
+        """Load the active FAISS index version (memory-mapped when settings.FAISS_MMAP) and report load time and RSS."""
+        index_path = self.versions.current_path()
+        if index_path is not None:
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            self.lock.acquire_shared()
+            self.vector_store = FAISSVectorStore.load_local(index_path, self.embeddings_model,
+                                                            mmap=settings.FAISS_MMAP)
+            self.set_search_params()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            rss_after = current_rss_bytes()
+            print(f"FAISS index of shard {self.shard!r} loaded in {elapsed_ms:.1f} ms "
+                  f"({'memory-mapped' if self.vector_store.mmapped else 'in memory'}, {self.vector_store.ntotal} vectors in {len(self.vector_store.segments)} segments), "
+                  f"RSS {rss_before / 2**20:.1f} MB -> {rss_after / 2**20:.1f} MB")
         return self.vector_store
-    
-
-  
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-  
 
+    def rollback(self, version: str = None):
+        """Activate and load an earlier index version (by default the one before the active one)."""
+        version = version or self.versions.previous()
+        if version is None:
+            raise ValueError("There is no earlier index version to roll back to.")
+        self.versions.activate(version)
+        print(f"Rolled the FAISS index of shard {self.shard!r} back to {version}.")
+        return self.load_index()
+
+    def list_versions(self) -> list:
+        """The kept index versions, oldest first, with the active one flagged."""
+        current = self.versions.current()
+        return [{"version": name, "active": name == current} for name in self.versions.list(activated_only=True)]
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Tune the loaded index at runtime (nprobe for IVF types, efSearch for HNSW)."""
+        if self.vector_store is not None:
+            self.vector_store.apply_search_params(nprobe=nprobe, ef_search=ef_search)
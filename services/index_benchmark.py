@@ -0,0 +1,140 @@
+"""
+this file compares the supported FAISS index types against the exact Flat index
+on the vectors of our own corpus and reports recall@k against search latency and memory.
+
+usage (from the project root, after the FAISS index has been built):
+    python -m services.index_benchmark --queries 200 --k 10
+"""
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+
+from core import settings
+from .index_factory import INDEX_TYPES, build_faiss_index, apply_search_params
+from .vector_store import FAISSVectorStore, truncate_and_normalize
+from .index_versions import IndexVersions, migrate_unsharded, shard_path
+
+# runtime knob values swept for each index type
+NPROBE_SWEEP = (1, 4, 16, 64)
+EF_SEARCH_SWEEP = (16, 64, 256)
+
+
+def load_corpus_vectors(index_path: str = None) -> np.ndarray:
+    """
+    Read the corpus vectors of a store (by default the active version of the default shard):
+    the full-precision side file when there is one, otherwise the vectors stored in the index segments.
+    """
+    if index_path is None:
+        migrate_unsharded()
+        index_path = shard_path(settings.DEFAULT_SHARD)
+    index_path = IndexVersions(index_path).current_path() or index_path
+    store = FAISSVectorStore.load_local(index_path, embedding=None, mmap=False)
+    if store.full_vectors is not None:
+        return np.array(store.full_vectors.vectors)
+    return np.concatenate([segment.reconstruct() for segment in store.segments])
+
+
+def _search_latencies(index: faiss.Index, queries: np.ndarray, k: int):
+    """Search the queries one at a time (as the chatbot does) and time each search."""
+    latencies = np.empty(len(queries))
+    results = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies[i] = time.perf_counter() - start
+        results[i] = ids[0]
+    return latencies, results
+
+
+def _recall(results: np.ndarray, ground_truth: np.ndarray) -> float:
+    k = ground_truth.shape[1]
+    hits = sum(len(np.intersect1d(r, g)) for r, g in zip(results, ground_truth))
+    return hits / (len(ground_truth) * k)
+
+
+def benchmark_index_types(vectors: np.ndarray, index_types=INDEX_TYPES, n_queries: int = 200, k: int = 10) -> list:
+    """
+    Build every index type over the corpus and measure recall@k (against Flat),
+    per-query latency and serialized index size.
+    The queries are held-out chunks, so no query is trivially matched by its own vector.
+    """
+    rng = np.random.default_rng(0)
+    n_queries = min(n_queries, len(vectors) // 10 or 1)
+    query_rows = rng.choice(len(vectors), size=n_queries, replace=False)
+    mask = np.ones(len(vectors), dtype=bool)
+    mask[query_rows] = False
+    queries = np.ascontiguousarray(vectors[query_rows], dtype="float32")
+    corpus = np.ascontiguousarray(vectors[mask], dtype="float32")
+
+    exact = faiss.IndexFlatL2(corpus.shape[1])
+    exact.add(corpus)
+    _, ground_truth = exact.search(queries, k)
+
+    results = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_faiss_index(corpus, index_type)
+        index.add(corpus)
+        build_seconds = time.perf_counter() - start
+        index_bytes = len(faiss.serialize_index(index))
+
+        if faiss.try_extract_index_ivf(index) is not None:
+            sweep = [("nprobe", value) for value in NPROBE_SWEEP]
+        elif isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+            sweep = [("efSearch", value) for value in EF_SEARCH_SWEEP]
+        else:
+            sweep = [(None, None)]
+
+        for param, value in sweep:
+            if param == "nprobe":
+                apply_search_params(index, nprobe=value)
+            elif param == "efSearch":
+                apply_search_params(index, ef_search=value)
+            latencies, found = _search_latencies(index, queries, k)
+            results.append({
+                "index_type": index_type,
+                "param": f"{param}={value}" if param else "",
+                f"recall@{k}": round(_recall(found, ground_truth), 4),
+                "mean_ms": round(latencies.mean() * 1000, 3),
+                "p95_ms": round(np.percentile(latencies, 95) * 1000, 3),
+                "build_s": round(build_seconds, 2),
+                "index_mb": round(index_bytes / 2 ** 20, 2),
+            })
+    return results
+
+
+def format_report(results: list) -> str:
+    """Render the benchmark results as a plain-text table."""
+    headers = list(results[0].keys())
+    rows = [[str(r[h]) for h in headers] for r in results]
+    widths = [max(len(h), *(len(row[i]) for row in rows)) for i, h in enumerate(headers)]
+    lines = ["  ".join(h.ljust(w) for h, w in zip(headers, widths))]
+    lines += ["  ".join(c.ljust(w) for c, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall vs latency report for the FAISS index types.")
+    parser.add_argument("--index-path", default=None,
+                        help="A store or shard directory (default: the default shard).")
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, default=settings.EMBEDDING_DIMENSIONS,
+                        help="Benchmark on truncated, re-normalized vectors of this size.")
+    parser.add_argument("--json", help="Optional path to also write the results as JSON.")
+    args = parser.parse_args(argv)
+
+    vectors = truncate_and_normalize(load_corpus_vectors(args.index_path), args.dimensions)
+    print(f"Benchmarking {len(vectors)} vectors of dimension {vectors.shape[1]}.")
+    results = benchmark_index_types(vectors, args.types, args.queries, args.k)
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+this file builds FAISS indexes of the type configured in the settings
+(Flat, HNSW, IVFFlat, IVFPQ, SQ8), trains them when needed and applies the runtime search knobs.
+"""
+import faiss
+import numpy as np
+
+from core import settings
+
+INDEX_TYPES = ("Flat", "HNSW", "IVFFlat", "IVFPQ", "SQ8")
+# faiss wants roughly 39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_factory_string(index_type: str, dim: int, n_vectors: int) -> str:
+    """Translate an index type from the settings into a faiss index_factory string."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}, expected one of {INDEX_TYPES}.")
+    if index_type == "Flat":
+        return "Flat"
+    if index_type == "HNSW":
+        return f"HNSW{settings.FAISS_HNSW_M}"
+    if index_type == "SQ8":
+        return "SQ8"
+
+    nlist = max(1, min(settings.FAISS_IVF_NLIST, n_vectors // MIN_POINTS_PER_CENTROID))
+    if index_type == "IVFFlat":
+        return f"IVF{nlist},Flat"
+    if dim % settings.FAISS_PQ_M != 0:
+        raise ValueError(f"FAISS_PQ_M={settings.FAISS_PQ_M} must divide the embedding dimension {dim}.")
+    return f"IVF{nlist},PQ{settings.FAISS_PQ_M}x{settings.FAISS_PQ_NBITS}"
+
+
+def new_faiss_index(dim: int, index_type: str = None, n_total: int = 0) -> faiss.Index:
+    """
+    An empty, untrained faiss index of `index_type` for a corpus of `n_total` vectors.
+    If the corpus is too small to train the requested type, a Flat index is returned instead.
+    """
+    index_type = index_type or settings.FAISS_INDEX_TYPE
+    if index_type == "IVFPQ" and n_total < 2 ** settings.FAISS_PQ_NBITS:
+        print(f"Only {n_total} vectors, too few to train {index_type}; falling back to Flat.")
+        index_type = "Flat"
+
+    index = faiss.index_factory(dim, index_factory_string(index_type, dim, n_total), faiss.METRIC_L2)
+    if index_type == "HNSW":
+        index.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+    return index
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = None, n_total: int = None) -> faiss.Index:
+    """
+    Build an empty (but trained) faiss index for the given vectors.
+    Index types that need training are trained on a random sample of at most
+    FAISS_TRAIN_SAMPLE_SIZE vectors. `vectors` may itself be a sample of a larger
+    corpus of `n_total` vectors (see new_faiss_index for the Flat fallback).
+    """
+    n_vectors, dim = vectors.shape
+    index = new_faiss_index(dim, index_type, n_total or n_vectors)
+    if not index.is_trained:
+        sample_size = min(n_vectors, settings.FAISS_TRAIN_SAMPLE_SIZE)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(n_vectors, size=sample_size, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype="float32"))
+
+    apply_search_params(index)
+    return index
+
+
+def apply_search_params(index: faiss.Index, nprobe: int = None, ef_search: int = None) -> None:
+    """Set the runtime knobs (nprobe for IVF indexes, efSearch for HNSW) on a faiss index."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or settings.FAISS_IVF_NPROBE, ivf.nlist)
+    if isinstance(index, faiss.IndexIDMap):
+        index = index.index
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        hnsw_index.hnsw.efSearch = ef_search or settings.FAISS_HNSW_EF_SEARCH
+
+
+def selector_search_params(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Search parameters restricting a search to the ids accepted by `selector`, carrying
+    the index's current nprobe/efSearch (the typed parameters would otherwise reset them).
+    """
+    if isinstance(index, faiss.IndexIDMap):
+        index = index.index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
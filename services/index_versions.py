@@ -0,0 +1,208 @@
+"""
+this file manages the versions of the vector store on disk for blue/green rebuilds.
+each full build goes into its own directory under FAISS_INDEX_PATH/versions, is validated there
+and only then activated by atomically replacing the CURRENT pointer file, so a failed build never
+touches the index being served. the previous FAISS_KEEP_VERSIONS versions are kept for rollback.
+every shard (FAISS_INDEX_PATH/shards/<name>) has its own versions.
+a process serving a shard holds a shared lock on its IN_USE file; offline tools that switch the active
+version (the rebuild of chunk_manifest) need it exclusively, so they refuse to run next to a server.
+"""
+import os
+import fcntl
+import re
+import json
+import shutil
+from datetime import datetime, timezone
+from typing import List, Optional
+import numpy as np
+
+from core import settings
+from .vector_store import FAISSVectorStore, MANIFEST_FILE, write_json
+
+SHARDS_DIR = "shards"
+SHARD_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+# written into a version directory when it is first activated; only such versions are rollback targets
+ACTIVATED_FILE = "ACTIVATED"
+IN_USE_FILE = "IN_USE"
+# files of a store written directly into FAISS_INDEX_PATH before versioning
+LEGACY_FILES = (MANIFEST_FILE, "index.faiss")
+
+
+def shard_path(name: str, root: str = None) -> str:
+    """Directory of a named shard."""
+    if not SHARD_NAME_PATTERN.match(name or ""):
+        raise ValueError(f"Invalid shard name {name!r}: use letters, digits, '-' and '_'.")
+    return os.path.join(root or settings.FAISS_INDEX_PATH, SHARDS_DIR, name)
+
+
+def migrate_unsharded(root: str = None):
+    """Move an index written before sharding into the default shard (once, at startup)."""
+    root = root or settings.FAISS_INDEX_PATH
+    if not os.path.isdir(root):
+        return
+    unsharded = [name for name in os.listdir(root) if name != SHARDS_DIR]
+    if unsharded:
+        default = shard_path(settings.DEFAULT_SHARD, root)
+        print(f"Moving the FAISS index in {root} to the {settings.DEFAULT_SHARD!r} shard...")
+        os.makedirs(default, exist_ok=True)
+        for name in unsharded:
+            os.replace(os.path.join(root, name), os.path.join(default, name))
+
+
+def list_shards(root: str = None) -> List[str]:
+    """Names of the shards on disk."""
+    root = root or settings.FAISS_INDEX_PATH
+    shards_dir = os.path.join(root, SHARDS_DIR)
+    if not os.path.isdir(shards_dir):
+        return []
+    return sorted(name for name in os.listdir(shards_dir) if SHARD_NAME_PATTERN.match(name))
+
+
+class ShardInUseError(Exception):
+    """Another process serves the shard."""
+
+
+class ShardLock:
+    """flock on a shard's IN_USE file: shared while a process serves the shard, exclusive for offline rebuilds."""
+    def __init__(self, root: str):
+        self.path = os.path.join(root, IN_USE_FILE)
+        self._fd = None
+        self.mode = None
+
+    def _open(self):
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire_shared(self):
+        """Mark the shard as served by this process (a no-op when this process already holds it)."""
+        if self.mode is None:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            self.mode = "shared"
+
+    def acquire_exclusive(self):
+        """Take the shard for an offline rebuild, or raise ShardInUseError when another process serves it."""
+        self._open()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ShardInUseError(f"{os.path.dirname(self.path)} is in use by another process (a running server?).")
+        self.mode = "exclusive"
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd, self.mode = None, None
+
+
+class IndexValidationError(Exception):
+    """A freshly built index failed its checks and was not activated."""
+
+
+class IndexVersions:
+    """Versioned store directories under one root plus an atomically swapped CURRENT pointer."""
+    def __init__(self, root: str = None):
+        self.root = root or settings.FAISS_INDEX_PATH
+        self.versions_dir = os.path.join(self.root, VERSIONS_DIR)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.versions_dir, name)
+
+    def _migrate_unversioned(self):
+        """Move a store that lives directly in the root into the first version."""
+        if not any(os.path.exists(os.path.join(self.root, name)) for name in LEGACY_FILES):
+            return
+        print(f"Moving the FAISS index in {self.root} to {self.path('v000001')}...")
+        os.makedirs(self.path("v000001"))
+        for name in os.listdir(self.root):
+            if name not in (VERSIONS_DIR, IN_USE_FILE):
+                os.replace(os.path.join(self.root, name), os.path.join(self.path("v000001"), name))
+        self.activate("v000001")
+
+    def current(self) -> Optional[str]:
+        """Name of the active version, or None when no index has been built."""
+        if os.path.isdir(self.root):
+            self._migrate_unversioned()
+        pointer = os.path.join(self.root, CURRENT_FILE)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, encoding="utf-8") as f:
+            return json.load(f)["version"]
+
+    def current_path(self) -> Optional[str]:
+        name = self.current()
+        return self.path(name) if name else None
+
+    def list(self, activated_only: bool = False) -> List[str]:
+        """Version directories, oldest first (with activated_only, skipping builds that never went live)."""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(name for name in os.listdir(self.versions_dir) if name.startswith("v")
+                      and (not activated_only or os.path.exists(os.path.join(self.path(name), ACTIVATED_FILE))))
+
+    def new_staging_dir(self) -> str:
+        """Create the directory for the next version; it is not served until activate()."""
+        versions = self.list()
+        name = f"v{int(versions[-1][1:]) + 1 if versions else 1:06d}"
+        os.makedirs(self.path(name))
+        return self.path(name)
+
+    def activate(self, name: str):
+        """Point CURRENT at a version (atomic: readers see the old or the new pointer, never a partial one)."""
+        if not os.path.exists(os.path.join(self.path(name), MANIFEST_FILE)):
+            raise ValueError(f"Unknown index version {name!r}.")
+        with open(os.path.join(self.path(name), ACTIVATED_FILE), "w", encoding="utf-8") as f:
+            f.write(datetime.now(timezone.utc).isoformat())
+        write_json({"version": name, "activated_at": datetime.now(timezone.utc).isoformat()},
+                   os.path.join(self.root, CURRENT_FILE))
+
+    def previous(self) -> Optional[str]:
+        """The newest previously activated version older than the active one."""
+        current = self.current()
+        older = [name for name in self.list(activated_only=True) if current is None or name < current]
+        return older[-1] if older else None
+
+    def prune(self, keep: int = None):
+        """Delete all but the active version and the `keep` versions before it."""
+        keep = settings.FAISS_KEEP_VERSIONS if keep is None else keep
+        current = self.current()
+        for name in self.list():
+            if name < current and not os.path.exists(os.path.join(self.path(name), ACTIVATED_FILE)):
+                shutil.rmtree(self.path(name), ignore_errors=True)  # an interrupted build
+        older = [name for name in self.list(activated_only=True) if name < current]
+        for name in older[:max(0, len(older) - keep)]:
+            shutil.rmtree(self.path(name), ignore_errors=True)
+
+    def discard(self, path: str):
+        """Delete a staging version that failed."""
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def validate_store(store: FAISSVectorStore, expected_rows: int, n_queries: int = None, k: int = 5):
+    """
+    Check a freshly built store before it is activated: the index and the chunk store must
+    both hold `expected_rows` rows, and sample chunks searched by their own stored vector
+    (no embedding calls) must find themselves in the top k.
+    """
+    n_queries = settings.FAISS_VALIDATION_QUERIES if n_queries is None else n_queries
+    if store.ntotal != expected_rows:
+        raise IndexValidationError(f"index holds {store.ntotal} vectors, expected {expected_rows}")
+    if len(store.chunk_store) != expected_rows:
+        raise IndexValidationError(f"chunk store holds {len(store.chunk_store)} chunks, expected {expected_rows}")
+    if store.full_vectors is None or not expected_rows:
+        return
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(expected_rows, size=min(n_queries, expected_rows), replace=False)
+    found = 0
+    for row in rows:
+        query = np.asarray(store.full_vectors.vectors[row])
+        hits = store.similarity_search_with_score_by_vector(query, k)
+        expected = store.chunk_store.get(int(row))
+        found += any(doc.page_content == expected.page_content for doc, _ in hits)
+    if found < 0.9 * len(rows):
+        raise IndexValidationError(f"only {found} of {len(rows)} sample chunks retrieve themselves in the top {k}")
@@ -0,0 +1,261 @@
+"""
+this file measures ingestion performance: it runs the SemanticChunkingService and FAISSIndexService
+over sample DOCX files or a generated corpus, with the local hashing embedder standing in for the
+embedding API (no network, no cost, no cache), and reports per stage the wall time, CPU time (of this
+process and of the parsing workers), peak RSS of this process, chunks per second, embedding calls and
+tokens, and the bytes of the index on disk.
+the stages (parse, chunk, dedup, embed, index) are first run one after the other so their costs can be
+told apart, then the whole streaming pipeline (build_from_files) is run end to end. the JSON results
+carry the git commit, so runs of different commits can be compared (--baseline prints the ratios).
+
+usage (from the project root):
+    python -m services.ingest_benchmark --files services/source_doc --json ingest.json
+    python -m services.ingest_benchmark --synthetic 200 --baseline ingest.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from typing import List
+from xml.sax.saxutils import escape
+
+from core import settings
+from core.metrics import current_rss_bytes
+from .chunker_benchmark import synthetic_texts
+from .embedding_service import EmbeddingService, HashEmbeddingBackend, set_embedding_service
+from .index_benchmark import format_report
+
+RSS_SAMPLE_SECONDS = 0.01
+SENTENCES_PER_PARAGRAPH = 5
+
+_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                  '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                  '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                  '<Default Extension="xml" ContentType="application/xml"/>'
+                  '<Override PartName="/word/document.xml" '
+                  'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                  '</Types>')
+_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+         'Target="word/document.xml"/></Relationships>')
+
+
+def write_docx(path: str, paragraphs: List[str]):
+    """A minimal DOCX file holding the paragraphs."""
+    body = "".join(f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _RELS)
+        archive.writestr("word/document.xml", document)
+
+
+def synthetic_corpus(directory: str, n_files: int) -> List[str]:
+    """Generate n_files DOCX files of topic-switching text (see chunker_benchmark) and return their paths."""
+    paths = []
+    for i, text in enumerate(synthetic_texts(n_files)):
+        sentences = [sentence + "." for sentence in text.split(". ")]
+        paragraphs = [" ".join(sentences[j:j + SENTENCES_PER_PARAGRAPH])
+                      for j in range(0, len(sentences), SENTENCES_PER_PARAGRAPH)]
+        paths.append(os.path.join(directory, f"synthetic_{i:05d}.docx"))
+        write_docx(paths[-1], paragraphs)
+    return paths
+
+
+def docx_paths(paths: List[str]) -> List[str]:
+    """The DOCX files given, directories expanded."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".docx"))
+        else:
+            files.append(path)
+    return files
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def worker_cpu_seconds() -> float:
+    """CPU time used so far by the DOCX parsing worker processes (0 where /proc is unavailable)."""
+    from . import semantic_chunking
+    pool = semantic_chunking._parse_pool
+    total = 0.0
+    for pid in list(getattr(pool, "_processes", None) or {}):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+
+class StageProfiler:
+    """Wall time, CPU time, peak RSS and embedding usage of each stage."""
+    def __init__(self, embeddings: EmbeddingService):
+        self.embeddings = embeddings
+        self.results = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Profile the block; it fills the yielded dict with "chunks" (and "index_bytes" if it builds an index)."""
+        record = {"chunks": 0, "index_bytes": 0}
+        peak, stop = [current_rss_bytes()], threading.Event()
+
+        def sample():
+            while not stop.wait(RSS_SAMPLE_SECONDS):
+                peak[0] = max(peak[0], current_rss_bytes())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        calls, tokens = self.embeddings.stats["api_calls"], self.embeddings.stats["tokens"]
+        workers = worker_cpu_seconds()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stop.set()
+            sampler.join()
+            self.results.append({
+                "stage": name,
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu, 3),
+                "worker_cpu_s": round(max(0.0, worker_cpu_seconds() - workers), 3),
+                "peak_rss_mb": round(max(peak[0], current_rss_bytes()) / 2 ** 20, 1),
+                "chunks": record["chunks"],
+                "chunks_per_s": round(record["chunks"] / wall, 1) if wall else 0.0,
+                "embed_calls": self.embeddings.stats["api_calls"] - calls,
+                "embed_tokens": self.embeddings.stats["tokens"] - tokens,
+                "index_mb": round(record["index_bytes"] / 2 ** 20, 2),
+            })
+
+
+async def benchmark_ingestion(files: List[str], workdir: str, dimensions: int = 3072) -> list:
+    """Profile every ingestion stage over the files, then the streaming pipeline."""
+    from .semantic_chunking import SemanticChunkingService
+    from .faiss_index import FAISSIndexService
+    from .vector_store import StoreBuilder
+    from .dedup import Deduplicator
+
+    embeddings = EmbeddingService(HashEmbeddingBackend(dimensions))
+    set_embedding_service(embeddings)
+    settings.FAISS_INDEX_PATH = os.path.join(workdir, "index")
+    service = SemanticChunkingService()
+    profiler = StageProfiler(embeddings)
+    limit = asyncio.Semaphore(settings.INGEST_MAX_FILES_IN_FLIGHT)
+
+    async def bounded(coroutine):
+        async with limit:
+            return await coroutine
+
+    # start the worker processes before timing
+    await service.aparse_file(files[0])
+
+    with profiler.stage("parse"):
+        parsed = await asyncio.gather(*(bounded(service.aparse_file(path)) for path in files))
+    with profiler.stage("chunk") as record:
+        documents = await asyncio.gather(*(bounded(service.achunk_parsed(result, os.path.basename(path)))
+                                           for result, path in zip(parsed, files)))
+        documents = [doc for docs in documents for doc in docs]
+        record["chunks"] = len(documents)
+    del parsed
+    with profiler.stage("dedup") as record:
+        dedup = Deduplicator()
+        documents = [doc for doc in documents
+                     if dedup.add(service.chunk_content(doc), doc.metadata["source"]) is not None]
+        record["chunks"] = len(documents)
+    with profiler.stage("embed") as record:
+        texts = [doc.page_content for doc in documents]
+        vectors = []
+        for start in range(0, len(texts), settings.INGEST_EMBED_BATCH):
+            vectors += await embeddings.aembed_documents(texts[start:start + settings.INGEST_EMBED_BATCH])
+        record["chunks"] = len(vectors)
+    with profiler.stage("index") as record:
+        path = os.path.join(workdir, "staged_index")
+        builder = StoreBuilder(path, embeddings, dimensions=settings.EMBEDDING_DIMENSIONS)
+        for start in range(0, len(texts), settings.INGEST_EMBED_BATCH):
+            end = start + settings.INGEST_EMBED_BATCH
+            builder.add(texts[start:end], vectors[start:end], [doc.metadata for doc in documents[start:end]])
+        store = builder.finish()
+        store.close()
+        record["chunks"], record["index_bytes"] = builder.n_rows, directory_bytes(path)
+    del documents, texts, vectors
+
+    with profiler.stage("pipeline") as record:
+        store = await FAISSIndexService("benchmark").build_from_files(files, service)
+        if store is not None:
+            record["chunks"], record["index_bytes"] = store.ntotal, directory_bytes(store.folder_path)
+            store.close()
+    return profiler.results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline: list) -> list:
+    """Wall time, CPU time and peak RSS of each stage relative to a baseline run (below 1 is better)."""
+    previous = {result["stage"]: result for result in baseline}
+    ratios = []
+    for result in results:
+        before = previous.get(result["stage"])
+        if before is None:
+            continue
+        ratios.append({"stage": result["stage"], **{
+            f"{key}_ratio": round(result[key] / before[key], 2) if before[key] else None
+            for key in ("wall_s", "cpu_s", "peak_rss_mb")}})
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage profile of DOCX ingestion with a local embedder.")
+    parser.add_argument("--files", nargs="*", default=[], help="DOCX files or directories of them.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of generated DOCX files to ingest.")
+    parser.add_argument("--dimensions", type=int, default=3072, help="Size of the stand-in embeddings.")
+    parser.add_argument("--json", help="Optional path to also write the results as JSON.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        files = docx_paths(args.files)
+        if args.synthetic:
+            os.makedirs(os.path.join(workdir, "corpus"))
+            files += synthetic_corpus(os.path.join(workdir, "corpus"), args.synthetic)
+        if not files:
+            parser.error("give --files or --synthetic")
+        # the services report every file they process; only the results are printed
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(benchmark_ingestion(files, workdir, args.dimensions))
+    print(format_report(results))
+
+    report = {"commit": git_commit(), "files": len(files), "synthetic": args.synthetic,
+              "dimensions": args.dimensions, "cpus": os.cpu_count(), "stages": results}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} (commit {baseline.get('commit')}):")
+        print(format_report(compare(results, baseline["stages"])))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
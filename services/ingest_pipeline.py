@@ -0,0 +1,128 @@
+"""
+this file contains the streaming ingestion pipeline used by full builds of a shard.
+files go through four stages joined by bounded queues (INGEST_QUEUE_SIZE items each):
+parse (worker processes) -> chunk (semantic chunking, then near-duplicate removal, see dedup)
+-> embed (batches of INGEST_EMBED_BATCH chunks; with EMBEDDING_POOLED_CHUNKS the pooled vectors of the
+kept chunks are handed to the embedding service right before their batch) -> index (StoreBuilder, which writes chunks and vectors
+to disk as they arrive).
+a stage waits while the queue after it is full, so only the files and chunks in flight are held in
+memory whatever the size of the corpus, and parsing, chunking, embedding and indexing overlap.
+"""
+import asyncio
+import os
+from typing import List, Optional
+
+from core import settings
+from .vector_store import StoreBuilder
+from .dedup import Deduplicator
+
+# put once per consumer of a queue when its producers are done
+_DONE = object()
+
+
+class IngestionPipeline:
+    """Parses, chunks and embeds DOCX files into a StoreBuilder, streaming."""
+    def __init__(self, semantic_service, builder: StoreBuilder, job=None):
+        self.semantic_service = semantic_service
+        self.embeddings_model = semantic_service.embeddings_model
+        self.builder = builder
+        self.job = job
+        self.dedup = Deduplicator()
+        self.stats = {"files": 0, "chunks": 0, "duplicate_chunks": 0}
+
+    def _progress(self, key: str, amount: int = 1):
+        self.stats[key] += amount
+        if self.job is not None:
+            self.job.increment(f"ingested_{key}", amount)
+
+    async def run(self, filepaths: List[str], sources: Optional[List[str]] = None) -> dict:
+        """
+        Ingest the files, their chunks named by `sources` (the file names by default), and return the
+        number of files and chunks added to the builder.
+        """
+        n_parsers = max(1, min(settings.INGEST_MAX_FILES_IN_FLIGHT, len(filepaths)))
+        n_chunkers = n_parsers
+        n_embedders = max(1, settings.EMBEDDING_MAX_IN_FLIGHT)
+        files = iter(zip(filepaths, sources or [os.path.basename(filepath) for filepath in filepaths]))
+        parsed = asyncio.Queue(settings.INGEST_QUEUE_SIZE)
+        chunks = asyncio.Queue(settings.INGEST_QUEUE_SIZE)
+        vectors = asyncio.Queue(settings.INGEST_QUEUE_SIZE)
+        rows = []  # row id of every kept chunk, by its dedup number
+
+        async def parse():
+            for filepath, source in files:
+                await parsed.put((source, await self.semantic_service.aparse_file(filepath)))
+
+        async def chunk():
+            while (item := await parsed.get()) is not _DONE:
+                source, result = item
+                documents, pooled = await self.semantic_service.achunk_parsed(result, source, pooled=True)
+                for doc, vector in zip(documents, pooled):
+                    k = self.dedup.add(self.semantic_service.chunk_content(doc), doc.metadata["source"])
+                    if k is None:
+                        self._progress("duplicate_chunks")
+                    else:
+                        await chunks.put((k, doc, vector))
+                self._progress("files")
+
+        async def embed():
+            done = False
+            while not done:
+                batch = []
+                # wait for the first chunk of a batch, then take whatever is already queued
+                while len(batch) < settings.INGEST_EMBED_BATCH and (not batch or not chunks.empty()):
+                    item = await chunks.get()
+                    if item is _DONE:
+                        done = True
+                        break
+                    batch.append(item)
+                if batch:
+                    texts = [doc.page_content for _, doc, _ in batch]
+                    if settings.EMBEDDING_POOLED_CHUNKS:
+                        await asyncio.to_thread(self.semantic_service.provide_pooled_vectors,
+                                                [doc for _, doc, _ in batch], [vector for *_, vector in batch])
+                    try:
+                        embeddings = await self.embeddings_model.aembed_documents(texts)
+                    finally:
+                        if settings.EMBEDDING_POOLED_CHUNKS:
+                            self.embeddings_model.withdraw(texts)
+                    await vectors.put((batch, embeddings))
+
+        async def index():
+            while (item := await vectors.get()) is not _DONE:
+                batch, embeddings = item
+                row_ids = await asyncio.to_thread(self.builder.add, [doc.page_content for _, doc, _ in batch],
+                                                  embeddings, [doc.metadata for _, doc, _ in batch])
+                for (k, *_), row_id in zip(batch, row_ids):
+                    rows.extend([None] * (k + 1 - len(rows)))
+                    rows[k] = row_id
+                self._progress("chunks", len(batch))
+
+        async def stage(worker, n_workers, queue, n_consumers):
+            """Run n_workers copies of a stage, then tell the next stage's consumers it is done."""
+            await asyncio.gather(*(worker() for _ in range(n_workers)))
+            for _ in range(n_consumers):
+                await queue.put(_DONE)
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(stage(parse, n_parsers, parsed, n_chunkers))
+                group.create_task(stage(chunk, n_chunkers, chunks, n_embedders))
+                group.create_task(stage(embed, n_embedders, vectors, 1))
+                group.create_task(index())
+        except ExceptionGroup as errors:
+            # report the failure itself; the other stages were cancelled because of it
+            raise errors.exceptions[0]
+        await asyncio.to_thread(self._merge_duplicate_sources, rows)
+        print(f"Ingested {self.stats['files']} files into {self.stats['chunks']} chunks "
+              f"({self.stats['duplicate_chunks']} near-duplicate chunks dropped).")
+        return dict(self.stats)
+
+    def _merge_duplicate_sources(self, rows: List[int]):
+        """Add the sources of the dropped copies to the metadata of the chunks that were kept."""
+        kept = {rows[k]: sources for k, sources in self.dedup.merged.items()}
+        if not kept:
+            return
+        updates = [(doc_row, Deduplicator.merge_sources(doc.metadata, kept[doc_row]))
+                   for doc_row, doc in zip(kept, self.builder.chunk_store.get_many(list(kept)))]
+        self.builder.chunk_store.update_metadata(updates)
@@ -0,0 +1,82 @@
+"""
+this file keeps track of the long-running background jobs (Drive syncs and rebuilds) started by the API,
+so their progress, result or error can be polled at /jobs/{job_id}. jobs live in memory and the most
+recent MAX_JOBS are kept.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+MAX_JOBS = 100
+
+
+class Job:
+    """One background job; `progress` is a free-form dict updated while it runs."""
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "pending"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+
+    def increment(self, key: str, amount: float = 1):
+        with self._lock:
+            self.progress[key] = self.progress.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"job_id": self.id, "kind": self.kind, "params": self.params, "status": self.status,
+                    "progress": dict(self.progress), "result": self.result, "error": self.error,
+                    "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at}
+
+
+class JobRegistry:
+    """The recent jobs by id."""
+    def __init__(self, max_jobs: int = MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, kind: str, **params) -> Job:
+        job = Job(kind, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    async def run(self, job: Job, coroutine):
+        """Await `coroutine` as the body of `job`, recording its result or error."""
+        job.status, job.started_at = "running", time.time()
+        try:
+            job.result = await coroutine
+            job.status = "succeeded"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+            print(f"Job {job.kind} {job.id} failed: {job.error}")
+        finally:
+            job.finished_at = time.time()
+
+
+jobs = JobRegistry()
@@ -0,0 +1,84 @@
+"""
+this file resolves metadata filters (source file, project, language, document type) to row-id bitmaps
+that are applied inside the FAISS search with an id selector.
+every filterable value describes a whole source file, so its bitmap is built from the row-id ranges
+in the source catalog, never from the chunks. bitmaps are cached until the catalog changes.
+searches run in several threads while writers change the catalog: a bitmap is built from a copy of
+the catalog entries, and the cache is only touched under a lock.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+import numpy as np
+
+from .source_catalog import SourceCatalog, ATTRIBUTE_KEYS
+
+FILTER_FIELDS = ("source", "filename") + ATTRIBUTE_KEYS
+# selects the shards a query searches (see shards); not a field of the store's metadata
+SHARD_FIELD = "shard"
+# cached (field, value) bitmaps; each takes n_rows / 8 bytes
+MAX_CACHED_BITMAPS = 256
+
+
+def entry_value(entry: dict, field: str):
+    if field in ("source", "filename"):
+        return entry[field]
+    return entry["attributes"].get(field)
+
+
+def check_filter(filter: Optional[dict], sharded: bool = False):
+    """Raise ValueError for a filter on a field that cannot be filtered on ("shard" only for a sharded search)."""
+    fields = FILTER_FIELDS + ((SHARD_FIELD,) if sharded else ())
+    for field in filter or {}:
+        if field not in fields:
+            raise ValueError(f"Cannot filter on {field!r}, expected one of {fields}.")
+
+
+class MetadataFilterIndex:
+    """Packed row-id bitmaps (bit i set = row i matches) per filter field and value."""
+    def __init__(self, catalog: SourceCatalog):
+        self.catalog = catalog
+        self._bitmaps = OrderedDict()
+        self._key = None
+        self._lock = threading.Lock()
+
+    def _value_bitmap(self, field: str, value, n_rows: int) -> np.ndarray:
+        # read before the entries, so a bitmap built while the catalog changes is cached under the old revision
+        key = (self.catalog.revision, n_rows)
+        with self._lock:
+            if key != self._key:
+                self._bitmaps.clear()
+                self._key = key
+            bitmap = self._bitmaps.get((field, value))
+            if bitmap is not None:
+                self._bitmaps.move_to_end((field, value))
+                return bitmap
+        mask = np.zeros(n_rows, dtype=bool)
+        for entry in list(self.catalog.entries.values()):
+            if entry_value(entry, field) == value:
+                for start, end in entry["row_ranges"]:
+                    mask[start:end] = True
+        bitmap = np.packbits(mask, bitorder="little")
+        with self._lock:
+            if key == self._key:
+                self._bitmaps[(field, value)] = bitmap
+                if len(self._bitmaps) > MAX_CACHED_BITMAPS:
+                    self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def bitmap(self, filter: Dict[str, Union[str, List[str]]], n_rows: int) -> Optional[np.ndarray]:
+        """
+        The packed bitmap of the rows matching `filter` ({field: value or list of values}):
+        values of one field are OR-ed, fields are AND-ed. None when the filter is empty.
+        """
+        check_filter(filter)
+        result = None
+        for field, values in filter.items():
+            if values is None:
+                continue
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            field_bitmap = np.zeros((n_rows + 7) // 8, dtype="uint8")
+            for value in values:
+                field_bitmap |= self._value_bitmap(field, value, n_rows)
+            result = field_bitmap if result is None else result & field_bitmap
+        return result
@@ -0,0 +1,102 @@
+"""
+this file keeps the embedding service within the account's requests-per-minute and tokens-per-minute limits.
+both budgets are token buckets refilled continuously; every call waits until its request and its
+tokens fit. the buckets are corrected from the x-ratelimit-* response headers, a 429 pauses all calls
+for its retry-after time, and the token size of a batch adapts: halved after a 429, grown back slowly
+after successful calls. queries take from the budgets without waiting for them (only a 429 pause holds
+them back), so a bulk backlog does not delay them; the bulk calls wait for what the queries used.
+it is used from the embedding service's event loop only, so it needs no locks.
+"""
+import asyncio
+import re
+import time
+from typing import Mapping, Optional
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds in an OpenAI reset duration such as "1s", "6m0s" or "120ms"."""
+    parts = _DURATION_PART.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+class _Bucket:
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # a single request larger than the bucket only waits for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+
+class RateLimiter:
+    """Request and token budgets per minute (0 disables a budget) with an adaptive batch token size."""
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_batch_tokens: int):
+        self.requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_tokens = max_batch_tokens
+        self.paused_until = 0.0
+        self.waited_seconds = 0.0
+
+    def _buckets(self):
+        return [bucket for bucket in (self.requests, self.tokens) if bucket is not None]
+
+    async def acquire(self, tokens: int):
+        """Wait until one request of `tokens` tokens fits the budgets, then take it from them."""
+        while True:
+            now = time.monotonic()
+            for bucket in self._buckets():
+                bucket.refill(now)
+            wait = max([self.paused_until - now]
+                       + [bucket.wait_time(amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens))
+                          if bucket is not None])
+            if wait <= 0:
+                break
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= min(tokens, self.tokens.capacity)
+
+    async def take(self, tokens: int):
+        """Take one request of `tokens` tokens from the budgets without waiting for them (only for a 429 pause)."""
+        wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+        now = time.monotonic()
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                bucket.level -= min(amount, bucket.capacity)
+
+    def observe_headers(self, headers: Mapping[str, str]):
+        """Lower the buckets to what the API reports as remaining."""
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if bucket is not None and remaining is not None and remaining.isdigit():
+                bucket.level = min(bucket.level, float(remaining))
+
+    def on_rate_limited(self, retry_after: Optional[float]):
+        """A 429: pause every call and halve the batch size."""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + (retry_after or 1.0))
+        for bucket in self._buckets():
+            bucket.level, bucket.updated = 0.0, now
+        self.batch_tokens = max(1, self.batch_tokens // 2)
+
+    def on_success(self):
+        self.batch_tokens = min(self.max_batch_tokens, int(self.batch_tokens * 1.1) + 1)
@@ -0,0 +1,79 @@
+"""
+this file re-ranks the retrieved chunks locally, without any network call, before they go to the LLM.
+each candidate is scored by the exact cosine between its stored full-precision vector and the query,
+by how many terms of the refined and original question it contains (weighted by how rare each term is
+among the candidates), and picked greedily with a penalty for sources that are already represented.
+everything is vectorized over the candidate set, so re-ranking ~50 chunks takes about a millisecond.
+"""
+import re
+from typing import List, Optional
+import numpy as np
+from langchain_core.documents import Document
+
+from core import settings
+
+# words of at least two letters or digits, in any script (Arabic included)
+TERM_PATTERN = re.compile(r"[^\W_]{2,}")
+
+
+def terms(text: str) -> set:
+    return set(TERM_PATTERN.findall(text.lower()))
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min()
+    if spread <= 0:
+        return np.zeros_like(scores)
+    return (scores - scores.min()) / spread
+
+
+class Reranker:
+    """Semantic + lexical + source-diversity re-ranking of retrieval candidates."""
+    def __init__(self, semantic_weight: float = None, lexical_weight: float = None, diversity_penalty: float = None):
+        self.semantic_weight = settings.RERANK_SEMANTIC_WEIGHT if semantic_weight is None else semantic_weight
+        self.lexical_weight = settings.RERANK_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+        self.diversity_penalty = settings.RERANK_DIVERSITY_PENALTY if diversity_penalty is None else diversity_penalty
+
+    @staticmethod
+    def semantic_scores(query: np.ndarray, vectors: Optional[np.ndarray], distances: np.ndarray) -> np.ndarray:
+        """Exact cosine similarity to the query, or the negated first-pass distance without stored vectors."""
+        if vectors is None:
+            return -distances
+        query = np.asarray(query, dtype="float32")
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        norms[norms == 0] = 1.0
+        return vectors @ query / norms
+
+    @staticmethod
+    def lexical_scores(docs: List[Document], questions: List[str]) -> np.ndarray:
+        """Fraction of the (rarity-weighted) question terms found in each candidate."""
+        query_terms = sorted(set().union(*(terms(question) for question in questions if question)))
+        if not query_terms:
+            return np.zeros(len(docs))
+        doc_terms = [terms(doc.page_content) for doc in docs]
+        present = np.array([[term in chunk_terms for term in query_terms] for chunk_terms in doc_terms], dtype=bool)
+        # terms found in every candidate (e.g. the project name) say little about which one is best
+        idf = np.log((len(docs) + 1) / (present.sum(axis=0) + 1)) + 1.0
+        return present @ idf / idf.sum()
+
+    def rerank(self, query: np.ndarray, docs: List[Document], vectors: Optional[np.ndarray], distances: np.ndarray,
+               questions: List[str], top_n: int = None) -> List[Document]:
+        """Return the best `top_n` candidates, best first."""
+        top_n = settings.RERANK_TOP_N if top_n is None else top_n
+        if not docs:
+            return []
+        scores = (self.semantic_weight * _min_max(self.semantic_scores(query, vectors, distances))
+                  + self.lexical_weight * _min_max(self.lexical_scores(docs, questions)))
+
+        _, source_ids = np.unique([doc.metadata.get("source") or doc.metadata.get("filename") or ""
+                                   for doc in docs], return_inverse=True)
+        picked_per_source = np.zeros(source_ids.max() + 1)
+        available = np.ones(len(docs), dtype=bool)
+        selected = []
+        for _ in range(min(top_n, len(docs))):
+            adjusted = np.where(available, scores - self.diversity_penalty * picked_per_source[source_ids], -np.inf)
+            best = int(np.argmax(adjusted))
+            selected.append(best)
+            available[best] = False
+            picked_per_source[source_ids[best]] += 1
+        return [docs[i] for i in selected]
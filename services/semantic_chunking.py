@@ -1,24 +1,91 @@
 """
 this service is responsible for chunking the text into Semantic parts for processing and embedding
-and saving the documents into a json file to be used by the faiss index service
+by the ingestion pipeline and the per-file updates of the faiss index service
+DOCX parsing, hashing and sentence splitting are CPU-bound and run in a pool of worker processes
+(INGEST_WORKERS); the sentence embeddings are requested asynchronously from this process.
+documents are read paragraph by paragraph (see docx_reader) and split into sentences one paragraph at
+a time, so the full text of a document is never held as one string.
 """
 import os
 import re
-import json
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_community.document_loaders import Docx2txtLoader
+import hashlib
+import random
+import numpy as np
+from langchain_core.documents import Document
 # from langchain_community.embeddings import OpenAIEmbeddings
 from core import settings
 import asyncio
-from langchain_openai import OpenAIEmbeddings
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from .embedding_service import get_embedding_service
+from .chunker import SemanticChunker, split_sentences
+from .docx_reader import iter_docx_blocks
+
+# put in front of every chunk's text, so the embedding and the LLM see which developer it is about
+CONTENT_PREFIX = "this data is from {} source and the content is "
+
+def content_hash(text):
+    """ Hash of a document's text, used to skip re-ingesting unchanged files. """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def letter_counts(text):
+    """ Number of Arabic and of Latin letters in the text. """
+    arabic = sum(1 for c in text if 0x0600 <= ord(c) <= 0x06FF)
+    latin = sum(1 for c in text if c.isascii() and c.isalpha())
+    return arabic, latin
+
+def load_docx_text(filepath):
+    """ The text of a DOCX file, one paragraph or table row per line. """
+    return "\n".join(iter_docx_blocks(filepath))
+
+def parse_paragraphs(paragraphs):
+    """
+    Hash, count and sentence-split a text given paragraph by paragraph. The hash is content_hash of the
+    paragraphs joined by newlines; a paragraph always ends a sentence.
+    The hash differs from the one taken of the Docx2txtLoader text before docx_reader, so after that
+    upgrade every file is seen as changed and re-ingested once (by the next upload or Drive sync).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    sentences, words, arabic, latin = [], 0, 0, 0
+    for i, paragraph in enumerate(paragraphs):
+        digest.update((("\n" if i else "") + paragraph).encode("utf-8"))
+        if paragraph.strip():
+            sentences += split_sentences(paragraph.strip())
+        words += len(paragraph.split())
+        counts = letter_counts(paragraph)
+        arabic, latin = arabic + counts[0], latin + counts[1]
+    return {"content_hash": digest.hexdigest(), "sentences": sentences, "words": words,
+            "language": "ar" if arabic > latin else "en"}
+
+def parse_file(filepath):
+    """ Stream, hash and sentence-split a DOCX file (runs in a worker process). """
+    return parse_paragraphs(iter_docx_blocks(filepath))
+
+_parse_pool = None
+
+def parse_pool():
+    """ The process pool parsing DOCX files, started on first use. """
+    global _parse_pool
+    if _parse_pool is None:
+        # forkserver: the workers do not inherit this process's threads (embedding loop, faiss)
+        _parse_pool = ProcessPoolExecutor(max_workers=settings.INGEST_WORKERS or os.cpu_count(),
+                                          mp_context=multiprocessing.get_context("forkserver"))
+    return _parse_pool
+
+def shutdown_parse_pool():
+    """ Stop the parsing worker processes (on application shutdown). """
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+        _parse_pool = None
+
 #--- Define the SemanticChunkingService class ---
 class SemanticChunkingService:
     def __init__(self):
-        self.embeddings_model = OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL)
-        self.chunker = SemanticChunker(self.embeddings_model, 
-                                       breakpoint_threshold_type="gradient", 
+        self.embeddings_model = get_embedding_service()
+        self.chunker = SemanticChunker(self.embeddings_model,
+                                       breakpoint_threshold_type="gradient",
                                        breakpoint_threshold_amount=settings.BREAKPOINT_THRESHOLD,
-                                       number_of_chunks=None,
                                        min_chunk_size=settings.MIN_CHUNK_SIZE)
 
     def clean_text(self, text):
@@ -27,45 +94,84 @@ class SemanticChunkingService:
         text = re.sub(r'\s+', ' ', text)
         return text.strip()
 
-    def process_file(self,filepath):
-        """ Process a single file to calculate chunks and create documents. """
-        loader = Docx2txtLoader(filepath)
-        raw_docs = loader.load()
-        full_text = "\n".join([doc.page_content for doc in raw_docs])
+    async def achunk_parsed(self, parsed, source, attributes=None, pooled=False):
+        """
+        Split a parse_file result (the text of one source file) into documents, embedding the sentences
+        without blocking the event loop.
+        attributes (e.g. project, doc_type) are added to the metadata of every chunk, next to the detected language.
+        With pooled, returns the documents and their pooled vectors and leaves providing them to the caller
+        (the ingestion pipeline provides them only for the chunks it keeps, right before embedding them).
+        """
+        sentences = parsed["sentences"]
+        if not sentences:
+            return ([], []) if pooled else []
+        windows = self.chunker.windows(sentences)
+        embeddings = await self.embeddings_model.aembed_documents(windows) if windows else None
+        chunks, vectors = self.chunker.split_embedded(sentences, embeddings, number_of_chunks=self._n_chunks(parsed, source))
+        documents = self._documents(chunks, parsed, source, attributes)
+        if pooled:
+            return documents, vectors
+        if settings.EMBEDDING_POOLED_CHUNKS:
+            await asyncio.to_thread(self.provide_pooled_vectors, documents, vectors)
+        return documents
 
-        word_count = len(full_text.split())
+    def _n_chunks(self, parsed, source):
+        word_count = parsed["words"]
         avg_chunk_size = 80  # words
         n_chunks = max(1, word_count // avg_chunk_size)
-        print(f"Processing {filepath} with {word_count} words and {n_chunks} chunks.")
+        print(f"Processing {source} with {word_count} words and {n_chunks} chunks.")
+        return n_chunks
 
-        self.chunker.number_of_chunks = n_chunks
-        filename = os.path.basename(filepath).split(".")[0]#[:-5]
-        documents = self.chunker.create_documents([full_text], metadatas=[{"filename": filename}])
+    def _documents(self, chunks, parsed, source, attributes):
+        filename = source.split(".")[0]#[:-5]
+        metadata = {"filename": filename, "source": source, "content_hash": parsed["content_hash"],
+                    "language": parsed["language"], **(attributes or {})}
+        documents = [Document(page_content=chunk, metadata=dict(metadata)) for chunk in chunks]
         for doc in documents:
             doc.page_content = self.clean_text(doc.page_content)  
             # add metadata into page content
-            doc.page_content = f"this data is from {doc.metadata['filename']} source and the content is {doc.page_content}"
+            doc.page_content = CONTENT_PREFIX.format(doc.metadata['filename']) + doc.page_content
         return documents
-    
-
-    async def process_directory(self,directory):
-            """ Process each DOCX file in the directory asynchronously. """
-            tasks = [asyncio.to_thread(self.process_file, os.path.join(directory, filename))
-                    for filename in os.listdir(directory) if filename.endswith('.docx')]
-            documents_lists = await asyncio.gather(*tasks)
-            all_documents = [doc for sublist in documents_lists for doc in sublist]  # Flatten
-            return all_documents
-    
-    async def process_directory(self,directory):
-            """ Process each DOCX file in the directory asynchronously. """
-            tasks = [asyncio.to_thread(self.process_file, os.path.join(directory, filename))
-                    for filename in os.listdir(directory) if filename.endswith('.docx')]
-            documents_lists = await asyncio.gather(*tasks)
-            all_documents = [doc for sublist in documents_lists for doc in sublist]  # Flatten
-            return all_documents
-        
-    def save_documents_to_json(self,documents, filename):                                    
-        """ Save a list of Document objects to a JSON file. """
-        docs_dict = [{'content': doc.page_content, 'metadata': doc.metadata} for doc in documents]
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(docs_dict, f, indent=4, ensure_ascii=False)
+
+    def chunk_content(self, doc):
+        """ The text of a chunk without the CONTENT_PREFIX. """
+        prefix = CONTENT_PREFIX.format(doc.metadata.get('filename'))
+        return doc.page_content[len(prefix):] if doc.page_content.startswith(prefix) else doc.page_content
+
+    def provide_pooled_vectors(self, documents, vectors):
+        """
+        Hand the pooled chunk vectors to the embedding service, so indexing the documents makes no
+        embedding calls for them. A sample (EMBEDDING_POOLED_VERIFY_SAMPLE) is re-embedded instead,
+        to measure how far the pooled vectors drift from real chunk embeddings.
+        """
+        pooled = [(doc.page_content, vector) for doc, vector in zip(documents, vectors) if vector is not None]
+        if not pooled:
+            return
+        n_sample = int(round(len(pooled) * settings.EMBEDDING_POOLED_VERIFY_SAMPLE))
+        if n_sample:
+            sample = random.sample(range(len(pooled)), n_sample)
+            exact = np.asarray(self.embeddings_model.embed_documents([pooled[i][0] for i in sample]), dtype="float32")
+            approx = np.asarray([pooled[i][1] for i in sample])
+            cosine = np.sum(exact * approx, axis=1) / np.linalg.norm(exact, axis=1)
+            self.embeddings_model.record_drift(1.0 - cosine)
+            print(f"Pooled chunk vectors: mean drift {1.0 - cosine.mean():.4f}, max {1.0 - cosine.min():.4f} "
+                  f"(1 - cosine, {n_sample} sampled chunks).")
+            sampled = set(sample)
+            pooled = [item for i, item in enumerate(pooled) if i not in sampled]
+        self.embeddings_model.provide([text for text, _ in pooled], [vector for _, vector in pooled])
+
+    async def aparse_file(self, filepath):
+        """ parse_file in the worker process pool. """
+        return await asyncio.get_running_loop().run_in_executor(parse_pool(), parse_file, filepath)
+
+    async def aprocess_file(self, filepath, source_name=None, attributes=None):
+        """
+        Parse (in a worker process) and chunk a single file into documents.
+        source_name is the original file name when `filepath` is a temporary copy.
+        """
+        parsed = await self.aparse_file(filepath)
+        return await self.achunk_parsed(parsed, source_name or os.path.basename(filepath), attributes)
+
+    def list_docx_files(self, directory):
+        """ Paths of the DOCX files in the directory. """
+        return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if filename.endswith('.docx')]
@@ -0,0 +1,114 @@
+"""
+this file splits the vector store into named shards (for example one per developer or Drive folder).
+every shard is a FAISSIndexService of its own: built, versioned, persisted and reloaded independently,
+so rebuilding one shard costs as much as that shard. a query fans out to the relevant shards in
+parallel threads (faiss releases the GIL while searching) and the hits are merged by distance.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+from core import settings
+from .embedding_service import get_embedding_service
+from .faiss_index import FAISSIndexService
+from .index_versions import list_shards, migrate_unsharded, shard_path
+from .metadata_filter import SHARD_FIELD
+from .vector_store import FAISSVectorStore
+
+_search_pool = None
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _search_pool
+    if _search_pool is None:
+        _search_pool = ThreadPoolExecutor(max_workers=settings.SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+    return _search_pool
+
+
+class ShardedVectorStore:
+    """Read-only view searching a set of shard stores as one."""
+    def __init__(self, embedding, stores: Dict[str, FAISSVectorStore]):
+        self.embedding = embedding
+        self.stores = stores
+
+    def _route(self, filter: Optional[Dict]) -> Tuple[List[FAISSVectorStore], Optional[Dict]]:
+        """The stores a query goes to (a "shard" filter key selects them) and the filter left for each store."""
+        filter = dict(filter or {})
+        names = filter.pop(SHARD_FIELD, None)
+        if names is None:
+            return list(self.stores.values()), filter or None
+        names = names if isinstance(names, (list, tuple, set)) else [names]
+        return [self.stores[name] for name in names if name in self.stores], filter or None
+
+    def _fan_out(self, stores: List[FAISSVectorStore], search) -> list:
+        if len(stores) == 1:
+            return [search(stores[0])]
+        return list(_pool().map(search, stores))
+
+    def candidates_by_vector(self, embedding: List[float], n: int,
+                             filter: Optional[Dict] = None) -> Tuple[List[Document], Optional[np.ndarray], np.ndarray]:
+        """The best `n` first-pass hits over the routed shards (see FAISSVectorStore.candidates_by_vector)."""
+        stores, filter = self._route(filter)
+        results = self._fan_out(stores, lambda store: store.candidates_by_vector(embedding, n, filter))
+        if not results:
+            return [], None, np.empty(0, dtype="float32")
+        docs = [doc for shard_docs, _, _ in results for doc in shard_docs]
+        distances = np.concatenate([shard_distances for _, _, shard_distances in results])
+        vectors = None
+        if all(shard_vectors is not None for _, shard_vectors, _ in results):
+            vectors = np.concatenate([shard_vectors for _, shard_vectors, _ in results])
+        order = np.argsort(distances)[:n]
+        return [docs[i] for i in order], vectors[order] if vectors is not None else None, distances[order]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        stores, filter = self._route(filter)
+        results = self._fan_out(stores, lambda store: store.similarity_search_with_score_by_vector(embedding, k, filter))
+        return sorted((hit for hits in results for hit in hits), key=lambda hit: hit[1])[:k]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        hits = self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter)
+        return [doc for doc, _ in hits]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        hits = await asyncio.to_thread(self.similarity_search_with_score_by_vector,
+                                       await self.embedding.aembed_query(query), k, filter)
+        return [doc for doc, _ in hits]
+
+
+class ShardManager:
+    """The FAISSIndexService of every shard, all using the process-wide embedding service."""
+    def __init__(self):
+        self.embeddings_model = get_embedding_service()
+        self.services: Dict[str, FAISSIndexService] = {}
+
+    def service(self, shard: str = None) -> FAISSIndexService:
+        """The service of a shard, created (empty) if the shard does not exist yet."""
+        shard = shard or settings.DEFAULT_SHARD
+        if shard not in self.services:
+            shard_path(shard)  # validates the name
+            self.services[shard] = FAISSIndexService(shard, self.embeddings_model)
+        return self.services[shard]
+
+    def store(self, shard: str = None) -> Optional[FAISSVectorStore]:
+        return self.service(shard).vector_store
+
+    def load_all(self) -> List[str]:
+        """Load every shard found on disk and return their names (called once, at startup)."""
+        migrate_unsharded()
+        names = list_shards()
+        for name in names:
+            self.service(name).load_index()
+        return names
+
+    def stores(self) -> Dict[str, FAISSVectorStore]:
+        """The loaded shard stores by name."""
+        return {name: service.vector_store for name, service in sorted(self.services.items())
+                if service.vector_store is not None}
+
+    def vector_store(self) -> Optional[ShardedVectorStore]:
+        """A view over all loaded shards, or None when there are none."""
+        stores = self.stores()
+        return ShardedVectorStore(self.embeddings_model, stores) if stores else None
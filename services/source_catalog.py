@@ -0,0 +1,177 @@
+"""
+this file contains the source catalog: one entry per ingested file with its chunk count, token count,
+content hash, ingestion time, filterable attributes (project, language, document type)
+and the row-id ranges of its chunks.
+the catalog is kept next to the chunks in the chunk store database and cached in memory,
+so reporting what the vector store contains never scans the chunks.
+"""
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import numpy as np
+
+from .chunk_store import ChunkStore, source_key
+from .tokens import count_tokens_batch
+
+# chunk metadata keys that describe the whole source file and can be used as search filters
+ATTRIBUTE_KEYS = ("project", "language", "doc_type")
+
+
+def to_ranges(row_ids: List[int]) -> List[List[int]]:
+    """Compress row ids into sorted [start, end) ranges."""
+    ranges = []
+    for row_id in sorted(row_ids):
+        if ranges and ranges[-1][1] == row_id:
+            ranges[-1][1] = row_id + 1
+        else:
+            ranges.append([row_id, row_id + 1])
+    return ranges
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and merged[-1][1] >= start:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def ranges_to_mask(ranges: List[List[int]], n_rows: int) -> np.ndarray:
+    """Boolean mask of length n_rows that is True inside the ranges."""
+    mask = np.zeros(n_rows, dtype=bool)
+    for start, end in ranges:
+        mask[start:end] = True
+    return mask
+
+
+def mask_to_ranges(mask: np.ndarray) -> List[List[int]]:
+    return to_ranges(np.flatnonzero(mask).tolist())
+
+
+def ranges_length(ranges: List[List[int]]) -> int:
+    return sum(end - start for start, end in ranges)
+
+
+class SourceCatalog:
+    """Per-source statistics of the chunks in a chunk store."""
+    def __init__(self, chunk_store: ChunkStore):
+        self.chunk_store = chunk_store
+        self._entries = None
+        # incremented on every change, so derived data (filter bitmaps) knows when to rebuild
+        self.revision = 0
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        """Catalog entries by source, read from the database on first use (and backfilled if missing)."""
+        if self._entries is None:
+            conn = self.chunk_store.conn
+            with self.chunk_store.lock, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, filename TEXT, chunk_count INTEGER, "
+                    "token_count INTEGER, content_hash TEXT, ingested_at TEXT, row_ranges TEXT, attributes TEXT)"
+                )
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(sources)")]
+                if "attributes" not in columns:
+                    conn.execute("ALTER TABLE sources ADD COLUMN attributes TEXT")
+                rows = conn.execute("SELECT * FROM sources").fetchall()
+            self._entries = {row[0]: self._from_row(row) for row in rows}
+            if not self._entries and len(self.chunk_store):
+                print("Building the source catalog from the chunk store...")
+                for source in self.chunk_store.sources():
+                    self._rebuild(source)
+        return self._entries
+
+    @staticmethod
+    def _from_row(row) -> dict:
+        source, filename, chunk_count, token_count, content_hash, ingested_at, row_ranges, attributes = row
+        return {"source": source, "filename": filename, "chunk_count": chunk_count, "token_count": token_count,
+                "content_hash": content_hash, "ingested_at": ingested_at, "row_ranges": json.loads(row_ranges),
+                "attributes": json.loads(attributes or "{}")}
+
+    @staticmethod
+    def _attributes(metadata: dict) -> dict:
+        return {key: metadata[key] for key in ATTRIBUTE_KEYS if metadata.get(key) is not None}
+
+    def _save(self, entry: dict):
+        with self.chunk_store.lock, self.chunk_store.conn:
+            self.chunk_store.conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry["source"], entry["filename"], entry["chunk_count"], entry["token_count"],
+                 entry["content_hash"], entry["ingested_at"], json.dumps(entry["row_ranges"]),
+                 json.dumps(entry["attributes"], ensure_ascii=False)),
+            )
+        self._entries[entry["source"]] = entry
+        self.revision += 1
+
+    def remove(self, source: str):
+        with self.chunk_store.lock, self.chunk_store.conn:
+            self.chunk_store.conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+        self._entries.pop(source, None)
+        self.revision += 1
+
+    def _rebuild(self, source: str):
+        """Recompute one entry from the chunks of that source."""
+        rows = self.chunk_store.source_rows(source)
+        if not rows:
+            self.remove(source)
+            return
+        previous = self.entries.get(source, {})
+        metadata = rows[-1][2]
+        self._save({
+            "source": source,
+            "filename": metadata.get("filename") or source,
+            "chunk_count": len(rows),
+            "token_count": sum(count_tokens_batch([text for _, text, _ in rows])),
+            "content_hash": metadata.get("content_hash"),
+            "ingested_at": previous.get("ingested_at") or datetime.now(timezone.utc).isoformat(),
+            "row_ranges": to_ranges([row_id for row_id, _, _ in rows]),
+            "attributes": self._attributes(metadata),
+        })
+
+    def record(self, row_ids: List[int], texts: List[str], metadatas: List[dict]):
+        """Add newly stored chunks to the entries of their sources."""
+        token_counts = count_tokens_batch(list(texts))
+        ingested_at = datetime.now(timezone.utc).isoformat()
+        grouped = {}
+        for row_id, tokens, metadata in zip(row_ids, token_counts, metadatas):
+            group = grouped.setdefault(source_key(metadata), {"row_ids": [], "tokens": 0, "metadata": metadata})
+            group["row_ids"].append(row_id)
+            group["tokens"] += tokens
+        for source, group in grouped.items():
+            if source is None:
+                continue
+            entry = dict(self.entries.get(source) or {"chunk_count": 0, "token_count": 0, "row_ranges": []})
+            metadata = group["metadata"]
+            entry.update({
+                "source": source,
+                "filename": metadata.get("filename") or source,
+                "chunk_count": entry["chunk_count"] + len(group["row_ids"]),
+                "token_count": entry["token_count"] + group["tokens"],
+                "content_hash": metadata.get("content_hash"),
+                "ingested_at": ingested_at,
+                "row_ranges": merge_ranges(entry["row_ranges"] + to_ranges(group["row_ids"])),
+                "attributes": self._attributes(metadata),
+            })
+            self._save(entry)
+
+    def truncate(self, n_rows: int):
+        """Re-derive the entries that referenced rows >= n_rows (after the chunk store was truncated)."""
+        for source, entry in list(self.entries.items()):
+            if entry["row_ranges"] and entry["row_ranges"][-1][1] > n_rows:
+                self._rebuild(source)
+
+    def get(self, source: str) -> Optional[dict]:
+        return self.entries.get(source)
+
+    def sources(self) -> List[dict]:
+        """Every entry, most recently ingested first."""
+        return sorted(self.entries.values(), key=lambda entry: entry["ingested_at"], reverse=True)
+
+    def filenames(self) -> List[str]:
+        """Distinct display names of the ingested files."""
+        return sorted({entry["filename"] for entry in self.entries.values()})
+
+    def __len__(self) -> int:
+        return len(self.entries)
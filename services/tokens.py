@@ -0,0 +1,23 @@
+"""
+this file counts tokens the way the OpenAI embedding models do (cl100k_base).
+it falls back to an estimate of 4 characters per token when tiktoken or its encoding file is unavailable.
+"""
+from functools import lru_cache
+from typing import List
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Number of tokens in each of `texts`."""
+    encoding = _encoding()
+    if encoding is None:
+        return [max(1, len(text) // 4) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
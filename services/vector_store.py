@@ -0,0 +1,733 @@
+"""
+this file contains the vector store used by the RAG chatbot.
+it keeps FAISS indexes over (optionally truncated and re-normalized) embeddings for a fast first-pass search,
+the full-size embeddings in a memory-mapped side file that is used to re-score the top candidates,
+and the chunk texts and metadata in a SQLite chunk store keyed by FAISS row id.
+
+the index is persisted as segments: the base segment written by a full build and one small delta
+segment per update, listed in manifest.json. every segment is an IndexIDMap whose ids are the global
+row ids, so a search runs over all segments and merges the hits. once there are more than
+FAISS_MAX_DELTA_SEGMENTS deltas, a background compaction merges everything into a new base.
+replacing or deleting a source file only marks its row ids as deleted in the manifest: searches skip
+them through an id selector and the next compaction drops them from the index.
+metadata filters (source file, project, language, document type) are applied the same way.
+
+reads never block on writes: a search pins the current Snapshot (segments, row count, deleted rows)
+and runs against it, while a writer builds the next snapshot off to the side and publishes it by
+swapping one reference. files and chunks that only old snapshots need are reclaimed once those are unpinned.
+segments are immutable and memory-mapped read-only on load, so startup does not depend on the corpus
+size and worker processes share one page-cached copy.
+a store has a single writer process: its manifest (row ids, segment names) is kept in memory and only
+written back, so the first write takes an flock on the store's WRITER file, and a write from any other
+process (a second server worker) fails with StoreWriterError instead of overwriting it. any number of
+processes can search it.
+"""
+import os
+import asyncio
+import fcntl
+import json
+import pickle
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from core import settings
+from .chunk_store import ChunkStore, CHUNK_STORE_FILE
+from .index_factory import new_faiss_index, apply_search_params, selector_search_params
+from .source_catalog import SourceCatalog, merge_ranges, ranges_to_mask, mask_to_ranges, ranges_length
+from .metadata_filter import MetadataFilterIndex
+
+FULL_VECTORS_FILE = "full_vectors.f32"
+MANIFEST_FILE = "manifest.json"
+TEMPLATE_FILE = "template.faiss"
+SEGMENTS_DIR = "segments"
+WRITER_FILE = "WRITER"
+# rows added to an index at a time when (re)building from the side file
+ADD_BLOCK_SIZE = 10000
+
+
+def truncate_and_normalize(vectors: np.ndarray, dimensions: Optional[int]) -> np.ndarray:
+    """
+    Keep the first `dimensions` components of each vector and re-normalize to unit length.
+    text-embedding-3 models are trained so that this matches asking the API for `dimensions` directly.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if not dimensions or dimensions >= vectors.shape[1]:
+        return vectors
+    truncated = np.ascontiguousarray(vectors[:, :dimensions])
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return truncated / norms
+
+
+class FullVectorFile:
+    """Append-only float32 matrix on disk, read through a read-only memory map."""
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self._mmap = None
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.dim * 4)
+
+    def append(self, vectors: np.ndarray):
+        """Append rows to the end of the file."""
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+        self._mmap = None
+
+    def truncate(self, n_rows: int):
+        """Drop every row from `n_rows` on (left over from an interrupted update)."""
+        with open(self.path, "r+b") as f:
+            f.truncate(n_rows * self.dim * 4)
+        self._mmap = None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The stored vectors as a (rows, dim) read-only memory map."""
+        if self._mmap is None or len(self._mmap) != len(self):
+            self._mmap = np.memmap(self.path, dtype="float32", mode="r", shape=(len(self), self.dim))
+        return self._mmap
+
+
+def trained_index(vectors_for: Callable[[np.ndarray], np.ndarray], row_ids: np.ndarray, dim: int,
+                  index_type: str) -> faiss.Index:
+    """
+    An empty faiss index for the rows, trained when its type needs it: only then are the vectors of a
+    sample of at most FAISS_TRAIN_SAMPLE_SIZE rows read (with vectors_for).
+    """
+    index = new_faiss_index(dim, index_type, n_total=len(row_ids))
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = rng.choice(row_ids, size=min(len(row_ids), settings.FAISS_TRAIN_SAMPLE_SIZE), replace=False)
+        index.train(vectors_for(np.sort(sample)))
+    apply_search_params(index)
+    return index
+
+
+def read_index(path: str, mmap: bool = True) -> Tuple[faiss.Index, bool]:
+    """
+    Read a faiss index, memory-mapping its vector codes read-only when possible.
+    Returns the index and whether it is memory-mapped.
+    """
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError as e:
+            print(f"Could not memory-map {path}, reading it into memory instead: {e}")
+    return faiss.read_index(path), False
+
+
+def write_index(index: faiss.Index, path: str):
+    """Write next to the target and rename, so a memory-mapped copy of the old file stays valid."""
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """The (possibly lossy) vectors stored in a plain faiss index, in insertion order."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def write_json(data: dict, path: str):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+class Segment:
+    """One immutable FAISS index file; its ids are global row ids."""
+    def __init__(self, name: str, index: faiss.IndexIDMap, base: bool = False):
+        self.name = name
+        self.index = index
+        self.base = base
+
+    @property
+    def rows(self) -> int:
+        return self.index.ntotal
+
+    def row_ids(self) -> np.ndarray:
+        return faiss.vector_to_array(self.index.id_map)
+
+    def reconstruct(self) -> np.ndarray:
+        """The stored (possibly lossy) vectors, in row_ids() order."""
+        return reconstruct_all(self.index.index)
+
+    def to_manifest(self) -> dict:
+        return {"name": self.name, "rows": self.rows, "base": self.base}
+
+
+class Snapshot:
+    """An immutable, searchable version of the index."""
+    def __init__(self, version: int, segments: Tuple[Segment, ...], n_rows: int, deleted: List[List[int]]):
+        self.version = version
+        self.segments = segments
+        self.n_rows = n_rows
+        self.deleted = deleted
+        self._live = None
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.rows for segment in self.segments)
+
+    def live_bitmap(self) -> Optional[np.ndarray]:
+        """Packed bitmap of the rows that are not deleted (None when nothing is deleted)."""
+        if not self.deleted:
+            return None
+        if self._live is None:
+            self._live = np.packbits(~ranges_to_mask(self.deleted, self.n_rows), bitorder="little")
+        return self._live
+
+
+class StoreWriterError(RuntimeError):
+    """Another process already writes to the store."""
+
+
+class FAISSVectorStore:
+    """Segmented FAISS index + SQLite chunk store + full-precision side vectors for re-scoring."""
+    def __init__(self, embedding: Embeddings, folder_path: str, manifest: dict, segments: List[Segment],
+                 template: bytes, chunk_store: ChunkStore, full_vectors: Optional[FullVectorFile] = None,
+                 mmapped: bool = False):
+        self.embedding = embedding
+        self.folder_path = folder_path
+        self.manifest = manifest
+        self.chunk_store = chunk_store
+        self.catalog = SourceCatalog(chunk_store)
+        self.filters = MetadataFilterIndex(self.catalog)
+        self.full_vectors = full_vectors
+        self.mmapped = mmapped
+        self._template = template
+        self._search_params = {}
+        self._write_lock = threading.RLock()
+        self._writer = None  # WRITER file, flocked by the first write
+        self._compact_lock = threading.Lock()
+        self._snapshot = Snapshot(manifest["version"], tuple(segments), manifest["next_row_id"],
+                                  list(manifest.get("deleted", [])))
+        # pinned snapshot version -> number of readers, and (version, release) pairs waiting for
+        # every snapshot older than version to be unpinned
+        self._pin_lock = threading.Lock()
+        self._pins = {}
+        self._garbage = []
+
+    @property
+    def segments(self) -> Tuple[Segment, ...]:
+        """Segments of the current snapshot."""
+        return self._snapshot.segments
+
+    @property
+    def dimensions(self) -> int:
+        """Dimension of the vectors in the FAISS index."""
+        return self.manifest["dimensions"]
+
+    @property
+    def version(self) -> int:
+        """Incremented by every persisted change (update, compaction)."""
+        return self.manifest["version"]
+
+    @property
+    def ntotal(self) -> int:
+        return self._snapshot.ntotal
+
+    @property
+    def deleted_rows(self) -> int:
+        """Rows marked as deleted but still stored in a segment."""
+        return ranges_length(self.manifest.get("deleted", []))
+
+    @contextmanager
+    def pin(self):
+        """Pin the current snapshot for the duration of a read."""
+        with self._pin_lock:
+            snapshot = self._snapshot
+            self._pins[snapshot.version] = self._pins.get(snapshot.version, 0) + 1
+        try:
+            yield snapshot
+        finally:
+            with self._pin_lock:
+                self._pins[snapshot.version] -= 1
+                if not self._pins[snapshot.version]:
+                    del self._pins[snapshot.version]
+            self._reclaim()
+
+    def _reclaim(self):
+        """Run the releases that no pinned snapshot depends on anymore."""
+        with self._pin_lock:
+            oldest = min(self._pins, default=None)
+            ready = [release for version, release in self._garbage if oldest is None or version <= oldest]
+            self._garbage = [(version, release) for version, release in self._garbage
+                             if not (oldest is None or version <= oldest)]
+        for release in ready:
+            release()
+
+    def _selector(self, snapshot: Snapshot, filter: Optional[Dict] = None) -> Optional[Tuple[np.ndarray, faiss.IDSelector]]:
+        """
+        An id selector accepting the live rows of `snapshot` that match `filter` (None when every row is accepted).
+        The bitmap is returned too: faiss does not own it, so it must outlive the search.
+        """
+        n_rows = snapshot.n_rows
+        bitmap = snapshot.live_bitmap()
+        if filter:
+            filter_bitmap = self.filters.bitmap(filter, n_rows)
+            if filter_bitmap is not None:
+                bitmap = filter_bitmap if bitmap is None else filter_bitmap & bitmap
+        if bitmap is None:
+            return None
+        # faiss takes the length of the bitmap in bytes
+        return bitmap, faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+
+    @property
+    def rescoring(self) -> bool:
+        """True when the index holds truncated vectors and the full ones are available for re-scoring."""
+        return self.full_vectors is not None and self.full_vectors.dim > self.dimensions
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.folder_path, *parts)
+
+    def apply_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Set nprobe/efSearch on every segment, including those added later."""
+        self._search_params = {"nprobe": nprobe, "ef_search": ef_search}
+        for segment in self.segments:
+            apply_search_params(segment.index, **self._search_params)
+
+    @classmethod
+    def create(cls, folder_path: str, embedding: Embeddings, texts: List[str], embeddings: np.ndarray,
+               metadatas: Optional[List[dict]] = None, index_type: str = None, dimensions: int = None):
+        """
+        Build a new store in `folder_path` from full-size embeddings: the index (of `index_type`,
+        over vectors truncated to `dimensions`) is trained on them and they become the base segment.
+        """
+        builder = StoreBuilder(folder_path, embedding, index_type, dimensions)
+        builder.add(texts, embeddings, metadatas)
+        return builder.finish()
+
+    # ------------------------------------------------------------------ writes
+    def claim_writer(self):
+        """Make this process the store's single writer, or raise StoreWriterError when another process is."""
+        with self._write_lock:
+            if self._writer is None:
+                writer = open(self._path(WRITER_FILE), "a")
+                try:
+                    fcntl.flock(writer.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    writer.close()
+                    raise StoreWriterError(f"{self.folder_path} is written by another process; "
+                                           f"run a single server worker.")
+                self._writer = writer
+
+    def close(self):
+        """Close the chunk store and give up the writer lock; the store is not used afterwards."""
+        self.chunk_store.close()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    @contextmanager
+    def _writing(self):
+        """The write lock, for a process that is (or becomes) the store's single writer."""
+        with self._write_lock:
+            self.claim_writer()
+            yield
+
+    def _publish(self, segments: Tuple[Segment, ...], release: Optional[Callable[[], None]] = None):
+        """
+        Persist the manifest and make `segments` (with the manifest's rows and deletions) the
+        current snapshot. `release` frees what only the previous snapshots use; it runs once
+        they are all unpinned. Called within _writing().
+        """
+        self.manifest["version"] += 1
+        self.manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self.manifest["segments"] = [segment.to_manifest() for segment in segments]
+        write_json(self.manifest, self._path(MANIFEST_FILE))
+        snapshot = Snapshot(self.manifest["version"], segments, self.manifest["next_row_id"],
+                            list(self.manifest.get("deleted", [])))
+        with self._pin_lock:
+            self._snapshot = snapshot
+            if release is not None:
+                self._garbage.append((snapshot.version, release))
+        self._reclaim()
+
+    def _new_segment_name(self) -> str:
+        name = f"seg-{self.manifest['next_segment']:06d}.faiss"
+        self.manifest["next_segment"] += 1
+        return name
+
+    def _add(self, texts: List[str], embeddings: np.ndarray, metadatas: Optional[List[dict]], base: bool = False) -> List[int]:
+        embeddings = np.asarray(embeddings, dtype="float32")
+        metadatas = metadatas or [{} for _ in texts]
+        with self._writing():
+            start = self.manifest["next_row_id"]
+            # catalog first: an interrupted update is repaired by catalog.truncate() on load
+            self.catalog.record(list(range(start, start + len(texts))), texts, metadatas)
+            row_ids = self.chunk_store.append(start, texts, metadatas)
+            if self.full_vectors is not None:
+                self.full_vectors.append(embeddings)
+
+            index = faiss.IndexIDMap(faiss.deserialize_index(self._template))
+            index.add_with_ids(truncate_and_normalize(embeddings, self.dimensions), np.asarray(row_ids, dtype="int64"))
+            apply_search_params(index, **self._search_params)
+            segment = Segment(self._new_segment_name(), index, base=base)
+            write_index(index, self._path(SEGMENTS_DIR, segment.name))
+
+            self.manifest["next_row_id"] = start + len(row_ids)
+            self._publish(self.segments + (segment,))
+        return row_ids
+
+    def _delete_source(self, source: str) -> int:
+        """
+        Mark the rows of a source as deleted (the caller publishes the change). Its chunks stay
+        readable by pinned snapshots and are purged by the compaction that drops the rows.
+        """
+        entry = self.catalog.get(source)
+        if entry is None:
+            return 0
+        self.manifest["deleted"] = merge_ranges(self.manifest.get("deleted", []) + entry["row_ranges"])
+        self.chunk_store.detach_source(source)
+        self.catalog.remove(source)
+        return entry["chunk_count"]
+
+    def _maybe_compact(self):
+        """Start a background compaction when there are too many deltas or deleted rows."""
+        too_many_deltas = sum(not segment.base for segment in self.segments) > settings.FAISS_MAX_DELTA_SEGMENTS
+        too_many_deleted = self.deleted_rows > settings.FAISS_MAX_DELETED_FRACTION * max(1, self.ntotal)
+        if too_many_deltas or too_many_deleted:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def add_embeddings(self, texts: List[str], embeddings: np.ndarray, metadatas: Optional[List[dict]] = None) -> List[int]:
+        """
+        Add texts with their full-size embeddings as a new delta segment and return their row ids.
+        The update is persisted immediately and its cost does not depend on the index size.
+        """
+        row_ids = self._add(texts, embeddings, metadatas)
+        self._maybe_compact()
+        return row_ids
+
+    def upsert_embeddings(self, source: str, texts: List[str], embeddings: np.ndarray,
+                          metadatas: Optional[List[dict]] = None) -> List[int]:
+        """Replace every chunk of `source` with the given ones and return their row ids."""
+        with self._writing():
+            self._delete_source(source)
+            row_ids = self._add(texts, embeddings, metadatas)
+        self._maybe_compact()
+        return row_ids
+
+    async def aupsert_texts(self, source: str, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[int]:
+        embeddings = await self.embedding.aembed_documents(list(texts))
+        # writing segments and the chunk store blocks: keep it off the event loop
+        return await asyncio.to_thread(self.upsert_embeddings, source, texts, embeddings, metadatas)
+
+    def delete_source(self, source: str) -> int:
+        """Remove every chunk of `source` and return how many were removed."""
+        with self._writing():
+            removed = self._delete_source(source)
+            if removed:
+                self._publish(self.segments)
+        if removed:
+            self._maybe_compact()
+        return removed
+
+    def add_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[int]:
+        embeddings = self.embedding.embed_documents(list(texts))
+        return self.add_embeddings(texts, embeddings, metadatas)
+
+    async def aadd_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[int]:
+        embeddings = await self.embedding.aembed_documents(list(texts))
+        return await asyncio.to_thread(self.add_embeddings, texts, embeddings, metadatas)
+
+    def _vectors_for(self, row_ids: np.ndarray) -> np.ndarray:
+        return truncate_and_normalize(self.full_vectors.vectors[row_ids], self.dimensions)
+
+    def compact(self):
+        """
+        Merge all current segments into a new, retrained base segment.
+        Runs in the background; segments added meanwhile are kept as deltas.
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return
+        try:
+            with self._write_lock:
+                merged = self.segments
+                deleted = self.manifest.get("deleted", [])
+                n_rows = self.manifest["next_row_id"]
+            if not merged:
+                return
+            dead = ranges_to_mask(deleted, n_rows)
+            print(f"Compacting {len(merged)} FAISS segments ({ranges_length(deleted)} deleted rows)...")
+            row_ids = np.sort(np.concatenate([segment.row_ids() for segment in merged]))
+            row_ids = row_ids[~dead[row_ids]]
+            if self.full_vectors is not None and len(row_ids):
+                inner = trained_index(self._vectors_for, row_ids, self.dimensions, self.manifest["index_type"])
+                template = faiss.serialize_index(inner)
+                index = faiss.IndexIDMap(inner)
+                for start in range(0, len(row_ids), ADD_BLOCK_SIZE):
+                    block = row_ids[start:start + ADD_BLOCK_SIZE]
+                    index.add_with_ids(self._vectors_for(block), block)
+            else:
+                # no side file: merge the stored vectors as they are, keeping the trained template
+                template = self._template
+                index = faiss.IndexIDMap(faiss.deserialize_index(template))
+                for segment in merged:
+                    live = ~dead[segment.row_ids()]
+                    index.add_with_ids(segment.reconstruct()[live], segment.row_ids()[live])
+            apply_search_params(index, **self._search_params)
+
+            with self._writing():
+                base = Segment(self._new_segment_name(), index, base=True)
+                write_index(index, self._path(SEGMENTS_DIR, base.name))
+                write_index(faiss.deserialize_index(template), self._path(TEMPLATE_FILE))
+                self._template = template
+                # rows deleted while compacting are still in the new base
+                still_dead = ranges_to_mask(self.manifest.get("deleted", []), self.manifest["next_row_id"])
+                still_dead[:n_rows] &= ~dead
+                self.manifest["deleted"] = mask_to_ranges(still_dead)
+                self._publish((base,) + tuple(s for s in self.segments if s not in merged),
+                              release=lambda: self._release_merged(merged, deleted))
+            print(f"Compacted into {base.name} ({base.rows} rows).")
+        finally:
+            self._compact_lock.release()
+
+    def _release_merged(self, merged: Tuple[Segment, ...], dropped: List[List[int]]):
+        """Delete the files of compacted segments and the chunks of the deleted rows they held."""
+        for segment in merged:
+            try:
+                os.remove(self._path(SEGMENTS_DIR, segment.name))
+            except OSError:
+                pass
+        self.chunk_store.delete_ranges(dropped)
+
+    # ------------------------------------------------------------------ search
+    def _search_segments(self, snapshot: Snapshot, query: np.ndarray, n: int,
+                         filter: Optional[Dict] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Search every segment of the snapshot for rows accepted by the filter and merge the hits into the best `n` (distances, row ids)."""
+        all_distances, all_row_ids = [], []
+        selector = self._selector(snapshot, filter)
+        if selector is not None and not selector[0].any():
+            return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        for segment in snapshot.segments:
+            params = selector_search_params(segment.index, selector[1]) if selector else None
+            distances, row_ids = segment.index.search(query, n, params=params)
+            all_distances.append(distances[0])
+            all_row_ids.append(row_ids[0])
+        if not all_distances:
+            return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        distances, row_ids = np.concatenate(all_distances), np.concatenate(all_row_ids)
+        found = row_ids >= 0
+        distances, row_ids = distances[found], row_ids[found]
+        order = np.argsort(distances)[:n]
+        return distances[order], row_ids[order]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """
+        Search with a full-size query embedding, optionally restricted by a metadata filter
+        such as {"project": "marina", "language": ["ar", "en"]} (see metadata_filter.FILTER_FIELDS).
+        When the index holds truncated vectors, the top RESCORE_CANDIDATES hits of the first pass
+        are re-scored with the full-size vectors. Scores are squared L2 distances (lower is better).
+        """
+        query = np.asarray(embedding, dtype="float32")[None, :]
+        n_candidates = max(k, settings.RESCORE_CANDIDATES) if self.rescoring else k
+        with self.pin() as snapshot:
+            distances, row_ids = self._search_segments(snapshot, truncate_and_normalize(query, self.dimensions),
+                                                       n_candidates, filter)
+
+            if self.rescoring and len(row_ids):
+                row_ids = np.sort(row_ids)  # read the memory map in file order
+                candidates = self.full_vectors.vectors[row_ids]
+                distances = ((candidates - query) ** 2).sum(axis=1)
+                order = np.argsort(distances)[:k]
+                distances, row_ids = distances[order], row_ids[order]
+
+            docs = self.chunk_store.get_many(row_ids[:k].tolist())
+        return [(doc, float(distance)) for doc, distance in zip(docs, distances[:k]) if doc is not None]
+
+    def candidates_by_vector(self, embedding: List[float], n: int,
+                             filter: Optional[Dict] = None) -> Tuple[List[Document], Optional[np.ndarray], np.ndarray]:
+        """
+        The first-pass top `n` hits for local re-ranking: their documents, their stored
+        full-precision vectors (None without the side file) and their first-pass distances.
+        """
+        query = np.asarray(embedding, dtype="float32")[None, :]
+        with self.pin() as snapshot:
+            distances, row_ids = self._search_segments(snapshot, truncate_and_normalize(query, self.dimensions), n, filter)
+            order = np.argsort(row_ids)  # read the memory map in file order
+            distances, row_ids = distances[order], row_ids[order]
+            vectors = np.asarray(self.full_vectors.vectors[row_ids]) if self.full_vectors is not None else None
+            docs = self.chunk_store.get_many(row_ids.tolist())
+        found = np.array([doc is not None for doc in docs], dtype=bool)
+        return ([doc for doc in docs if doc is not None],
+                vectors[found] if vectors is not None else None,
+                distances[found])
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4,
+                                            filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        embedding = await self.embedding.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_with_score_by_vector, embedding, k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, filter)]
+
+    # ------------------------------------------------------------------ persistence
+    def save_local(self, folder_path: str = None):
+        """
+        Kept for callers of the LangChain API: every update is already persisted as a segment,
+        so this only rewrites the (small) manifest.
+        """
+        if folder_path and os.path.abspath(folder_path) != os.path.abspath(self.folder_path):
+            raise ValueError(f"The vector store persists into {self.folder_path}, not {folder_path}.")
+        with self._writing():
+            self._publish(self.segments)
+
+    @classmethod
+    def load_local(cls, folder_path: str, embedding: Embeddings, mmap: bool = True):
+        """
+        Load a store from its manifest, memory-mapping the segments unless mmap=False.
+        The manifest is authoritative: chunks and vectors beyond its last row (from an
+        interrupted update) are dropped. Single-file indexes (LangChain's FAISS.save_local
+        layout) are migrated to the segment layout once.
+        """
+        if not os.path.exists(os.path.join(folder_path, MANIFEST_FILE)):
+            migrate_single_file_layout(folder_path)
+        with open(os.path.join(folder_path, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        segments, mmapped = [], mmap
+        for entry in manifest["segments"]:
+            index, segment_mmapped = read_index(os.path.join(folder_path, SEGMENTS_DIR, entry["name"]), mmap)
+            segments.append(Segment(entry["name"], index, entry["base"]))
+            mmapped = mmapped and segment_mmapped
+        template = faiss.serialize_index(faiss.read_index(os.path.join(folder_path, TEMPLATE_FILE)))
+
+        chunk_store = ChunkStore(os.path.join(folder_path, CHUNK_STORE_FILE))
+        chunk_store.truncate(manifest["next_row_id"])
+        full_vectors = None
+        if manifest.get("full_dimensions"):
+            full_vectors = FullVectorFile(os.path.join(folder_path, FULL_VECTORS_FILE), manifest["full_dimensions"])
+            if len(full_vectors) > manifest["next_row_id"]:
+                full_vectors.truncate(manifest["next_row_id"])
+        store = cls(embedding, folder_path, manifest, segments, template, chunk_store, full_vectors, mmapped)
+        store.catalog.truncate(manifest["next_row_id"])
+        return store
+
+
+def migrate_pickled_docstore(pickle_path: str, chunk_store: ChunkStore, n_rows: int):
+    """Copy the documents of a LangChain-pickled docstore into the chunk store, in FAISS row order."""
+    print(f"Migrating {pickle_path} to the chunk store...")
+    with open(pickle_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    docs = [docstore.search(index_to_docstore_id[position]) for position in range(n_rows)]
+    chunk_store.append(0, [doc.page_content for doc in docs], [doc.metadata for doc in docs])
+
+
+def migrate_single_file_layout(folder_path: str, index_name: str = "index"):
+    """
+    Turn a single-file index (index.faiss + index.pkl, as written by LangChain's FAISS.save_local)
+    into the segment layout: the index becomes the base segment with row ids 0..n-1.
+    """
+    print(f"Migrating {folder_path} to the segment layout...")
+    index = faiss.read_index(os.path.join(folder_path, f"{index_name}.faiss"))
+    chunk_store_path = os.path.join(folder_path, CHUNK_STORE_FILE)
+    pickle_path = os.path.join(folder_path, f"{index_name}.pkl")
+    if not os.path.exists(chunk_store_path):
+        chunk_store = ChunkStore(chunk_store_path)
+        migrate_pickled_docstore(pickle_path, chunk_store, index.ntotal)
+        chunk_store.close()
+
+    template = faiss.clone_index(index)
+    template.reset()
+    base = faiss.IndexIDMap(faiss.clone_index(template))
+    if index.ntotal:
+        base.add_with_ids(reconstruct_all(index), np.arange(index.ntotal, dtype="int64"))
+
+    os.makedirs(os.path.join(folder_path, SEGMENTS_DIR), exist_ok=True)
+    write_index(template, os.path.join(folder_path, TEMPLATE_FILE))
+    write_index(base, os.path.join(folder_path, SEGMENTS_DIR, "seg-000000.faiss"))
+    full_vectors_path = os.path.join(folder_path, FULL_VECTORS_FILE)
+    if os.path.exists(full_vectors_path):
+        os.remove(full_vectors_path)
+    manifest = {"version": 1, "index_type": settings.FAISS_INDEX_TYPE, "dimensions": index.d,
+                "full_dimensions": None, "next_row_id": index.ntotal, "next_segment": 1,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "segments": [{"name": "seg-000000.faiss", "rows": index.ntotal, "base": True}], "deleted": []}
+    write_json(manifest, os.path.join(folder_path, MANIFEST_FILE))
+    for name in (f"{index_name}.faiss", f"{index_name}.pkl"):
+        os.remove(os.path.join(folder_path, name))
+
+
+class StoreBuilder:
+    """
+    Builds a new store from chunks that arrive in batches (see ingest_pipeline): chunk texts and full-size
+    vectors are written to disk as they come, and finish() trains the index on a sample of the
+    memory-mapped vectors and fills the base segment block by block, so memory does not grow with the corpus.
+    """
+    def __init__(self, folder_path: str, embedding: Embeddings, index_type: str = None, dimensions: int = None):
+        self.folder_path = folder_path
+        self.embedding = embedding
+        self.index_type = index_type or settings.FAISS_INDEX_TYPE
+        self.dimensions = dimensions
+        os.makedirs(os.path.join(folder_path, SEGMENTS_DIR), exist_ok=True)
+        for name in (MANIFEST_FILE, TEMPLATE_FILE, FULL_VECTORS_FILE, CHUNK_STORE_FILE):
+            if os.path.exists(os.path.join(folder_path, name)):
+                os.remove(os.path.join(folder_path, name))
+        for name in os.listdir(os.path.join(folder_path, SEGMENTS_DIR)):
+            os.remove(os.path.join(folder_path, SEGMENTS_DIR, name))
+        self.chunk_store = ChunkStore(os.path.join(folder_path, CHUNK_STORE_FILE))
+        self.catalog = SourceCatalog(self.chunk_store)
+        self.full_vectors = None
+        self.n_rows = 0
+
+    def add(self, texts: List[str], embeddings: np.ndarray, metadatas: Optional[List[dict]] = None) -> List[int]:
+        """Store a batch of chunks with their full-size embeddings and return their row ids."""
+        if not texts:
+            return []
+        embeddings = np.asarray(embeddings, dtype="float32")
+        metadatas = metadatas or [{} for _ in texts]
+        if self.full_vectors is None:
+            self.full_vectors = FullVectorFile(os.path.join(self.folder_path, FULL_VECTORS_FILE), embeddings.shape[1])
+        start = self.n_rows
+        self.catalog.record(list(range(start, start + len(texts))), texts, metadatas)
+        row_ids = self.chunk_store.append(start, texts, metadatas)
+        self.full_vectors.append(embeddings)
+        self.n_rows += len(row_ids)
+        return row_ids
+
+    def finish(self) -> FAISSVectorStore:
+        """Train and fill the index over every added chunk and return the store."""
+        if not self.n_rows:
+            raise ValueError("Cannot build a FAISS index without any chunks.")
+        vectors = self.full_vectors.vectors
+        dim = min(self.dimensions or self.full_vectors.dim, self.full_vectors.dim)
+        inner = trained_index(lambda rows: truncate_and_normalize(vectors[rows], self.dimensions),
+                              np.arange(self.n_rows), dim, self.index_type)
+        template = faiss.serialize_index(inner)
+        faiss.write_index(faiss.deserialize_index(template), os.path.join(self.folder_path, TEMPLATE_FILE))
+        index = faiss.IndexIDMap(inner)
+        for start in range(0, self.n_rows, ADD_BLOCK_SIZE):
+            block = np.arange(start, min(start + ADD_BLOCK_SIZE, self.n_rows), dtype="int64")
+            index.add_with_ids(truncate_and_normalize(vectors[start:start + len(block)], self.dimensions), block)
+
+        manifest = {"version": 0, "index_type": self.index_type, "dimensions": index.d,
+                    "full_dimensions": self.full_vectors.dim, "next_row_id": self.n_rows, "next_segment": 0,
+                    "segments": [], "deleted": []}
+        store = FAISSVectorStore(self.embedding, self.folder_path, manifest, [], template, self.chunk_store,
+                                 self.full_vectors)
+        with store._writing():
+            segment = Segment(store._new_segment_name(), index, base=True)
+            write_index(index, store._path(SEGMENTS_DIR, segment.name))
+            store._publish((segment,))
+        return store
+
@@ -0,0 +1,66 @@
+"""
+this file holds the shared setup of the tests: the local hashing embedder (EMBEDDING_BACKEND="hash")
+stands in for the embedding API, the embedding cache is off unless a test turns it on, LangSmith tracing
+is off and every test gets its own index root, so no test needs the network or leaves files behind.
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# before core.settings is created
+os.environ.update(EMBEDDING_BACKEND="hash", EMBEDDING_CACHE_PATH="", LANGCHAIN_TRACING_V2="false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import langchain_core.runnables.graph
+# the units subgraph renders its graph with mermaid.ink when it is imported
+langchain_core.runnables.graph.Graph.draw_mermaid_png = lambda *args, **kwargs: b""
+
+from langchain_core.documents import Document
+
+from core import settings
+from services.embedding_service import EmbeddingService, HashEmbeddingBackend, set_embedding_service
+from services.ingest_benchmark import write_docx
+
+
+@pytest.fixture(autouse=True)
+def index_root(tmp_path, monkeypatch):
+    """A fresh FAISS_INDEX_PATH for every test."""
+    root = tmp_path / "index"
+    monkeypatch.setattr(settings, "FAISS_INDEX_PATH", str(root))
+    return root
+
+
+@pytest.fixture
+def embeddings():
+    """A process-wide embedding service of its own, on the hashing embedder."""
+    service = EmbeddingService(HashEmbeddingBackend(64))
+    set_embedding_service(service)
+    yield service
+    set_embedding_service(None)
+
+
+def make_documents(source: str, texts, **attributes):
+    """Chunks of one source file, with the metadata the chunker gives them."""
+    filename = source.split(".")[0]
+    return [Document(page_content=text, metadata={"source": source, "filename": filename, **attributes})
+            for text in texts]
+
+
+def make_docx(directory, name: str, paragraphs) -> str:
+    """A DOCX file holding the paragraphs; returns its path."""
+    path = os.path.join(str(directory), name)
+    write_docx(path, list(paragraphs))
+    return path
+
+
+class FakeLLM:
+    """Chat model stand-in answering every prompt with `reply` and keeping the prompts."""
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return SimpleNamespace(content=self.reply)
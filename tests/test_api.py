@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import make_docx, make_documents
+from core import settings
+from services import FAISSVectorStore, ShardManager
+
+HEADERS = {"app-api-key": settings.APP_API_KEY}
+
+
+@pytest.fixture
+def api(embeddings, monkeypatch):
+    """A client of the app over a default shard holding marina.docx (startup is skipped)."""
+    import main
+    from routers import global_rag_chatbot
+
+    builder = ShardManager()
+    asyncio.run(builder.service().create_faiss_index(make_documents(
+        "marina.docx", ["Marina villas have a private beach and a sea view."])))
+    builder.store().close()
+    # loaded the way the server loads it at startup
+    shards = ShardManager()
+    shards.load_all()
+    monkeypatch.setattr(global_rag_chatbot, "shards", shards)
+    monkeypatch.setattr(global_rag_chatbot, "vector_store", shards.vector_store())
+    return TestClient(main.app), shards
+
+
+def upload(client, path, name="desert.docx", **form):
+    with open(path, "rb") as f:
+        return client.post("/upload", headers=HEADERS, files={"file": (name, f)}, data=form)
+
+
+def test_writes_are_refused_while_another_process_writes_the_index(api, tmp_path):
+    client, shards = api
+    other = FAISSVectorStore.load_local(shards.store().folder_path, shards.embeddings_model)
+    other.claim_writer()
+    path = make_docx(tmp_path, "desert.docx", ["Desert chalets have a private pool."])
+
+    response = upload(client, path)
+    assert response.status_code == 409
+    assert "another process" in response.json()["detail"]
+
+    response = client.delete("/documents/marina.docx", headers=HEADERS)
+    assert response.status_code == 409
+
+    with open(path, "rb") as f:
+        response = client.post("/sync_drive", headers=HEADERS, files={"credentials_file": ("creds.json", f)},
+                               data={"drive_link": "https://drive.google.com/drive/folders/brochures"})
+    assert response.status_code == 409
+
+
+def test_upload_reports_the_shard_and_its_index_version(api, tmp_path):
+    client, shards = api
+    path = make_docx(tmp_path, "desert.docx", ["Desert chalets have a private pool."])
+    response = upload(client, path, project="desert")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["shard"] == settings.DEFAULT_SHARD
+    assert body["index_version"] == shards.service().versions.current()
+    assert body["index_version"] in body["message"]
+
+    response = upload(client, path, project="desert")
+    assert response.status_code == 200
+    assert response.json()["index_version"] is None
+    assert "unchanged" in response.json()["message"]
+
+
+def test_vector_store_info_counts_files_by_source(api, tmp_path):
+    client, shards = api
+    # a second file shown as "marina"
+    path = make_docx(tmp_path, "marina.pdf.docx", ["Marina villas, the scanned brochure."])
+    assert upload(client, path, name="marina.pdf.docx").status_code == 200
+
+    info = client.get("/vector_store_info", headers=HEADERS).json()
+    assert info["num_files"] == len(info["files"]) == 2
+    assert info["num_files"] == sum(shard["num_files"] for shard in info["shards"].values())
+    assert info["filenames"] == ["marina"]
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import FakeLLM, make_documents
+from core import settings
+from services import ShardManager, check_filter
+
+
+@pytest.fixture
+def chat(embeddings, monkeypatch):
+    """A /chat client over two shards, "marina" and "desert", with stand-in LLMs (classifier: RAG)."""
+    import main
+    from routers import global_rag_chatbot, main_graph
+
+    shards = ShardManager()
+    asyncio.run(shards.service("marina").create_faiss_index(make_documents(
+        "marina.docx", ["Marina villas have a private beach and a sea view.",
+                        "Marina apartments start at five million."])))
+    asyncio.run(shards.service("desert").create_faiss_index(make_documents(
+        "desert.docx", ["Desert villas have a private pool and a garden.",
+                        "Desert chalets are delivered next year."])))
+    answer = FakeLLM("Here is what I found.")
+    monkeypatch.setattr(main_graph, "classifier_llm", FakeLLM("RAG"))
+    monkeypatch.setattr(global_rag_chatbot, "llm_refined_query", FakeLLM("villas"))
+    monkeypatch.setattr(global_rag_chatbot, "llm", answer)
+    monkeypatch.setattr(global_rag_chatbot, "shards", shards)
+    monkeypatch.setattr(global_rag_chatbot, "vector_store", shards.vector_store())
+    return TestClient(main.app), answer
+
+
+def ask(client, question, filters, user_id="filters-test"):
+    return client.post("/chat", headers={"app-api-key": settings.APP_API_KEY},
+                       json={"user_id": user_id, "input": question, "chat_history": [], "filters": filters})
+
+
+def test_shard_filter_searches_only_that_shard(chat):
+    client, answer = chat
+    response = ask(client, "Which villas are there?", {"shard": "desert"})
+    assert response.status_code == 200
+    assert response.json()["text"] == "Here is what I found."
+    prompt = answer.prompts[-1]
+    assert "Desert villas" in prompt
+    assert "Marina" not in prompt
+
+
+def test_shard_filter_combines_with_metadata_filters(chat):
+    client, answer = chat
+    response = ask(client, "Which villas are there?", {"shard": ["marina", "desert"], "source": "marina.docx"})
+    assert response.status_code == 200
+    assert "Marina villas" in answer.prompts[-1]
+    assert "Desert" not in answer.prompts[-1]
+
+
+def test_unknown_filter_field_is_rejected(chat):
+    client, answer = chat
+    response = ask(client, "Which villas are there?", {"shard": "desert", "colour": "blue"})
+    assert response.status_code == 400
+    assert "colour" in response.json()["detail"]
+    assert not answer.prompts
+
+
+def test_shard_is_only_a_filter_of_sharded_searches():
+    check_filter({"shard": "desert", "project": "marina"}, sharded=True)
+    with pytest.raises(ValueError):
+        check_filter({"shard": "desert"})
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import pytest
+
+from conftest import make_docx
+from routers import RAGChatbot
+from services import LocalDriveClient
+from services.drive_sync import plan_sync
+
+LINK = "https://drive.google.com/drive/folders/brochures"
+
+
+class Drive(LocalDriveClient):
+    """LocalDriveClient whose files can be listed under other names (Drive names repeat and change)."""
+    def __init__(self, root):
+        super().__init__(root)
+        self.names = {}
+
+    def list_files(self, folder_id):
+        files = super().list_files(folder_id)
+        for file in files:
+            file["name"] = self.names.get(file["id"], file["name"])
+        return files
+
+
+@pytest.fixture
+def drive(tmp_path):
+    os.makedirs(tmp_path / "drive" / "brochures")
+    return Drive(str(tmp_path / "drive"))
+
+
+def write(drive, name, *paragraphs):
+    return make_docx(os.path.join(drive.root, "brochures"), name, paragraphs)
+
+
+@pytest.fixture
+def chatbot(embeddings):
+    return RAGChatbot()
+
+
+def sync(chatbot, drive):
+    return asyncio.run(chatbot.sync_drive_folder(LINK, shard="drive", client=drive))
+
+
+def texts(chatbot, source):
+    store = chatbot.shards.store("drive")
+    entry = store.catalog.get(source)
+    if entry is None:
+        return []
+    return [doc.page_content for doc in store.chunk_store.get_many(
+        [row for start, end in entry["row_ranges"] for row in range(start, end)])]
+
+
+def test_sync_adds_changes_and_removes_files(chatbot, drive):
+    write(drive, "marina.docx", "Marina villas have a private beach.")
+    write(drive, "desert.docx", "Desert chalets have a private pool.")
+    result = sync(chatbot, drive)
+    assert result["added"] == 2 and result["index_version"] is not None
+    assert sorted(entry["source"] for entry in chatbot.shards.store("drive").catalog.sources()) == \
+        ["desert.docx", "marina.docx"]
+
+    write(drive, "marina.docx", "Marina villas now come with a marina berth.")
+    os.remove(os.path.join(drive.root, "brochures", "desert.docx"))
+    write(drive, "oasis.docx", "Oasis towers overlook the lake.")
+    result = sync(chatbot, drive)
+    assert {key: result[key] for key in ("added", "changed", "removed", "unchanged")} == \
+        {"added": 1, "changed": 1, "removed": 1, "unchanged": 0}
+    assert any("berth" in text for text in texts(chatbot, "marina.docx"))
+    assert texts(chatbot, "desert.docx") == []
+    assert texts(chatbot, "oasis.docx")
+
+    result = sync(chatbot, drive)
+    assert result["unchanged"] == 2 and result["added"] == result["changed"] == result["removed"] == 0
+
+
+def test_sync_moves_a_renamed_file_to_its_new_source(chatbot, drive):
+    write(drive, "prices.docx", "The price list of the marina phase.")
+    sync(chatbot, drive)
+    drive.names["brochures/prices.docx"] = "prices 2025.docx"
+    result = sync(chatbot, drive)
+    assert result["changed"] == 1
+    assert texts(chatbot, "prices.docx") == []
+    assert texts(chatbot, "prices 2025.docx")
+
+
+def test_files_of_the_same_name_keep_their_own_chunks(chatbot, drive):
+    write(drive, "a.docx", "Marina villas have a private beach.")
+    write(drive, "b.docx", "Desert chalets have a private pool.")
+    drive.names = {"brochures/a.docx": "brochure.docx", "brochures/b.docx": "brochure.docx"}
+    result = sync(chatbot, drive)
+    assert result["added"] == 2
+    sources = sorted(entry["source"] for entry in chatbot.shards.store("drive").catalog.sources())
+    assert sources == ["brochure.docx", "brochure.docx (brochures/b.docx)"]
+    assert any("Marina" in text for text in texts(chatbot, "brochure.docx"))
+    assert any("Desert" in text for text in texts(chatbot, "brochure.docx (brochures/b.docx)"))
+
+    # removing one of them leaves the other's chunks alone
+    os.remove(os.path.join(drive.root, "brochures", "a.docx"))
+    result = sync(chatbot, drive)
+    assert result["removed"] == 1 and result["unchanged"] == 1
+    assert texts(chatbot, "brochure.docx") == []
+    assert any("Desert" in text for text in texts(chatbot, "brochure.docx (brochures/b.docx)"))
+
+
+def test_a_name_with_a_slash_stays_in_the_download_directory(chatbot, drive):
+    write(drive, "escape.docx", "Marina villas have a private beach.")
+    drive.names["brochures/escape.docx"] = "../../escape.docx"
+    result = sync(chatbot, drive)
+    assert result["added"] == 1
+    assert texts(chatbot, "../../escape.docx")
+
+
+def test_plan_sync_separates_files_ingested_under_one_name():
+    # a manifest written when files were keyed by name: both copies are re-ingested under their own source
+    known = {"1": {"id": "1", "name": "x.docx", "md5Checksum": "a"},
+             "2": {"id": "2", "name": "x.docx", "md5Checksum": "b"}}
+    listing = [dict(file) for file in known.values()]
+    plan = plan_sync(known, listing)
+    assert [file["source"] for file in plan["changed"]] == ["x.docx", "x.docx (2)"]
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from services import EmbeddingService, HashEmbeddingBackend
+from services.embedding_cache import EmbeddingCache
+
+
+class RecordingBackend(HashEmbeddingBackend):
+    """HashEmbeddingBackend that records its calls; calls holding a "slow" text take `delay` seconds."""
+    def __init__(self, delay: float = 0.0):
+        super().__init__(32)
+        self.delay = delay
+        self.calls = []
+
+    async def embed(self, texts):
+        self.calls.append(list(texts))
+        if any(text.startswith("slow") for text in texts):
+            await asyncio.sleep(self.delay)
+        return await super().embed(texts)
+
+
+def test_concurrent_queries_are_coalesced():
+    backend = RecordingBackend()
+    service = EmbeddingService(backend)
+
+    async def queries():
+        return await asyncio.gather(*(service.aembed_query(f"villas in phase {i}") for i in range(40)))
+
+    vectors = asyncio.run(queries())
+    assert len(backend.calls) < 40
+    assert sorted(text for call in backend.calls for text in call) == sorted(f"villas in phase {i}" for i in range(40))
+    assert service.stats["queries"] == 40
+    for i, vector in enumerate(vectors):
+        np.testing.assert_allclose(vector, backend._vector(f"villas in phase {i}"), rtol=1e-6)
+    np.testing.assert_allclose(service.embed_query("villas in phase 3"), vectors[3], rtol=1e-6)
+
+
+def test_queries_do_not_wait_behind_document_batches():
+    backend = RecordingBackend(delay=0.2)
+    service = EmbeddingService(backend, max_batch_size=1, max_in_flight=1)
+
+    async def run():
+        backlog = asyncio.ensure_future(service.aembed_documents([f"slow chunk {i}" for i in range(5)]))
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        await service.aembed_query("quick question")
+        elapsed = time.perf_counter() - start
+        await backlog
+        return elapsed
+
+    assert asyncio.run(run()) < 0.15
+
+
+def test_provided_vectors_are_used_once_without_a_call():
+    backend = RecordingBackend()
+    service = EmbeddingService(backend)
+    pooled = np.ones(32, dtype="float32") / np.sqrt(32)
+    service.provide(["pooled chunk"], [pooled])
+    assert service.embed_documents(["pooled chunk"]) == [pooled.tolist()]
+    assert backend.calls == [] and service.stats["provided"] == 1
+    # used once: the next request embeds it
+    service.embed_documents(["pooled chunk"])
+    assert backend.calls == [["pooled chunk"]]
+
+
+def test_provided_vectors_survive_concurrent_threads():
+    service = EmbeddingService(RecordingBackend())
+    vector = np.ones(32, dtype="float32")
+    errors = []
+
+    def provide(worker):
+        try:
+            for i in range(300):
+                texts = [f"chunk {worker} {i} {j}" for j in range(8)]
+                service.provide(texts, [vector] * len(texts))
+                service.embed_documents(texts[:4])
+                service.withdraw(texts[4:])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=provide, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(service._provided) == 0
+    assert service.stats["provided"] == 4 * 300 * 4
+
+
+def test_the_cache_is_reused_by_a_later_build(tmp_path):
+    texts = [f"Marina villas, unit {i}." for i in range(10)]
+    first = RecordingBackend()
+    vectors = EmbeddingService(first, cache=EmbeddingCache(str(tmp_path / "cache"), first.model)).embed_documents(texts)
+    assert first.calls
+
+    # another process: a new service over the same cache directory
+    backend = RecordingBackend()
+    service = EmbeddingService(backend, cache=EmbeddingCache(str(tmp_path / "cache"), backend.model))
+    # the key ignores whitespace differences
+    assert service.embed_documents(texts[:5] + [f"  Marina villas,\tunit {i}." for i in range(5, 10)]) == vectors
+    assert backend.calls == [] and service.stats["cache_hits"] == 10
+
+    # queries are neither read from nor written to the cache
+    service.embed_query(texts[0])
+    assert backend.calls == [[texts[0]]]
+    service.embed_documents(["Desert chalets."])
+    assert backend.calls[-1] == ["Desert chalets."]
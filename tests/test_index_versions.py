@@ -0,0 +1,42 @@
+import asyncio
+
+from conftest import make_documents
+from services import FAISSIndexService
+
+
+def build(service, *texts):
+    return asyncio.run(service.create_faiss_index(make_documents("marina.docx", texts)))
+
+
+def search(store, query):
+    return [doc.page_content for doc in store.similarity_search(query, 1)]
+
+
+def test_a_rebuild_is_activated_and_can_be_rolled_back(embeddings):
+    service = FAISSIndexService("marina")
+    build(service, "Marina villas have a private beach.")
+    first = service.versions.current()
+    build(service, "Marina villas now come with a marina berth.")
+    second = service.versions.current()
+    assert first != second
+    assert service.list_versions() == [{"version": first, "active": False}, {"version": second, "active": True}]
+
+    store = service.rollback()
+    assert service.versions.current() == first
+    assert search(store, "Marina villas") == ["Marina villas have a private beach."]
+    assert service.list_versions() == [{"version": first, "active": True}, {"version": second, "active": False}]
+
+    # a process starting now loads the rolled-back version
+    assert search(FAISSIndexService("marina").load_index(), "Marina villas") == ["Marina villas have a private beach."]
+
+    store = service.rollback(second)
+    assert search(store, "Marina villas") == ["Marina villas now come with a marina berth."]
+
+
+def test_an_empty_build_leaves_the_active_version_alone(embeddings):
+    service = FAISSIndexService("marina")
+    build(service, "Marina villas have a private beach.")
+    active = service.versions.current()
+    assert build(service) is None
+    assert service.versions.current() == active
+    assert [version["version"] for version in service.list_versions()] == [active]
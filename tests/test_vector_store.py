@@ -0,0 +1,112 @@
+import pytest
+
+from services import FAISSVectorStore, StoreWriterError
+
+
+def build_store(path, embeddings, sources, attributes=None):
+    """A store over {source: [texts]}, with the {source: {attribute: value}} of each source."""
+    texts, metadatas = [], []
+    for source, source_texts in sources.items():
+        texts += source_texts
+        metadatas += [{"source": source, "filename": source.split(".")[0], **(attributes or {}).get(source, {})}
+                      for _ in source_texts]
+    return FAISSVectorStore.create(str(path), embeddings, texts, embeddings.embed_documents(texts), metadatas)
+
+
+def search(store, query, k=4, filter=None):
+    return [doc.page_content for doc in store.similarity_search(query, k, filter)]
+
+
+def test_only_one_process_writes_a_store(tmp_path, embeddings):
+    store = build_store(tmp_path / "store", embeddings, {"marina.docx": ["Marina villas with a beach."]})
+    # another open file description of the WRITER file stands in for another process
+    other = FAISSVectorStore.load_local(store.folder_path, embeddings)
+    with pytest.raises(StoreWriterError):
+        other.add_texts(["Desert villas."], [{"source": "desert.docx", "filename": "desert"}])
+    with pytest.raises(StoreWriterError):
+        other.delete_source("marina.docx")
+    # searching needs no lock
+    assert search(other, "Marina villas", k=1) == ["Marina villas with a beach."]
+
+    store.close()
+    other.add_texts(["Desert villas."], [{"source": "desert.docx", "filename": "desert"}])
+    assert other.catalog.get("desert.docx")["chunk_count"] == 1
+
+
+@pytest.fixture
+def brochures(tmp_path, embeddings):
+    return build_store(tmp_path / "store", embeddings, {
+        "marina.docx": ["Villas with a private beach.", "Apartments near the beach."],
+        "marina_ar.docx": ["Villas with a private beach, in Arabic."],
+        "desert.docx": ["Villas with a private pool.", "Chalets near the pool."],
+    }, {
+        "marina.docx": {"project": "marina", "language": "en"},
+        "marina_ar.docx": {"project": "marina", "language": "ar"},
+        "desert.docx": {"project": "desert", "language": "en"},
+    })
+
+
+def test_filtered_search_only_returns_matching_rows(brochures):
+    assert sorted(search(brochures, "villas", 10, {"project": "desert"})) == \
+        ["Chalets near the pool.", "Villas with a private pool."]
+    # values of one field are OR-ed, fields are AND-ed
+    assert sorted(search(brochures, "villas", 10, {"project": ["marina", "desert"], "language": "ar"})) == \
+        ["Villas with a private beach, in Arabic."]
+    assert search(brochures, "villas", 10, {"source": "missing.docx"}) == []
+
+
+def test_filtered_search_skips_deleted_rows(brochures):
+    brochures.delete_source("marina_ar.docx")
+    assert sorted(search(brochures, "villas", 10, {"project": "marina"})) == \
+        ["Apartments near the beach.", "Villas with a private beach."]
+
+
+def test_unknown_filter_field_is_rejected(brochures):
+    with pytest.raises(ValueError):
+        search(brochures, "villas", 4, {"colour": "blue"})
+
+
+@pytest.fixture
+def no_background_compaction(monkeypatch):
+    from core import settings
+    monkeypatch.setattr(settings, "FAISS_MAX_DELTA_SEGMENTS", 1000)
+    monkeypatch.setattr(settings, "FAISS_MAX_DELETED_FRACTION", 1.0)
+
+
+def test_a_deleted_source_can_be_added_again(brochures, embeddings, no_background_compaction):
+    assert brochures.delete_source("marina.docx") == 2
+    assert brochures.delete_source("marina.docx") == 0
+    assert brochures.catalog.get("marina.docx") is None
+    assert search(brochures, "villas", 10, {"source": "marina.docx"}) == []
+
+    brochures.add_texts(["Marina villas, phase two."], [{"source": "marina.docx", "filename": "marina"}])
+    assert brochures.catalog.get("marina.docx")["chunk_count"] == 1
+    assert search(brochures, "villas", 10, {"source": "marina.docx"}) == ["Marina villas, phase two."]
+
+    # an upsert replaces the chunks of the source, and the change survives a reload
+    brochures.upsert_embeddings("marina.docx", ["Marina villas, phase three."],
+                                embeddings.embed_documents(["Marina villas, phase three."]),
+                                [{"source": "marina.docx", "filename": "marina"}])
+    brochures.close()
+    reloaded = FAISSVectorStore.load_local(brochures.folder_path, embeddings)
+    assert reloaded.catalog.get("marina.docx")["chunk_count"] == 1
+    assert search(reloaded, "villas", 10, {"source": "marina.docx"}) == ["Marina villas, phase three."]
+
+
+def test_compaction_merges_the_deltas_and_drops_deleted_rows(brochures, embeddings, no_background_compaction):
+    for i in range(3):
+        brochures.add_texts([f"Oasis towers, block {i}."], [{"source": f"oasis_{i}.docx", "filename": f"oasis_{i}"}])
+    brochures.delete_source("desert.docx")
+    assert len(brochures.segments) == 4
+    assert brochures.deleted_rows == 2
+
+    brochures.compact()
+    assert len(brochures.segments) == 1 and brochures.segments[0].base
+    assert brochures.ntotal == 6
+    assert brochures.deleted_rows == 0
+
+    brochures.close()
+    reloaded = FAISSVectorStore.load_local(brochures.folder_path, embeddings)
+    assert len(reloaded.segments) == 1 and reloaded.ntotal == 6
+    assert search(reloaded, "Oasis towers, block 1.", k=1) == ["Oasis towers, block 1."]
+    assert search(reloaded, "villas", 10, {"source": "desert.docx"}) == []